@@ -28,10 +28,28 @@ A permissions allowance is required to run commands that bridge to the CM from t
 
 import os
 import sys
+import re
+import hashlib
+import heapq
+import tempfile
+import itertools
+import statistics
 import subprocess
 import argparse
 import base64
 import configparser
+import array
+import operator
+import sqlite3
+import zipfile
+import io
+import socket
+import select
+import time
+import ipaddress
+import threading
+import concurrent.futures
+import http.server
 
 # global set by arguments
 use_raw_output = False
@@ -51,6 +69,24 @@ notimp = "Not Implemented"
 completion_code_idx = 6  # 6th byte in the response is the completion code
 CMLogOffsetIncrement = 64
 CMLogMaxLines = 999
+# a bridged request is one IPMB message of at most 32 bytes, 7 of them are the rsSA, netFn/LUN, checksum,
+# rqSA, rqSeq/LUN, cmd and the final checksum, the rest are the data bytes of the command
+IpmbMaxMessageBytes = 32
+IpmbMaxDataBytes = IpmbMaxMessageBytes - 7
+# Set Config data is the ConfigStructVersion and number of properties, then the ID and value bytes
+ConfigBatchMaxBytes = IpmbMaxDataBytes - 2
+
+# used by the fleet commands that run against many iDRACs at once
+fleet_threads = 32   # default number of concurrent ipmitool sessions
+ipmi_target = threading.local()  # per-thread host that overrides --host in call_ipmitool
+
+# RMCP packets sent to UDP port 623 by the Discover command
+rmcp_port = 623
+# ASF Presence Ping: RMCP header (ver 6, seq 0xff, class ASF) + ASF IANA 4542, type 0x80, tag, len 0
+rmcp_presence_ping = bytes([0x06, 0x00, 0xff, 0x06, 0x00, 0x00, 0x11, 0xbe, 0x80, 0x00, 0x00, 0x00])
+# IPMI 1.5 session-less Get Channel Authentication Capabilities, channel 0x0e (this one) + IPMI v2 bit, admin priv
+rmcp_get_chan_auth_cap = bytes([0x06, 0x00, 0xff, 0x07, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x09,
+                                0x20, 0x18, 0xc8, 0x81, 0x00, 0x38, 0x8e, 0x04, 0xb5])
 
 # used to identify supported Chassis
 CMBoardPN = {
@@ -219,8 +255,101 @@ class CMFRUSet:
         self.default = default 
         if len > 1:
             self.datatype = 'str'
+
+class RingBuffer:
+    """A fixed-size history of timestamped samples, the oldest sample is overwritten when full"""
     
+    def __init__(self, size):
+        self.size = size
+        self.times = array.array('d', [0.0]) * size
+        self.values = array.array('d', [0.0]) * size
+        self.count = 0  # total samples ever added
+        
+    def append(self, when, value):
+        idx = self.count % self.size
+        self.times[idx] = when
+        self.values[idx] = value
+        self.count += 1
+        
+    def last(self):
+        if (self.count == 0):
+            return None
+        return self.values[(self.count - 1) % self.size]
+        
+    def recent(self, n):
+        """Return up to n of the newest (time, value) samples, oldest first"""
+        n = min(n, self.count, self.size)
+        return [(self.times[i % self.size], self.values[i % self.size]) for i in range(self.count - n, self.count)]
+        
+    def window_stats(self, seconds, now):
+        """Return (min, max, avg, samples) of the samples newer than now - seconds, or None if there are none"""
+        start = now - seconds
+        minval = maxval = None
+        total = 0.0
+        samples = 0
+        for i in range(self.count - 1, max(self.count - self.size, 0) - 1, -1):
+            idx = i % self.size
+            if (self.times[idx] < start):
+                break  # samples are in time order, the rest are older
+            value = self.values[idx]
+            if ((minval is None) or (value < minval)):
+                minval = value
+            if ((maxval is None) or (value > maxval)):
+                maxval = value
+            total += value
+            samples += 1
+        if (samples == 0):
+            return None
+        return minval, maxval, total / samples, samples
+
  
+class CountMinSketch:
+    """Approximate counts of any number of keys in fixed memory, a count is never under the true count"""
+    
+    def __init__(self, width=16384, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array.array('q', [0]) * width for i in range(depth)]
+        
+    def add(self, key, count=1):
+        """Add count to key and return its new estimate"""
+        estimate = None
+        for i, row in enumerate(self.rows):
+            idx = hash((i, key)) % self.width
+            row[idx] += count
+            if ((estimate is None) or (row[idx] < estimate)):
+                estimate = row[idx]
+        return estimate
+        
+    def estimate(self, key):
+        return min(row[hash((i, key)) % self.width] for i, row in enumerate(self.rows))
+
+class TopCounter:
+    """The keys with the highest counts, keeps at most size candidates"""
+    
+    def __init__(self, size):
+        self.size = size
+        self.counts = {}
+        self.heap = []  # (count, key), may hold old counts for a key
+        
+    def update(self, key, count):
+        if ((key not in self.counts) and (len(self.counts) >= self.size)):
+            # drop the smallest candidate if the new key beats it
+            while (self.heap[0][0] != self.counts.get(self.heap[0][1])):
+                heapq.heappop(self.heap)
+            if (count <= self.heap[0][0]):
+                return
+            del self.counts[heapq.heappop(self.heap)[1]]
+        self.counts[key] = count
+        heapq.heappush(self.heap, (count, key))
+        if (len(self.heap) > 4 * self.size):
+            self.heap = [(count, key) for key, count in self.counts.items()]
+            heapq.heapify(self.heap)
+            
+    def top(self, n):
+        """Return up to n (key, count) pairs, highest count first"""
+        return heapq.nlargest(n, self.counts.items(), key=operator.itemgetter(1))
+
 # enumeration dictionaries used for displaying human-readable output
 
 # These may be used by all platforms to interpret GetConfig and GetVersion output
@@ -417,7 +546,7 @@ CMDeviceIDInfo = {
 CMValidConfigSettings = {
     '1': {'>=70': range(1,30)},
     '2': {'*': range(1,30)},
-    '3': {'*': range(1,30)},
+    '3': {'<23': range(1,30), '>=23': range(1,31)},  # CableAmpLimit added in v3.23
 }
 
 CMValidHiddenConfigSettings = {
@@ -704,7 +833,22 @@ def CMGetSensorInfo(args):
     return output
 
 
+# Board PN and Rev read from each target, so the Set commands don't probe it again for every property
+boardpn_cache = {}
+
+# the host that call_ipmitool will send the next command to
+def CurrentTarget():
+    target = getattr(ipmi_target, 'host', None)
+    if (target):
+        return target
+    if (args.wmi):
+        return 'wmi'
+    return args.host
+
 def BoardPNAndRev():
+    cached = boardpn_cache.get(CurrentTarget(), None)
+    if (cached):
+        return cached
     boardpn = ""
     boardrev = ""
     boardpndata = call_ipmitool("{} 0x11 0x0 0xaa 0x0 0x09 {}".format(log_preamble, ending))
@@ -716,9 +860,116 @@ def BoardPNAndRev():
         boardpn += chr(int(ch, 16))
     for ch in databytes [15:-1]:
         boardrev += chr(int(ch, 16))
-        
+
+    if (boardpn.strip()):
+        boardpn_cache[CurrentTarget()] = (boardpn.strip(), boardrev.strip())
     return boardpn.strip(), boardrev.strip()
 
+# CM FW version and the ranges of supported property ids for each target:
+# target: (major, minor, config ids, hidden ids)
+capability_cache = {}
+
+# the operators used in the minor version keys of CMValidConfigSettings, longest first
+MinorVersionOps = [('>=', operator.ge), ('<=', operator.le), ('>', operator.gt), ('<', operator.lt), ('==', operator.eq)]
+
+def ResolveValidIds(ValidSettings, major, minor):
+    """Return the range of valid property ids for the CM version, or None if the version is not in the table"""
+    for minorspec, ids in ValidSettings.get(str(major), {}).items():
+        if (minorspec == '*'):
+            return ids
+        for opname, op in MinorVersionOps:
+            if (minorspec.startswith(opname)):
+                if (op(minor, int(minorspec[len(opname):]))):
+                    return ids
+                break
+    return None
+
+# Read the CM FW version once per target and resolve the config and hidden config ids it supports.
+# Returns None if the version can't be read.
+def GetCMCapabilities():
+    target = CurrentTarget()
+    cached = capability_cache.get(target, None)
+    if (cached):
+        return cached
+    stdout = call_ipmitool('0x30 0x12')
+    outbytes = stdout.split()
+    if (len(outbytes) < 5):
+        return None
+    # CM FW Version is bytes 3 and 4 of Get Chassis Configuration, see CMConfigInfo
+    major = int(outbytes[3], 16)
+    minor = int(outbytes[4], 16)
+    capabilities = (major, minor, ResolveValidIds(CMValidConfigSettings, major, minor),
+                    ResolveValidIds(CMValidHiddenConfigSettings, major, minor))
+    verbose("CM FW {}.{} config ids {} hidden ids {}".format(*capabilities))
+    capability_cache[target] = capabilities
+    return capabilities
+
+# The property ids the CM FW of the current target supports, or None if they aren't known
+def SupportedIds(hidden=False):
+    capabilities = GetCMCapabilities()
+    if (not capabilities):
+        return None
+    return capabilities[3] if hidden else capabilities[2]
+
+# Return the properties in the list that the CM FW version of the current target doesn't support.
+# hidden selects the Hidden Config ids.  Nothing is filtered if the version isn't in the tables.
+def UnsupportedProperties(properties, hidden=False):
+    validids = SupportedIds(hidden)
+    if (validids is None):
+        return []
+    return [property for property in properties if (int(property.id, 16) not in validids)]
+
+def UnsupportedMessage(properties):
+    major, minor = GetCMCapabilities()[:2]
+    return "Not supported by CM FW version {}.{}: {}".format(major, minor, ', '.join(property.name for property in properties))
+
+# Return the value of a property from its bytes in a Get Config or Get Hidden Config response
+def DecodeConfigValue(setting, valuebytes, ini_output):
+    if (setting.len == 1):
+        numvalue = int(valuebytes[0], 16)
+    elif (setting.len == 2):
+        # LSB is first in all of these
+        numvalue = int(valuebytes[0], 16) + int(valuebytes[1], 16) * 0x100
+    elif (setting.len == 8):
+        # must be svctag, therefore string
+        val = ""
+        for offset in range(0,7): # 8th byte is a 00
+            val += bytes.fromhex(valuebytes[offset]).decode('ascii')
+        return val.strip().strip('\0')
+    else:
+        return ""
+    if (ini_output):
+        return numvalue
+    return setting.get_enum_val(numvalue)
+
+# Walk the id/value pairs of a Get Config or Get Hidden Config response.  The CM returns the ids its FW
+# supports, which don't have to be 1 to count, so each id is looked up instead of counted.
+# Only the ids in validids are returned, all of them if it's None.
+# Returns a list of (setting, value) and an error message, or "" if the whole response was decoded.
+def DecodeConfigPairs(outbytes, settings, validids, ini_output):
+    pairs = []
+    settingscount = int(outbytes[8], 16)
+    position = 9  # byte after the number of properties
+    for count in range(settingscount):
+        if (position >= len(outbytes)):
+            return pairs, "---Response ended after {} of {} properties".format(count, settingscount)
+        id = int(outbytes[position], 16)
+        setting = settings.get(id, None)
+        if (setting is None):
+            # the length of an unknown id isn't known so nothing after it can be decoded
+            return pairs, "---Unknown property id {} at position {}".format(id, position)
+        if (position + 1 + setting.len > len(outbytes)):
+            # cut off in the middle of the value
+            return pairs, "---Response ended after {} of {} properties".format(count, settingscount)
+        position += 1  # increment past the ID byte
+        value = DecodeConfigValue(setting, outbytes[position:position + setting.len], ini_output)
+        position += setting.len
+        if ((validids is None) or (id in validids)):
+            pairs.append((setting, value))
+        else:
+            verbose("Skipping {} (id {}), not supported by this CM FW version".format(setting.name, id))
+    return pairs, ""
+
 def GetSptChassisByPN(boardpn):
     for platform in CMBoardPN.keys():
         if (boardpn in CMBoardPN[platform]):
@@ -735,7 +986,7 @@ def CMGetConfig(args, ini_output=False):
     progressstring = "Getting Configuration Properties"
     SptChassis = ""
     
-    print(progressstring, end='\r')
+    progress(progressstring, end='\r')
     verbose("Chassis Board PN = {}, rev = {}".format(boardpn, boardrev))
     SptChassis = GetSptChassisByPN(boardpn)
     if (SptChassis == ""):
@@ -748,7 +999,7 @@ def CMGetConfig(args, ini_output=False):
     # get all the config items, don't care about the args
     stdout = call_ipmitool("{} 0xa0 0x0 0xff {}".format(config_preamble, ending))
     
-    print(progressstring + '.', end='\r')
+    progress(progressstring + '.', end='\r')
     if (use_raw_output):
         return stdout
 
@@ -761,49 +1012,19 @@ def CMGetConfig(args, ini_output=False):
     completion = CMConfigCompCodes.get(outbytes[completion_code_idx], 'Unknown response')
     if (not (completion == 'Success')):
         return "Unsuccessful reponse: {} = {} ".format(outbytes[completion_code_idx], completion)
-    print(progressstring + '..', end='\r')
+    progress(progressstring + '..', end='\r')
     # now parse the config data
     if (ini_output):
         output = "[ConfigProperties]\n"
         output += "Board PN = {}\nPlatform Name = {}\n".format(boardpn, platname)
     else:
         output = "CM Config Properties: Board PN {} Platform Name {}\n".format(boardpn, platname)
-    settingscount = int(outbytes[8], 16)
-    position = 9  # byte after the number of properties
-    for id in range(1, settingscount + 1):
-        if (id != int(outbytes[position], 16)):
-            print("---IDs not aligned at position {}".format(position))
-            break
-        else:
-            position += 1  # increment past the ID byte
-            if (CMConfigSettings[id].len == 1):
-                numvalue = int(outbytes[position], 16)
-                if (ini_output):
-                    value = numvalue
-                else:
-                    value = CMConfigSettings[id].get_enum_val(numvalue)
-            elif (CMConfigSettings[id].len == 2):
-                # LSB is first in all of these
-                numvalue = int(outbytes[position], 16) + int(outbytes[position+1], 16) * 0x100
-                if (ini_output):
-                    value = numvalue
-                else:
-                    value = CMConfigSettings[id].get_enum_val(numvalue)
-            elif (CMConfigSettings[id].len == 8):
-                # must be svctag, therefore string
-                val = ""
-                value = ""
-                for offset in range(0,7): # 8th byte is a 00
-                    val += bytes.fromhex(outbytes[position+offset]).decode('ascii')
-                value = val.strip().strip('\0')
-            else:
-                value = ""
-            #end if
-            position += CMConfigSettings[id].len
-            output += "{:22} = {:8}\n".format(CMConfigSettings[id].name, value)
-        #end if
-    #end for
-    print(progressstring + '...')
+    pairs, error = DecodeConfigPairs(outbytes, CMConfigSettings, SupportedIds(), ini_output)
+    if (error):
+        print(error)
+    for setting, value in pairs:
+        output += "{:22} = {:8}\n".format(setting.name, value)
+    progress(progressstring + '...')
     return output
     
 def CMGetDeviceId(args):
@@ -892,7 +1113,7 @@ def CMGetPasscode(arglist):
     return output
     
 # Get ALL hidden config values
-def CMGetHiddenConfig(arglist):
+def CMGetHiddenConfig(arglist, ini_output=False):
     cmdhelp = CMCommandHelpDetailed['GetHiddenConfig'.lower()]
     key = ""
     passcode = ""
@@ -950,29 +1171,15 @@ def CMGetHiddenConfig(arglist):
         return "Unsuccessful reponse: {} = {} ".format(outbytes[completion_code_idx], completion)
     
     # now parse the config data
-    output = "CM Hidden Config Settings:\n"
-    settingscount = int(outbytes[8], 16)
-    position = 9  # byte after the number of properties
-    for id in range(1, settingscount + 1):
-        if (id != int(outbytes[position], 16)):
-            print("---IDs not aligned at position {}".format(position))
-            break
-        else:
-            position += 1  # increment past the ID byte
-            if (CMHiddenSettings[id].len == 1):
-                numvalue = int(outbytes[position], 16)
-                value = CMHiddenSettings[id].get_enum_val(numvalue)
-            elif (CMHiddenSettings[id].len == 2):
-                # LSB is first in all of these
-                numvalue = int(outbytes[position], 16) + int(outbytes[position+1], 16) * 0x100
-                value = CMHiddenSettings[id].get_enum_val(numvalue)
-            else:
-                value = ""
-            #end if
-            position += CMHiddenSettings[id].len
-            output += "{:22} = {:8}\n".format(CMHiddenSettings[id].name, value)
-        #end if
-    #end for
+    if (ini_output):
+        output = "[HiddenConfigProperties]\n"
+    else:
+        output = "CM Hidden Config Settings:\n"
+    pairs, error = DecodeConfigPairs(outbytes, CMHiddenSettings, SupportedIds(hidden=True), ini_output)
+    if (error):
+        print(error)
+    for setting, value in pairs:
+        output += "{:22} = {:8}\n".format(setting.name, value)
     return output
 
 def CMGetLog(arglist):
@@ -995,17 +1202,10 @@ def CMGetLog(arglist):
                 print(cmdhelp)
                 return ""
     
-    #result = []
-    # get the number of 64-byte log blocks
-    stdout = call_ipmitool("{} 0x10 0x1 0xff".format(log_preamble))
-    if (len(stdout) == 0):
+    log_cnt = CMLogByteCount()
+    if (log_cnt < 0):
         # bad connection, message in stderr
         return "Ipmitool Error.  Verify HOST, user, and password are correct"
-    
-    log_cnt = (int((stdout[25:27]) + (stdout[22:24]),16))
-    if ((log_cnt / CMLogOffsetIncrement) >= CMLogMaxLines):
-        log_cnt -= CMLogOffsetIncrement   # subtract one line to suppress the beginning of the circular log if the log is full
-    verbose("Got {} log bytes, {} lines of {} bytes.".format(log_cnt, log_cnt / CMLogOffsetIncrement, CMLogOffsetIncrement))
     if (tail):
         offset = log_cnt - tail
         
@@ -1014,6 +1214,31 @@ def CMGetLog(arglist):
         print("Writing CM Log to {} Starting from offset byte {}.".format(outfilename, offset))
         outfile = open(outfilename, 'w+')
         
+    for offset, ascii_string in CMLogBlocks(offset, log_cnt):
+        #output to console
+        print (ascii_string)
+        if (outfile):
+            outfile.write(ascii_string + '\n')
+    
+    if (outfile):
+        outfile.close()
+        
+    return ""
+
+# get the number of bytes in the CM log (64-byte blocks), -1 if ipmitool failed
+def CMLogByteCount():
+    stdout = call_ipmitool("{} 0x10 0x1 0xff".format(log_preamble))
+    if (len(stdout) == 0):
+        return -1
+    
+    log_cnt = (int((stdout[25:27]) + (stdout[22:24]),16))
+    if ((log_cnt / CMLogOffsetIncrement) >= CMLogMaxLines):
+        log_cnt -= CMLogOffsetIncrement   # subtract one line to suppress the beginning of the circular log if the log is full
+    verbose("Got {} log bytes, {} lines of {} bytes.".format(log_cnt, log_cnt / CMLogOffsetIncrement, CMLogOffsetIncrement))
+    return log_cnt
+
+# generator of (byte offset, text) for each block of the CM log from offset to log_cnt
+def CMLogBlocks(offset, log_cnt):
     while (offset < log_cnt):
         offsetlsb = "0x" + (format(offset,'04x'))[2:]
         offsetmsb = "0x" + str(format(offset,'04x'))[:-2]  # make sure it comes out as string
@@ -1027,35 +1252,136 @@ def CMGetLog(arglist):
         line2 = line1.replace('n','').replace('\\','').replace("'",'').upper()
         line3 = line2[16:-2]   # cut out header and tailer bytes, just data is left
         ascii_string = str(base64.b16decode(line3))[2:-1]
-        
-        #output to console
-        print (ascii_string)
-        if (outfile):
-            outfile.write(ascii_string + '\n')
+        yield offset, ascii_string
         offset += CMLogOffsetIncrement
-    
-    if (outfile):
-        outfile.close()
-        
-    return ""
+
+ParseLogLeadBytes = '0x00 0x40'
+ParseLogBufferBytes = 1024 * 1024
+ParseLogWriteBatch = 512
 
 # used by the ParseLog funbction to process the data from string containing 0xXX bytes to actual ASCII data
-def ParseLogLine(line):
+# returns None if the section can't be converted
+def DecodeLogSection(section):
     # need to cut off the first 2 bytes which is just the number of bytes returned
-    leadbytes = '0x00 0x40'
-    firstcut = line.find(leadbytes)
-    if (firstcut > -1):
-        firstcut = len(leadbytes)
-    # take the slice after and remove '0x' from all
-    dataline = line[(firstcut+1):].replace('0x','')
+    if (ParseLogLeadBytes in section):
+        section = section[(len(ParseLogLeadBytes)+1):]
     try:
-        output = bytes.fromhex(dataline).decode()
-        print(output)
+        return bytes.fromhex(section.replace('0x','')).decode()
     except:
-        print("can't process this line to ascii")
-        return ""
-    return output + '\n'
+        return None
+
+# generator of the hex data sections in a CMLogs.log file, one per response, or None where a comm error dropped one
+def LogSections(logfile):
+    section = []
+    for line in logfile:
+        # build a section with the lines up to the one that is only '\n'
+        if (line.startswith(('Sending', 'Sent', 'Response', 'Data'))):
+            section = []
+        elif (line.startswith('scbmctestfunc: Error')):
+            yield None
+            section = []
+        elif (line != '\n'):
+            section.append(line.strip())
+        elif (section):
+            yield ' '.join(section)
+            section = []
+    if (section):
+        yield ' '.join(section)
+
+# generator of the readable log lines in a CMLogs.log file, failed is a one item list counting the sections that didn't decode
+def ParseLogLines(logfile, failed):
+    for section in LogSections(logfile):
+        if (section is None):
+            yield 'Line missing due to comm error\n'
+            continue
+        output = DecodeLogSection(section)
+        if (output is None):
+            failed[0] += 1
+            continue
+        yield output + '\n'
+
+# write the lines from a generator in batches
+def WriteLines(outfile, lines):
+    count = 0
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if (len(batch) >= ParseLogWriteBatch):
+            outfile.write(''.join(batch))
+            count += len(batch)
+            batch = []
+    if (batch):
+        outfile.write(''.join(batch))
+        count += len(batch)
+    return count
         
+TSRLogName = 'cmlogs.log'
+
+# generator of (member path, text stream) for each CM log in a TSR zip, including the ones in nested zip archives
+def TSRLogMembers(archive, prefix=""):
+    for info in archive.infolist():
+        name = info.filename
+        basename = name.rsplit('/', 1)[-1].lower()
+        if (basename == TSRLogName):
+            with archive.open(info) as member:
+                yield prefix + name, io.TextIOWrapper(member, errors='replace')
+        elif (basename.endswith('.zip')):
+            try:
+                nested = zipfile.ZipFile(io.BytesIO(archive.read(info)))
+            except zipfile.BadZipFile:
+                verbose("Skipping {}{}, it isn't a zip archive".format(prefix, name))
+                continue
+            with nested:
+                yield from TSRLogMembers(nested, prefix + name + '/')
+
+# parse every CM log in an open TSR zip to outfile, returns the number of logs and lines
+def ParseTSR(archive, outfile, failed):
+    logs = 0
+    count = 0
+    for name, logfile in TSRLogMembers(archive):
+        verbose("Parsing {}".format(name))
+        logs += 1
+        count += WriteLines(outfile, ParseLogLines(logfile, failed))
+    return logs, count
+
+# process pool worker for a directory of TSRs, returns (tsr filename, logs, lines, failed sections, error)
+def ParseTSRToFile(tsrfilename, outfilename):
+    failed = [0]
+    try:
+        with zipfile.ZipFile(tsrfilename) as archive:
+            with open(outfilename, 'w', buffering=ParseLogBufferBytes) as outfile:
+                logs, count = ParseTSR(archive, outfile, failed)
+    except (OSError, zipfile.BadZipFile) as err:
+        return (tsrfilename, 0, 0, 0, str(err))
+    if (not logs):
+        os.remove(outfilename)
+    return (tsrfilename, logs, count, failed[0], "")
+
+def ParseTSRDirectory(tsrdir, outdir, processes):
+    tsrfilenames = sorted(os.path.join(tsrdir, name) for name in os.listdir(tsrdir) if name.lower().endswith('.zip'))
+    if (not tsrfilenames):
+        return "No TSR zip files were found in {}".format(tsrdir)
+    if (not outdir):
+        outdir = tsrdir
+    try:
+        os.makedirs(outdir, exist_ok=True)
+    except OSError:
+        return "Unable to create output directory {}".format(outdir)
+    outfilenames = [os.path.join(outdir, os.path.splitext(os.path.basename(name))[0] + '_CMLogs.txt') for name in tsrfilenames]
+
+    output = "{:40} {:>5} {:>9} {:>7}  {}\n".format('TSR', 'Logs', 'Lines', 'Failed', 'Output')
+    nologs = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        for (tsrfilename, logs, count, failed, error), outfilename in zip(executor.map(ParseTSRToFile, tsrfilenames, outfilenames), outfilenames):
+            if (error):
+                outfilename = error
+            elif (not logs):
+                nologs += 1
+                outfilename = "no CM log found"
+            output += "{:40} {:>5} {:>9} {:>7}  {}\n".format(os.path.basename(tsrfilename), logs, count, failed, outfilename)
+    output += "{} TSRs processed, {} without a CM log.".format(len(tsrfilenames), nologs)
+    return output
+
 def CMParseLog(arglist):
     cmdhelp = CMCommandHelpDetailed['ParseLog'.lower()]
     logfile = None
@@ -1063,6 +1389,8 @@ def CMParseLog(arglist):
     errmsg = ""
     outfilename = ""
     logfilename = ""
+    tsrname = ""
+    processes = None
     if (arglist and (len(arglist) >= 1)):
         for arg in arglist:
             if ('logfile=' in arg):
@@ -1071,55 +1399,615 @@ def CMParseLog(arglist):
             elif ('outfile=' in arg):
                 value = arg.split('=')[1]
                 outfilename = value
+            elif ('tsr=' in arg):
+                value = arg.split('=')[1]
+                tsrname = value
+            elif ('processes=' in arg):
+                value = arg.split('=')[1]
+                try:
+                    processes = int(value)
+                except:
+                    return "The processes value must be an integer."
+                if (processes < 1):
+                    return "The processes value must be at least 1."
             else:
                 print("Invalid Argument: {}".format(arg.split('=')[0]))
                 print(cmdhelp)
                 return ""
-                
-    if (logfilename):
+
+    if (tsrname and os.path.isdir(tsrname)):
+        return ParseTSRDirectory(tsrname, outfilename, processes)
+    if (tsrname):
+        try:
+            logfile = zipfile.ZipFile(tsrname)
+        except (OSError, zipfile.BadZipFile):
+            print("Unable to open TSR {} as a zip file.".format(tsrname))
+            return ""
+    elif (logfilename):
         try:
-            logfile = open(logfilename, 'r')
+            logfile = open(logfilename, 'r', buffering=ParseLogBufferBytes)
         except:
             print("Unable to open logfile {} for reading.".format(logfilename))
             return ""
     else:
-        print("The logfile parameter is required for this command.")
+        print("The logfile or tsr parameter is required for this command.")
         return ""
     
     if (outfilename):
         try:
-            outfile = open(outfilename,  'w+')
+            outfile = open(outfilename,  'w+', buffering=ParseLogBufferBytes)
         except:
-            print("Unable to open output file  {} for writing".format(outputfilename))
-            return ""   
-    line = logfile.readline()
-    section = ''
-    while (line):
-        # build a section with the lines up to the one that is only '\n'
-        if (line.startswith('Sending') or line.startswith('Sent') or line.startswith('Response') or line.startswith('Data')):
-            section = ''
-        elif (line.startswith('scbmctestfunc: Error')):
-            outfile.write('Line missing due to comm error\n')
-            section = ''
-        elif (line != '\n'):
-            section += line.strip() + ' '
+            print("Unable to open output file  {} for writing".format(outfilename))
+            logfile.close()
+            return ""
+    else:
+        outfile = sys.stdout
+
+    failed = [0]
+    with logfile:
+        if (tsrname):
+            logs, count = ParseTSR(logfile, outfile, failed)
+            if (not logs):
+                print("No CMLogs.log was found in {}".format(tsrname))
         else:
-            # parse the section as one output line
-            if (section):
-                outfile.write(ParseLogLine(section))
-                section = ''
-        line = logfile.readline()
-    if (section):
-        #write the last bit of data out
-        outfile.write(ParseLogLine(section))
-        
-    #close out
-    if (logfile):
-        logfile.close()
-    if (outfile):
+            count = WriteLines(outfile, ParseLogLines(logfile, failed))
+    if (outfilename):
         outfile.close()
+        verbose("Wrote {} lines to {}".format(count, outfilename))
+    if (failed[0]):
+        print("{} sections can't be processed to ascii".format(failed[0]))
     return ""
     
+# The CM log text has no fixed layout, these pick out the parts that can be recognized in a line
+LogTimestampFormats = [
+    (re.compile(r'(\d{4})[-/](\d{1,2})[-/](\d{1,2})[ T]+(\d{1,2}):(\d{2}):(\d{2})'), (0, 1, 2)),  # 2024-01-31 13:45:00
+    (re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})[ ,]+(\d{1,2}):(\d{2}):(\d{2})'), (2, 0, 1)),       # 01/31/2024 13:45:00
+]
+LogSeverityPattern = re.compile(r'\b(FATAL|CRIT(?:ICAL)?|ALERT|ERR(?:OR)?|FAIL(?:ED|URE)?|WARN(?:ING)?|NOTICE|INFO|DEBUG)\b', re.IGNORECASE)
+LogSeverityNames = {'FATAL': 'CRITICAL', 'CRIT': 'CRITICAL', 'CRITICAL': 'CRITICAL', 'ALERT': 'CRITICAL',
+                    'ERR': 'ERROR', 'ERROR': 'ERROR', 'FAIL': 'ERROR', 'FAILED': 'ERROR', 'FAILURE': 'ERROR',
+                    'WARN': 'WARNING', 'WARNING': 'WARNING', 'NOTICE': 'INFO', 'INFO': 'INFO', 'DEBUG': 'DEBUG'}
+LogComponentPattern = re.compile(r'\b(PSU|FAN|SLED|NODE|IOM|BP|CM|TEMP|PWR|MUX|FW)[ _#-]?(\d*)\b', re.IGNORECASE)
+LogRelativeTime = re.compile(r'^(\d+)([dhm])$')
+LogRelativeSeconds = {'d': 86400, 'h': 3600, 'm': 60}
+LogStoreBatch = 1000
+
+# remove the padding from a log block, GetLog blocks are the repr of the bytes so the NULs are escaped text
+def CleanLogText(text):
+    return text.replace('\\x00', '').replace('\x00', '').strip()
+
+# find the timestamp in a line of CM log text, returns (timestamp, text without it)
+# The timestamp is normalized to YYYY-MM-DD HH:MM:SS so it sorts, '' if there isn't one.
+def LogTimestamp(text):
+    for pattern, (year, month, day) in LogTimestampFormats:
+        match = pattern.search(text)
+        if (match):
+            parts = match.groups()
+            timestamp = "{:04}-{:02}-{:02} {:02}:{:02}:{:02}".format(int(parts[year]), int(parts[month]), int(parts[day]),
+                                                                   int(parts[3]), int(parts[4]), int(parts[5]))
+            return timestamp, (text[:match.start()] + text[match.end():]).strip(' :-[]')
+    return '', text
+
+# Split one line of CM log text into (timestamp, severity, component, message), parts that aren't found are ''.
+def ParseLogRecord(text):
+    timestamp, message = LogTimestamp(text)
+    match = LogSeverityPattern.search(message)
+    severity = LogSeverityNames[match.group(1).upper()] if match else ''
+    match = LogComponentPattern.search(message)
+    component = (match.group(1) + match.group(2)).upper() if match else ''
+    return timestamp, severity, component, message
+
+# build the store rows for (offset, text) log blocks read from a host
+def LogRows(host, platform, blocks, ingested):
+    rows = []
+    for offset, text in blocks:
+        text = CleanLogText(text)
+        if (not text):
+            continue
+        digest = hashlib.sha1(text.encode()).hexdigest()
+        rows.append((host, platform, offset, digest) + ParseLogRecord(text) + (text, ingested))
+    return rows
+
+def OpenLogStore(dbfilename):
+    db = sqlite3.connect(dbfilename)
+    db.execute("CREATE TABLE IF NOT EXISTS logevent (host TEXT, platform TEXT, offset INTEGER, hash TEXT, "
+               "timestamp TEXT, severity TEXT, component TEXT, message TEXT, line TEXT, ingested TEXT, "
+               "UNIQUE (host, offset, hash))")
+    db.execute("CREATE INDEX IF NOT EXISTS logevent_host ON logevent (host, timestamp)")
+    db.execute("CREATE INDEX IF NOT EXISTS logevent_time ON logevent (timestamp)")
+    db.execute("CREATE INDEX IF NOT EXISTS logevent_component ON logevent (component, severity)")
+    # full text index of the messages when the sqlite library was built with FTS5
+    try:
+        db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS logevent_fts USING fts5 (line, content='logevent', content_rowid='rowid')")
+        db.execute("CREATE TRIGGER IF NOT EXISTS logevent_fts_insert AFTER INSERT ON logevent BEGIN "
+                   "INSERT INTO logevent_fts (rowid, line) VALUES (new.rowid, new.line); END")
+    except sqlite3.OperationalError:
+        verbose("This sqlite library has no FTS5, text searches will scan the log lines.")
+    return db
+
+def HasLogFTS(db):
+    return bool(db.execute("SELECT 1 FROM sqlite_master WHERE name = 'logevent_fts'").fetchone())
+
+# save rows to the store, repeated blocks (same host, offset and content) are skipped, returns the number added
+def StoreLogRows(db, rows):
+    added = 0
+    with db:
+        for start in range(0, len(rows), LogStoreBatch):
+            # rowcount doesn't include the ignored rows or the full text index rows added by the trigger
+            added += db.executemany("INSERT OR IGNORE INTO logevent (host, platform, offset, hash, timestamp, severity, component, "
+                           "message, line, ingested) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows[start:start+LogStoreBatch]).rowcount
+    return added
+
+# read the whole CM log of the current target as store rows
+def ReadLogRows(host, ingested):
+    log_cnt = CMLogByteCount()
+    if (log_cnt < 0):
+        return "Ipmitool Error.  Verify HOST, user, and password are correct"
+    boardpn, boardrev = BoardPNAndRev()
+    platform = GetSptChassisByPN(boardpn) or None
+    return LogRows(host, platform, CMLogBlocks(0, log_cnt), ingested)
+
+# the sections of a parsed TSR log are whole log blocks, give them the offset they had in the CM log.
+# Sections that were dropped or don't decode still take up their block so the offsets after them stay right.
+def ParsedLogBlocks(logfile):
+    for index, section in enumerate(LogSections(logfile)):
+        output = DecodeLogSection(section) if (section is not None) else None
+        if (output is not None):
+            yield index * CMLogOffsetIncrement, output + '\n'
+
+# process pool worker for ingesting a directory of TSRs, returns (tsr filename, rows, error)
+def TSRLogRows(tsrfilename, platform, ingested):
+    host = os.path.splitext(os.path.basename(tsrfilename))[0]
+    rows = []
+    try:
+        with zipfile.ZipFile(tsrfilename) as archive:
+            for name, logfile in TSRLogMembers(archive):
+                rows += LogRows(host, platform, ParsedLogBlocks(logfile), ingested)
+    except (OSError, zipfile.BadZipFile) as err:
+        return (tsrfilename, [], str(err))
+    return (tsrfilename, rows, "")
+
+def CMIngestLog(arglist):
+    cmdhelp = CMCommandHelpDetailed['IngestLog'.lower()]
+    dbfilename = ""
+    inventoryfile = ""
+    logfilename = ""
+    tsrname = ""
+    host = ""
+    platform = None
+    threads = fleet_threads
+    if (arglist and (len(arglist) > 0)):
+        for arg in arglist:
+            if (len(arg.split('=')) < 2):  # argument is not well-formed
+                errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
+                return (errmsg + cmdhelp)
+            argname, value = arg.split('=', 1)
+            if (argname == 'db'):
+                dbfilename = value
+            elif (argname == 'inventory'):
+                inventoryfile = value
+            elif (argname == 'logfile'):
+                logfilename = value
+            elif (argname == 'tsr'):
+                tsrname = value
+            elif (argname == 'host'):
+                host = value
+            elif (argname == 'platform'):
+                platform = value
+            elif (argname == 'threads'):
+                threads = int(value)
+            else:
+                return (cmdhelp)
+    if ((not dbfilename) or (not (inventoryfile or logfilename or tsrname))):
+        return (cmdhelp)
+
+    if (inventoryfile and (not check_ipmitool())):
+        return "You must install ipmitool on this system to read the logs of an inventory."
+
+    ingested = time.strftime('%Y-%m-%d %H:%M:%S')
+    sources = {}
+    errors = {}
+    if (inventoryfile):
+        try:
+            hostlist = ReadInventory(inventoryfile)
+        except OSError:
+            return "Unable to open {} for reading.".format(inventoryfile)
+        print("Reading the CM log of {} hosts.".format(len(hostlist)))
+        for target, rows in CallOnHosts(hostlist, lambda target: ReadLogRows(target, ingested), threads).items():
+            if (isinstance(rows, str)):
+                errors[target] = rows.strip()
+            else:
+                sources[target] = rows
+    elif (logfilename):
+        try:
+            with open(logfilename, 'r', buffering=ParseLogBufferBytes) as logfile:
+                sources[logfilename] = LogRows(host or os.path.basename(logfilename), platform, ParsedLogBlocks(logfile), ingested)
+        except OSError:
+            return "Unable to open logfile {} for reading.".format(logfilename)
+    elif (os.path.isdir(tsrname)):
+        tsrfilenames = sorted(os.path.join(tsrname, name) for name in os.listdir(tsrname) if name.lower().endswith('.zip'))
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            for tsrfilename, rows, error in executor.map(TSRLogRows, tsrfilenames, [platform] * len(tsrfilenames), [ingested] * len(tsrfilenames)):
+                if (error):
+                    errors[tsrfilename] = error
+                else:
+                    sources[tsrfilename] = rows
+    else:
+        tsrfilename, rows, error = TSRLogRows(tsrname, platform, ingested)
+        if (error):
+            return "Unable to open TSR {} as a zip file.".format(tsrname)
+        if (host):
+            rows = [(host,) + row[1:] for row in rows]
+        sources[tsrfilename] = rows
+
+    db = OpenLogStore(dbfilename)
+    output = ""
+    total = 0
+    added = 0
+    for source in sorted(sources):
+        rows = sources[source]
+        count = StoreLogRows(db, rows)
+        verbose("{}: {} log lines, {} new".format(source, len(rows), count))
+        total += len(rows)
+        added += count
+    db.close()
+    for source in sorted(errors):
+        output += "{}: {}\n".format(source, errors[source])
+    output += "Ingested {} log lines from {} sources into {}, {} were new. {} sources failed.".format(
+        total, len(sources), dbfilename, added, len(errors))
+    return output
+
+# turn a since/until value into a timestamp, either YYYY-MM-DD[ HH:MM:SS] or relative to now like 7d, 12h, 30m
+def LogTimeValue(value):
+    match = LogRelativeTime.match(value)
+    if (match):
+        seconds = int(match.group(1)) * LogRelativeSeconds[match.group(2)]
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - seconds))
+    return value
+
+def CMQueryLog(arglist):
+    cmdhelp = CMCommandHelpDetailed['QueryLog'.lower()]
+    dbfilename = ""
+    where = []
+    params = []
+    text = ""
+    limit = 100
+    if (arglist and (len(arglist) > 0)):
+        for arg in arglist:
+            if (len(arg.split('=')) < 2):  # argument is not well-formed
+                errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
+                return (errmsg + cmdhelp)
+            argname, value = arg.split('=', 1)
+            if (argname == 'db'):
+                dbfilename = value
+            elif (argname in ['host', 'platform', 'component', 'severity']):
+                where.append("logevent.{} = ? COLLATE NOCASE".format(argname))
+                params.append(value)
+            elif (argname == 'since'):
+                where.append("logevent.timestamp >= ?")
+                params.append(LogTimeValue(value))
+            elif (argname == 'until'):
+                where.append("logevent.timestamp <= ?")
+                params.append(LogTimeValue(value))
+            elif (argname == 'text'):
+                text = value
+            elif (argname == 'limit'):
+                limit = int(value)
+            else:
+                return (cmdhelp)
+    if (not dbfilename):
+        return (cmdhelp)
+    if (not os.path.isfile(dbfilename)):
+        return "The log store {} does not exist.".format(dbfilename)
+
+    db = OpenLogStore(dbfilename)
+    tables = "logevent"
+    if (text and HasLogFTS(db)):
+        tables = "logevent_fts JOIN logevent ON logevent.rowid = logevent_fts.rowid"
+        where.append("logevent_fts MATCH ?")
+        params.append(text)
+    elif (text):
+        where.append("logevent.line LIKE ?")
+        params.append('%' + text + '%')
+    query = "SELECT logevent.host, logevent.timestamp, logevent.severity, logevent.component, logevent.message FROM {}".format(tables)
+    if (where):
+        query += " WHERE " + ' AND '.join(where)
+    query += " ORDER BY logevent.timestamp, logevent.host, logevent.offset LIMIT ?"
+    params.append(limit)
+
+    output = ""
+    count = 0
+    hosts = set()
+    try:
+        for host, timestamp, severity, component, message in db.execute(query, params):
+            output += "{:20} {:19} {:8} {:6} {}\n".format(host, timestamp, severity, component, message)
+            hosts.add(host)
+            count += 1
+    except sqlite3.OperationalError as err:
+        db.close()
+        return "The text search {} is not valid: {}".format(text, err)
+    db.close()
+    output += "{} log lines from {} chassis matched.".format(count, len(hosts))
+    if (count == limit):
+        output += " Showing the first {}, use -a limit= to see more.".format(limit)
+    return output
+
+# the most logs merged at once, more than this are merged in groups through temporary files so
+# the number of open files stays bounded
+MergeLogsFanIn = 200
+
+# generator of (timestamp, host, text) for the lines of a GetLog or ParseLog output file,
+# a line without a timestamp gets the one of the line before it
+def LogFileRecords(filename, host):
+    timestamp = ''
+    with open(filename, 'r', buffering=ParseLogBufferBytes, errors='replace') as logfile:
+        for line in logfile:
+            text = CleanLogText(line)
+            if (not text):
+                continue
+            found = LogTimestamp(text)[0]
+            if (found):
+                timestamp = found
+            yield (timestamp, host, text)
+
+# generator of (timestamp, host, text) for the lines in a log store, in time order
+def LogStoreRecords(dbfilename, platform, since, until):
+    db = OpenLogStore(dbfilename)
+    where = ["1"]
+    params = []
+    if (platform):
+        where.append("platform = ? COLLATE NOCASE")
+        params.append(platform)
+    if (since):
+        where.append("timestamp >= ?")
+        params.append(since)
+    if (until):
+        where.append("timestamp <= ?")
+        params.append(until)
+    try:
+        for record in db.execute("SELECT timestamp, host, line FROM logevent WHERE {} ORDER BY timestamp, host, offset".format(' AND '.join(where)), params):
+            yield record
+    finally:
+        db.close()
+
+# the records of one log between since and until, the log is in time order so reading stops after until
+def LogWindow(records, since, until):
+    for record in records:
+        if (since and (record[0] < since)):
+            continue
+        if (until and (record[0] > until)):
+            break
+        yield record
+
+def SpoolRecords(spool):
+    with spool:
+        for line in spool:
+            yield tuple(line.rstrip('\n').split('\t', 2))
+
+# k-way merge of time ordered record streams
+def MergeLogRecords(streams):
+    while (len(streams) > MergeLogsFanIn):
+        spooled = []
+        for start in range(0, len(streams), MergeLogsFanIn):
+            spool = tempfile.TemporaryFile('w+')
+            for timestamp, host, text in heapq.merge(*streams[start:start+MergeLogsFanIn]):
+                spool.write("{}\t{}\t{}\n".format(timestamp, host, text.replace('\n', ' ')))
+            spool.seek(0)
+            spooled.append(SpoolRecords(spool))
+        streams = spooled
+    return heapq.merge(*streams)
+
+# log files are named for the host they came from, ex. <host>.txt or CM_log_<servicetag>_<host>_<YYYYmmdd_HHMMSS>.txt from cm_log_read
+CollectedLogName = re.compile(r'^CM_log_[A-Za-z0-9]+_(.+)_\d{8}_\d{6}$')
+
+def LogFileHost(filename):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    match = CollectedLogName.match(name)
+    return match.group(1) if match else name
+
+# the Platform of each host in a Discover inventory file
+def InventoryPlatforms(filename):
+    inventory = configparser.ConfigParser(interpolation=None)
+    try:
+        inventory.read(filename)
+    except configparser.MissingSectionHeaderError:
+        return {}
+    return {host: inventory.get(host, 'Platform', fallback='') for host in inventory.sections()}
+
+def CMMergeLogs(arglist):
+    cmdhelp = CMCommandHelpDetailed['MergeLogs'.lower()]
+    logfilenames = []
+    dbfilenames = []
+    inventoryfile = ""
+    outfilename = ""
+    platform = ""
+    since = ""
+    until = ""
+    if (arglist and (len(arglist) > 0)):
+        for arg in arglist:
+            if (len(arg.split('=')) < 2):  # argument is not well-formed
+                errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
+                return (errmsg + cmdhelp)
+            argname, value = arg.split('=', 1)
+            if (argname == 'logfile'):
+                logfilenames.append(value)
+            elif (argname == 'dir'):
+                if (not os.path.isdir(value)):
+                    return "{} is not a directory.".format(value)
+                logfilenames += sorted(os.path.join(value, name) for name in os.listdir(value) if os.path.isfile(os.path.join(value, name)))
+            elif (argname == 'db'):
+                dbfilenames.append(value)
+            elif (argname == 'inventory'):
+                inventoryfile = value
+            elif (argname == 'platform'):
+                platform = value
+            elif (argname == 'since'):
+                since = LogTimeValue(value)
+            elif (argname == 'until'):
+                until = LogTimeValue(value)
+            elif (argname == 'outfile'):
+                outfilename = value
+            else:
+                return (cmdhelp)
+    if (not (logfilenames or dbfilenames)):
+        return (cmdhelp)
+    if (platform and logfilenames and (not inventoryfile)):
+        return "An inventory file is required to filter log files by platform."
+
+    platforms = {}
+    if (inventoryfile):
+        try:
+            platforms = InventoryPlatforms(inventoryfile)
+        except OSError:
+            return "Unable to open {} for reading.".format(inventoryfile)
+
+    streams = []
+    for logfilename in logfilenames:
+        host = LogFileHost(logfilename)
+        if (platform and (platforms.get(host, '').lower() != platform.lower())):
+            verbose("Skipping {}, host {} is not a {}".format(logfilename, host, platform))
+            continue
+        streams.append(LogWindow(LogFileRecords(logfilename, host), since, until))
+    for dbfilename in dbfilenames:
+        if (not os.path.isfile(dbfilename)):
+            return "The log store {} does not exist.".format(dbfilename)
+        streams.append(LogStoreRecords(dbfilename, platform, since, until))
+
+    outfile = sys.stdout
+    if (outfilename):
+        try:
+            outfile = open(outfilename, 'w', buffering=ParseLogBufferBytes)
+        except OSError:
+            return "Unable to open output file {} for writing".format(outfilename)
+    hosts = set()
+    lines = (hosts.add(host) or "{:19} {:20} {}\n".format(timestamp, host, text) for timestamp, host, text in MergeLogRecords(streams))
+    try:
+        count = WriteLines(outfile, lines)
+    except OSError as err:
+        return "Unable to read a log: {}".format(err)
+    finally:
+        if (outfilename):
+            outfile.close()
+    return "Merged {} log lines from {} chassis.".format(count, len(hosts))
+
+# the variable parts of a log message, replaced to make the message template
+LogTemplatePatterns = [
+    (re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}\b'), '<ip>'),
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), '<hex>'),
+    (re.compile(r'\d+'), '<n>'),
+    (re.compile(r'\s+'), ' '),
+]
+LogStatsCandidates = 4  # TopCounter keeps this many candidates for each template shown
+
+def LogTemplate(text):
+    message = LogTimestamp(text)[1]
+    for pattern, replacement in LogTemplatePatterns:
+        message = pattern.sub(replacement, message)
+    return message.strip()
+
+def CMLogStats(arglist):
+    cmdhelp = CMCommandHelpDetailed['LogStats'.lower()]
+    logfilenames = []
+    dbfilenames = []
+    inventoryfile = ""
+    since = ""
+    until = ""
+    newsince = LogTimeValue('7d')
+    topcount = 20
+    outlierstdevs = 3.0
+    if (arglist and (len(arglist) > 0)):
+        for arg in arglist:
+            if (len(arg.split('=')) < 2):  # argument is not well-formed
+                errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
+                return (errmsg + cmdhelp)
+            argname, value = arg.split('=', 1)
+            if (argname == 'logfile'):
+                logfilenames.append(value)
+            elif (argname == 'dir'):
+                if (not os.path.isdir(value)):
+                    return "{} is not a directory.".format(value)
+                logfilenames += sorted(os.path.join(value, name) for name in os.listdir(value) if os.path.isfile(os.path.join(value, name)))
+            elif (argname == 'db'):
+                dbfilenames.append(value)
+            elif (argname == 'inventory'):
+                inventoryfile = value
+            elif (argname == 'since'):
+                since = LogTimeValue(value)
+            elif (argname == 'until'):
+                until = LogTimeValue(value)
+            elif (argname == 'new'):
+                newsince = LogTimeValue(value)
+            elif (argname == 'top'):
+                topcount = int(value)
+            elif (argname == 'outliers'):
+                outlierstdevs = float(value)
+            else:
+                return (cmdhelp)
+    if (not (logfilenames or dbfilenames)):
+        return (cmdhelp)
+
+    platforms = {}
+    if (inventoryfile):
+        try:
+            platforms = InventoryPlatforms(inventoryfile)
+        except OSError:
+            return "Unable to open {} for reading.".format(inventoryfile)
+    streams = []
+    for logfilename in logfilenames:
+        streams.append(LogWindow(LogFileRecords(logfilename, LogFileHost(logfilename)), since, until))
+    for dbfilename in dbfilenames:
+        if (not os.path.isfile(dbfilename)):
+            return "The log store {} does not exist.".format(dbfilename)
+        db = OpenLogStore(dbfilename)
+        for host, platform in db.execute("SELECT DISTINCT host, platform FROM logevent"):
+            platforms.setdefault(host, platform or '')
+        db.close()
+        streams.append(LogStoreRecords(dbfilename, '', since, until))
+
+    # one pass over all the lines, memory only grows with the number of chassis
+    counts = CountMinSketch()
+    older = CountMinSketch()      # lines from before newsince, a template that has none is new
+    byplatform = CountMinSketch() # keyed by (platform, template)
+    topk = TopCounter(topcount * LogStatsCandidates)
+    hostlines = {}
+    total = 0
+    try:
+        for timestamp, host, text in itertools.chain(*streams):
+            template = LogTemplate(text)
+            platform = platforms.get(host, '')
+            topk.update(template, counts.add(template))
+            # a line with no timestamp can't be placed before newsince
+            if (timestamp and (timestamp < newsince)):
+                older.add(template)
+            byplatform.add((platform, template))
+            hostlines[host] = hostlines.get(host, 0) + 1
+            total += 1
+    except OSError as err:
+        return "Unable to read a log: {}".format(err)
+    if (not total):
+        return "No log lines were found."
+
+    allplatforms = sorted(set(platforms.get(host, '') for host in hostlines))
+    output = "{} log lines from {} chassis. New templates have no lines before {}.\n".format(total, len(hostlines), newsince)
+    output += "{:>4} {:>9} {:3}  {}\n".format('Rank', 'Count', 'New', 'Template')
+    for rank, (template, count) in enumerate(topk.top(topcount), 1):
+        output += "{:>4} {:>9} {:3}  {}\n".format(rank, count, '*' if (older.estimate(template) == 0) else '', template)
+        breakdown = [(platform or 'Unknown', byplatform.estimate((platform, template))) for platform in allplatforms]
+        output += "{:18}{}\n".format('', ', '.join("{} {}".format(platform, count) for platform, count in breakdown if count))
+
+    if (len(hostlines) > 1):
+        mean = statistics.mean(hostlines.values())
+        stdev = statistics.pstdev(hostlines.values())
+        limit = mean + (outlierstdevs * stdev)
+        outliers = sorted(((count, host) for host, count in hostlines.items() if (stdev and (count > limit))), reverse=True)
+        output += "Outlier chassis, more than {} log lines ({:.0f} average, {} standard deviations):\n".format(int(limit), mean, outlierstdevs)
+        for count, host in outliers:
+            output += "    {:20} {:14} {:>9}\n".format(host, platforms.get(host, '') or 'Unknown', count)
+        if (not outliers):
+            output += "    None\n"
+    # counts come from a count-min sketch, they may be a little high but are never low
+    return output.rstrip('\n')
+
 def CMSetConfig(arglist):
     cmdhelp = CMCommandHelpDetailed['SetConfig'.lower()]
     property = None
@@ -1154,6 +2042,14 @@ def CMSetConfig(arglist):
         return (cmdhelp)
     
     verbose("Config Property {} will be set to {}".format(property.name, property.get_enum_val(propval)))
+    propvalbytes = ConfigValueBytes(property, propval)
+    if (not propvalbytes):
+        return ("The property {} has an invalid byte length defined: {}.".format(property.name, property.len))
+
+    return SetConfigProperties([(property, propvalbytes)])
+
+# convert a property value to the hex byte string used in a Set Config request
+def ConfigValueBytes(property, propval):
     if (property.len == 1):
         setval = int(propval)
         lsb = "0x" + (format(setval,'04x'))[2:]  # just make sure we only get lower byte
@@ -1173,34 +2069,63 @@ def CMSetConfig(arglist):
             propvalbytes += '0x20 '  # pad with spaces
         propvalbytes = propvalbytes.strip()
     else:
-        return ("The property {} has an invalid byte length defined: {}.".format(property.name, property.len))
-        
-    stdout = call_ipmitool("{} 0xa1 0x1 0x1 {} {} {}".format(config_preamble, property.id, propvalbytes, ending))
-    
-    if (use_raw_output):
-        return stdout
+        return ""
+    return propvalbytes
+
+# Add the properties of the requests that were already applied to an error from a later request
+def PartialWriteMessage(message, batches, failed):
+    if (failed == 0):
+        return message
+    applied = [name for batch in batches[:failed] for name, propbytes in batch]
+    return "{}. Request {} of {} failed, these were already set by the earlier requests: {}".format(
+        message.strip(), failed + 1, len(batches), ', '.join(applied))
+
+# Send a list of (property, propvalbytes) in as few Set Config requests as the IPMB message size allows.
+# Cmd = 0xa1  ConfigStructVersion = 0x01  NumberofProperties = count, then the ID and value of each one
+def SetConfigProperties(proplist):
+    unsupported = UnsupportedProperties([property for property, propvalbytes in proplist])
+    if (unsupported):
+        return UnsupportedMessage(unsupported)
+    batches = [[]]
+    batchlen = 0
+    for property, propvalbytes in proplist:
+        proplen = 1 + property.len
+        if (batches[-1] and (batchlen + proplen > ConfigBatchMaxBytes)):
+            batches.append([])
+            batchlen = 0
+        batches[-1].append((property.name, "{} {}".format(property.id, propvalbytes)))
+        batchlen += proplen
+
+    completion = ""
+    for index, batch in enumerate(batches):
+        verbose("Setting {} Config Properties in one request".format(len(batch)))
+        stdout = call_ipmitool("{} 0xa1 0x1 {} {} {}".format(config_preamble, hex(len(batch)), ' '.join(propbytes for name, propbytes in batch), ending))
+
+        if (use_raw_output):
+            return stdout
 
-    outbytes = stdout.split()
-    if (len(outbytes) == 0):
-        # bad connection, message in stderr
-        return "Ipmitool Error.  Verify HOST, user, and password are correct"
+        outbytes = stdout.split()
+        if (len(outbytes) == 0):
+            # bad connection, message in stderr
+            return PartialWriteMessage("Ipmitool Error.  Verify HOST, user, and password are correct", batches, index)
+
+        # check the completion code
+        completion = CMConfigCompCodes.get(outbytes[completion_code_idx], 'Unknown response')
+        if (not (completion == 'Success')):
+            return PartialWriteMessage("Unsuccessful reponse: {} = {} ".format(outbytes[completion_code_idx], completion), batches, index)
 
-    # check the completion code
-    completion = CMConfigCompCodes.get(outbytes[completion_code_idx], 'Unknown response')
-    if (not (completion == 'Success')):
-        return "Unsuccessful reponse: {} = {} ".format(outbytes[completion_code_idx], completion)
-    
     return completion
 
 
-def CMGetFRU(args, ini_output = False):
+# fields is an optional list of FRU names to read, the default is to read all of them
+def CMGetFRU(args, ini_output = False, fields = None):
     cmdhelp = CMCommandHelpDetailed['GetFRU'.lower()]
     property = None
     propval = None
     errmsg = ""
     progressstring = "Getting FRU Settings"
     
-    print(progressstring, end='\r')
+    progress(progressstring, end='\r')
     
     # Get the FRU CM Board PN/Rev to determine the chassis type and HW level (UT/PT/ST)
     boardpn, boardrev = BoardPNAndRev()
@@ -1217,7 +2142,7 @@ def CMGetFRU(args, ini_output = False):
     verbose("Using " + SptChassis + " FRU Settings")
     
     progressstring += '.'
-    print(progressstring, end='\r')
+    progress(progressstring, end='\r')
     #Have to loop through all the addresses since there isn't one command to get all data
     if (ini_output):
         output = "[FRUSettings]\n"
@@ -1226,8 +2151,10 @@ def CMGetFRU(args, ini_output = False):
         output = "CM FRU Settings: Board PN {} Platform Name {}\n".format(boardpn, platname)
 
     for fru in CMFRUSettings:
+        if (fields and (CMFRUSettings[fru].name not in fields)):
+            continue
         progressstring += '.'
-        print(progressstring, end='\r')
+        progress(progressstring, end='\r')
     
         stdout = call_ipmitool("{} 0x11 0x0 {} {} {} {}".format(log_preamble, CMFRUSettings[fru].addr_lsb, CMFRUSettings[fru].addr_msb, CMFRUSettings[fru].len, ending))
     
@@ -1249,7 +2176,7 @@ def CMGetFRU(args, ini_output = False):
             outstr += bytes.fromhex(mybyte).decode('ascii')
         output += "{:26} = {}\n".format(CMFRUSettings[fru].name, outstr)
     #end for
-    print(progressstring)
+    progress(progressstring)
 
     return output    
 
@@ -1274,15 +2201,25 @@ def CMSetFRU(arglist):
     else:
         return (cmdhelp)
 
-    # pad or trunc the string to fit required length
+    return SetFRUValue(property, propval)
+
+# pad or trunc the string to fit the FRU field
+def FRUFieldValue(property, propval):
     setval = propval.ljust(property.len)
     if (len(propval) > property.len):
         verbose("Trimming the length of {} to {} characters".format(propval, property.len))
         setval = propval[0:property.len]
+    return setval
+
+def SetFRUValue(property, propval):
+    setval = FRUFieldValue(property, propval)
     verbose("CM FRU Property {} will be set to {}".format(property.name, setval))
     hexsetval = ''
     for letter in setval:
         hexsetval += hex(ord(letter)) + ' '
+    # BoardPNAndRev reads this field, read it again after it changes
+    if (property.name == 'ChassisBoardPartNumber'):
+        boardpn_cache.pop(CurrentTarget(), None)
     stdout = call_ipmitool("{} 0x12 0x0 {} {} {} {}".format(log_preamble, property.addr_lsb, property.addr_msb, hexsetval, ending))    
     
     if (use_raw_output):
@@ -1327,21 +2264,38 @@ def CMSaveConfig(arglist):
     else:
         return (cmdhelp)
     
-    ini_output = True
+    reconfigprops = BuildReconfigProps()
+    if (isinstance(reconfigprops, str)):
+        inifile.close()
+        return reconfigprops
+
+    verbose("Writing Config Properties and FRU Settings to {}".format(inifile))
+    reconfigprops.write(inifile)
+    inifile.close()
+    
+    return completion
+
+# Read the current target and return a ConfigParser with just the ReconfigProperties,
+# or an error string if the reads fail.
+def BuildReconfigProps():
     tempargs = []
-    allconfigs = configparser.ConfigParser()
+    allconfigs = configparser.ConfigParser(interpolation=None)
     verbose("Calling CMGetConfig with ini_output = True and parsing in ConfigParser")
     configout = CMGetConfig(tempargs, True)
     verbose(configout)
+    if (not configout.startswith('[')):
+        return configout
     allconfigs.read_string(configout)
     verbose("Calling CMGetFRU with ini_output = True and parsing in ConfigParser")
-    fruout = CMGetFRU(tempargs, True)
+    fruout = CMGetFRU(tempargs, True, ReconfigProperties['FRUSettings'])
     verbose(fruout)
+    if (not fruout.startswith('[')):
+        return fruout
     allconfigs.read_string(fruout)
-    
+    unsupported = UnsupportedReconfigProperties(GetSptChassisByPN(allconfigs.get('ConfigProperties', 'Board PN')))
     
     # make a new empty INI file parser
-    reconfigprops = configparser.ConfigParser()
+    reconfigprops = configparser.ConfigParser(interpolation=None)
     # now loop through the dict of desired output settings and select the ones to save in reconfigprops
     for key in ReconfigProperties:
         if (not reconfigprops.has_section(key)):
@@ -1350,14 +2304,27 @@ def CMSaveConfig(arglist):
         for prop in ReconfigProperties[key]:
             if (not allconfigs.has_section(key)):
                 return ("The config data read from the system is missing the Section named {}.\n".format(key))
+            if ((key == 'ConfigProperties') and (prop in unsupported)):
+                verbose("Skipping {}, this chassis doesn't support it".format(prop))
+                continue
             propval = allconfigs.get(key, prop)
             verbose("Adding option {} to section {} with value {}".format(prop, key, propval))
             reconfigprops.set(key, prop, propval)
-            
-    verbose("Writing Config Properties and FRU Settings to {}".format(inifile))
-    reconfigprops.write(inifile)
-    
-    return completion
+    return reconfigprops
+
+# The ReconfigProperties config property names that the platform or the CM FW version of the target don't have
+def UnsupportedReconfigProperties(SptChassis):
+    CMConfigSettings = CMAllConfigSettings[SptChassis]
+    unsupported = []
+    properties = []
+    for name in ReconfigProperties['ConfigProperties']:
+        property = FindConfigByName(CMConfigSettings, name)
+        if (property):
+            properties.append(property)
+        else:
+            unsupported.append(name)
+    unsupported += [property.name for property in UnsupportedProperties(properties)]
+    return unsupported
 
     
 def CMReconfig(arglist):
@@ -1397,116 +2364,263 @@ def CMReconfig(arglist):
         return("Unable to parse the INI file {}.\n".format(inifilename))
     
     verbose("reconfigprops Sections = {}".format(reconfigprops.sections()))
-    # look for expected settings from ReconfigProperties and call the appropriate Set function
+    return ApplyReconfigProps(reconfigprops)
+
+# Read the current Config Properties and FRU Settings once, then write only the ReconfigProperties
+# that differ from reconfigprops and read them back once to verify.
+def ApplyReconfigProps(reconfigprops):
+    current = configparser.ConfigParser(interpolation=None)
+    configout = CMGetConfig([], True)
+    if (not configout.startswith('[')):
+        return configout
+    current.read_string(configout)
+    fruout = CMGetFRU([], True, ReconfigProperties['FRUSettings'])
+    if (not fruout.startswith('[')):
+        return fruout
+    current.read_string(fruout)
+
+    SptChassis = GetSptChassisByPN(current.get('ConfigProperties', 'Board PN'))
+    unsupported = UnsupportedReconfigProperties(SptChassis)
+
+    # look for expected settings from ReconfigProperties
+    desired = {}
     for key in ReconfigProperties:
         if (not reconfigprops.has_section(key)):
             return("The INI file is missing the required section named {}.".format(key))
         for opt in ReconfigProperties[key]:
+            if ((key == 'ConfigProperties') and (opt in unsupported)):
+                verbose("Skipping {}, this chassis doesn't support it".format(opt))
+                continue
             try:
-                optval = reconfigprops.get(key, opt)
+                desired[(key, opt)] = reconfigprops.get(key, opt)
             except:
                 return("The INI file is missing the required option named {}".format(opt))
-            myarg = ["{}={}".format(opt, optval)]
-            if ('config' in key.lower()):
-                verbose("Calling CMSetConfig with {}".format(myarg))
-                completion = CMSetConfig(myarg)
-            elif ('fru' in key.lower()):
-                verbose("Calling CMSetFRU with {}".format(myarg))
-                completion = CMSetFRU(myarg)               
+
+    CMConfigSettings = CMAllConfigSettings[SptChassis]
+    CMFRUSettings = CMAllFRUSettings[SptChassis]
+
+    configchanges = []
+    fruchanges = []
+    readonly = []
+    for (key, opt), optval in desired.items():
+        curval = current.get(key, opt, fallback='')
+        if ('config' in key.lower()):
+            property = FindConfigByName(CMConfigSettings, opt)
+            if (not property):
+                return "No Config Property named {} was found".format(opt)
+            if (property.len == 8):
+                unchanged = (optval.upper().strip() == curval.upper().strip())
             else:
-                verbose("The key {} is unknown, ignoring these options.")
-        # end for
-    #end for
-    
-    return completion
+                unchanged = SameValue(optval, curval)
+            if (unchanged):
+                verbose("{} is already {}".format(opt, curval))
+                continue
+            if (not property.iswritable()):
+                verbose("Skipping {}, it is read-only on this chassis".format(opt))
+                readonly.append(opt)
+                continue
+            errmsg = property.check_value(optval)
+            if (not (errmsg == "OK")):
+                return errmsg
+            verbose("{} will change from {} to {}".format(opt, curval, optval))
+            configchanges.append((property, ConfigValueBytes(property, optval), optval))
+        elif ('fru' in key.lower()):
+            property = FindFRUByName(CMFRUSettings, opt)
+            if (not property):
+                return "No FRU Value named {} was found".format(opt)
+            if (FRUFieldValue(property, optval).strip() == curval.strip()):
+                verbose("{} is already {}".format(opt, curval))
+                continue
+            verbose("{} will change from {} to {}".format(opt, curval, optval))
+            fruchanges.append((property, optval))
+        else:
+            verbose("The key {} is unknown, ignoring these options.".format(key))
+
+    unchanged = len(desired) - len(configchanges) - len(fruchanges) - len(readonly)
+    skipped = ""
+    if (unsupported):
+        skipped = " Skipped {}, not supported by this chassis.".format(', '.join(unsupported))
+    if (readonly):
+        skipped += " Skipped {}, read-only.".format(', '.join(readonly))
+    if ((not configchanges) and (not fruchanges)):
+        return "Success. All {} properties already match.".format(unchanged) + skipped
+
+    if (configchanges):
+        completion = SetConfigProperties([(property, propvalbytes) for property, propvalbytes, optval in configchanges])
+        if (not (completion == 'Success')):
+            return completion
+    for property, optval in fruchanges:
+        completion = SetFRUValue(property, optval)
+        if (not (completion == 'Success')):
+            return "Setting FRU {} failed: {}".format(property.name, completion)
+
+    # read back what was written
+    verify = configparser.ConfigParser(interpolation=None)
+    if (configchanges):
+        configout = CMGetConfig([], True)
+        if (not configout.startswith('[')):
+            return "Verify failed: " + configout
+        verify.read_string(configout)
+    if (fruchanges):
+        fruout = CMGetFRU([], True, [property.name for property, optval in fruchanges])
+        if (not fruout.startswith('[')):
+            return "Verify failed: " + fruout
+        verify.read_string(fruout)
+    mismatches = []
+    for property, propvalbytes, optval in configchanges:
+        readval = verify.get('ConfigProperties', property.name, fallback='')
+        if (not (SameValue(optval.upper(), readval.upper()))):
+            mismatches.append("{} = {} expected {}".format(property.name, readval, optval))
+    for property, optval in fruchanges:
+        readval = verify.get('FRUSettings', property.name, fallback='')
+        if (FRUFieldValue(property, optval).strip() != readval.strip()):
+            mismatches.append("{} = {} expected {}".format(property.name, readval, optval))
+    if (mismatches):
+        return "Verify failed:\n" + '\n'.join(mismatches)
+
+    return "Success. Changed {} Config Properties and {} FRU Settings, {} already matched.".format(
+        len(configchanges), len(fruchanges), unchanged) + skipped
     
 def CMSetHiddenConfig(arglist):
     cmdhelp = CMCommandHelpDetailed['SetHiddenConfig'.lower()]
     key = ""
     passcode = ""
-    
-    boardpn, boardrev = BoardPNAndRev()
-    platname = ""
-    
-    verbose("Chassis Board PN = {}, rev = {}".format(boardpn, boardrev))
-    SptChassis = GetSptChassisByPN(boardpn)
-    if (SptChassis == ""):
-        return "CM Board PN {} is not implemented.".format(boardpn)
-        
+    bytepasscode = ""
+    inventoryfile = ""
+    threads = fleet_threads
     CMHiddenSettings = CMAllHiddenSettings
-    platname = CMAllPlatNames[SptChassis]
-    verbose("Using " + SptChassis + " Hidden Config Settings")
 
-    property = None
-    propval = None
+    proplist = []
     if (arglist and (len(arglist) > 0)):
         for arg in arglist:
-            if ('key=' in arg):
-                value = arg.split('=')[1]
-                key = value
-            elif ('passcode=' in arg):
-                value = arg.split('=')[1]
-                passcode = value
+            if (len(arg.split('=')) < 2):  # argument is not well-formed
+                errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
+                return (errmsg + cmdhelp)
+            propname,propval = arg.split('=', 1)
+            if (propname == 'key'):
+                key = propval
+            elif (propname == 'passcode'):
+                passcode = propval
+            elif (propname == 'inventory'):
+                inventoryfile = propval
+            elif (propname == 'threads'):
+                threads = int(propval)
             else:
-                if (len(arg.split('=')) < 2):  # argument is not well-formed
-                    errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
-                    return (errmsg + cmdhelp)
-                propname,propval = arg.split('=')
                 property = FindHiddenConfigByName(CMHiddenSettings, propname)
                 if (not property):
-                    errmsg = "No Hidden Config Property named {} was found\n".format((arg.split('='))[0])
+                    errmsg = "No Hidden Config Property named {} was found\n".format(propname)
                     return (errmsg + cmdhelp)
                 errmsg = property.check_value(propval)
                 if (not (errmsg == "OK")):
                     return (errmsg + cmdhelp)
+                if (property.len not in (1, 2)):
+                    return ("The property {} has an invalid byte length defined: {}.".format(property.name, property.len))
+                proplist.append((property, propval))
     else:
         return (cmdhelp)
                 
-    # already checked the property name and value
-    if ((not key) or (not passcode)):
+    # already checked the property names and values
+    if ((not key) or (not proplist)):
         return(cmdhelp)
 
     if (not (len(key) == 8)):
         return("The static key must be exactly 8 characters.")
-    bytekey = ConvertKey(key)
 
-    passbytes = passcode.strip(',').split(',')
-    if (not (len(passbytes) == 8)):
-        return("The passcode must have must be exactly 8 bytes, separated by commas with '0x' preceding each byte in hex.")
-    bytepasscode = ConvertPasscode(passbytes)
-    
-    verbose("Hidden Config Property {} will be set to {}".format(property.name, property.get_enum_val(propval)))
-    
-    if (property.len == 1):
-        setval = int(propval)
-        lsb = "0x" + (format(setval,'04x'))[2:]  # just make sure we only get lower byte
-        propvalbytes = lsb
-    elif (property.len == 2):
-        setval = int(propval)
-        lsb = "0x" + (format(setval,'04x'))[2:]
-        msb = "0x" + str(format(setval,'04x'))[:-2]  # make sure it comes out as string
-        #lsb = propval & 0x00FF
-        #msb = (propval >> 8) & 0x00FF  # mask upper bytes just to make sure
-        propvalbytes = "{} {}".format(lsb, msb)   # lsb goes first I think
-    else:
-        return ("The property {} has an invalid byte length defined: {}.".format(property.name, property.len))
+    if (passcode):
+        if (inventoryfile):
+            return("A passcode is only good for one CM, leave it out to get one from each CM in the inventory.")
+        passbytes = passcode.strip(',').split(',')
+        if (not (len(passbytes) == 8)):
+            return("The passcode must have must be exactly 8 bytes, separated by commas with '0x' preceding each byte in hex.")
+        bytepasscode = ConvertPasscode(passbytes)
 
-    # Cmd = 0x03  ConfigStructVersion = 0x01, only one property to set
-    command = "{} 0x03 0x01 {} {} 0x01 {} {} {}".format(hidden_config_preamble, bytekey, bytepasscode, property.id, propvalbytes, ending)
-    stdout = call_ipmitool(command)
+    if (inventoryfile):
+        try:
+            hostlist = ReadInventory(inventoryfile)
+        except OSError:
+            return "Unable to open {} for reading.".format(inventoryfile)
+        results = CallOnHosts(hostlist, lambda host: SetHiddenProperties(key, proplist), threads)
+        failed = [host for host in hostlist if (results[host] != 'Success')]
+        output = "Set {} Hidden Config Properties on {} of {} hosts.\n".format(len(proplist), len(hostlist) - len(failed), len(hostlist))
+        for host in failed:
+            output += "FAILED {}: {}\n".format(host, results[host].strip())
+        return output
+
+    return SetHiddenProperties(key, proplist, bytepasscode)
+
+# Passcodes from GetPasscode are reused for the hidden config writes to the same target: target: (passcode, time)
+passcode_cache = {}
+PasscodeReuseSeconds = 30
+# Set Hidden Config data is the ConfigStructVersion, 8 byte key, 8 byte passcode and number of properties
+HiddenConfigBatchMaxBytes = IpmbMaxDataBytes - 18
+
+# Returns the passcode as 0x hex bytes, from the cache if it is recent enough, or an error string
+def GetCachedPasscode(key, refresh=False):
+    cached = passcode_cache.get(CurrentTarget(), None)
+    if (cached and (not refresh) and (time.monotonic() - cached[1] < PasscodeReuseSeconds)):
+        return cached[0]
+    passout = CMGetPasscode(["key={}".format(key)])
+    if (not passout.startswith("Passcode")):
+        return passout
+    bytepasscode = ConvertPasscode(passout.split('=')[1].strip().split(','))
+    passcode_cache[CurrentTarget()] = (bytepasscode, time.monotonic())
+    return bytepasscode
 
-    if (use_raw_output):
-        return stdout
-    
-    # check the completion codes
-    outbytes = stdout.split()
-    if (len(outbytes) == 0):
-        # bad connection, message in stderr
-        return "Ipmitool Error.  Verify HOST, user, and password are correct"
+# Set a list of (property, value) hidden properties, packed into as few requests as possible.
+# If no passcode is given one is read with GetPasscode and reused while it is valid.
+def SetHiddenProperties(key, proplist, bytepasscode=""):
+    boardpn, boardrev = BoardPNAndRev()
+    verbose("Chassis Board PN = {}, rev = {}".format(boardpn, boardrev))
+    SptChassis = GetSptChassisByPN(boardpn)
+    if (SptChassis == ""):
+        return "CM Board PN {} is not implemented.".format(boardpn)
+    verbose("Using " + SptChassis + " Hidden Config Settings")
+    unsupported = UnsupportedProperties([property for property, propval in proplist], True)
+    if (unsupported):
+        return UnsupportedMessage(unsupported)
+    bytekey = ConvertKey(key)
 
-    completion = CMConfigCompCodes.get(outbytes[completion_code_idx], 'Unknown response')
-    if (not (completion == 'Success')):
-        return "Unsuccessful reponse: {} = {} ".format(outbytes[completion_code_idx], completion)
+    batches = [[]]
+    batchlen = 0
+    for property, propval in proplist:
+        verbose("Hidden Config Property {} will be set to {}".format(property.name, property.get_enum_val(propval)))
+        proplen = 1 + property.len
+        if (batches[-1] and (batchlen + proplen > HiddenConfigBatchMaxBytes)):
+            batches.append([])
+            batchlen = 0
+        batches[-1].append((property.name, "{} {}".format(property.id, ConfigValueBytes(property, propval))))
+        batchlen += proplen
+
+    completion = ""
+    for index, batch in enumerate(batches):
+        refresh = False
+        for attempt in range(2):
+            if (refresh or (not bytepasscode)):
+                bytepasscode = GetCachedPasscode(key, refresh)
+                if (not bytepasscode.startswith('0x')):
+                    return PartialWriteMessage(bytepasscode, batches, index)
+            # Cmd = 0x03  ConfigStructVersion = 0x01, then the number of properties to set
+            command = "{} 0x03 0x01 {} {} {} {} {}".format(hidden_config_preamble, bytekey, bytepasscode, hex(len(batch)), ' '.join(propbytes for name, propbytes in batch), ending)
+            stdout = call_ipmitool(command)
+
+            if (use_raw_output):
+                return stdout
+    
+            # check the completion codes
+            outbytes = stdout.split()
+            if (len(outbytes) == 0):
+                # bad connection, message in stderr
+                return PartialWriteMessage("Ipmitool Error.  Verify HOST, user, and password are correct", batches, index)
+
+            if (outbytes[completion_code_idx] == '83'):
+                # the passcode expired, get a new one and try again
+                verbose("Passcode was not accepted, getting a new one.")
+                refresh = True
+                continue
+            break
+        completion = CMConfigCompCodes.get(outbytes[completion_code_idx], 'Unknown response')
+        if (not (completion == 'Success')):
+            return PartialWriteMessage("Unsuccessful reponse: {} = {} ".format(outbytes[completion_code_idx], completion), batches, index)
 
     return (completion)
     
@@ -1586,7 +2700,893 @@ def CMPowerCycle(arglist):
         return "Unsuccessful reponse: {} = {} ".format(outbytes[completion_code_idx], completion)
     
     return notimp
-    
+
+# Send the RMCP presence pings to every address and collect the ones that answer.
+# Uses one non-blocking UDP socket so thousands of addresses can be swept in a few seconds.
+def RMCPSweep(hostlist, timeout):
+    responders = {}
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+
+    def drain(wait):
+        readable, _, _ = select.select([sock], [], [], wait)
+        while (readable):
+            try:
+                data, addr = sock.recvfrom(1024)
+            except (BlockingIOError, OSError):
+                break
+            host = addr[0]
+            if ((len(data) < 4) or (data[0] != 0x06)):
+                continue  # not an RMCP packet
+            msgclass = data[3] & 0x1f
+            if ((msgclass == 0x06) and (len(data) > 8) and (data[8] == 0x40)):
+                responders.setdefault(host, set()).add('asf')
+            elif ((msgclass == 0x07) and (len(data) > 20) and (data[19] == 0x38) and (data[20] == 0x00)):
+                # IPMI response to Get Channel Auth Capabilities with a good completion code
+                responders.setdefault(host, set()).add('ipmi')
+            readable, _, _ = select.select([sock], [], [], 0)
+
+    try:
+        for host in hostlist:
+            for packet in (rmcp_presence_ping, rmcp_get_chan_auth_cap):
+                select.select([], [sock], [], timeout)
+                try:
+                    sock.sendto(packet, (host, rmcp_port))
+                except OSError as err:
+                    verbose("RMCPSweep: send to {} failed: {}".format(host, err))
+            drain(0)
+        # collect the late answers
+        deadline = time.monotonic() + timeout
+        while (time.monotonic() < deadline):
+            drain(deadline - time.monotonic())
+    finally:
+        sock.close()
+    return responders
+
+# turn "name = value" lines from the Get* commands into a dict
+def ParseInfoOutput(output):
+    values = {}
+    for line in output.splitlines():
+        if (' = ' in line):
+            name, value = line.split(' = ', 1)
+            values[name.strip()] = value.strip()
+    return values
+
+def CMDiscover(arglist):
+    cmdhelp = CMCommandHelpDetailed['Discover'.lower()]
+    networks = []
+    outfilename = ""
+    timeout = 2.0
+    threads = fleet_threads
+    if (arglist and (len(arglist) > 0)):
+        for arg in arglist:
+            if (len(arg.split('=')) < 2):  # argument is not well-formed
+                errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
+                return (errmsg + cmdhelp)
+            argname, value = arg.split('=', 1)
+            if (argname == 'cidr'):
+                try:
+                    networks.append(ipaddress.ip_network(value, strict=False))
+                except ValueError:
+                    return "The value {} is not a valid CIDR range.\n".format(value) + cmdhelp
+            elif (argname == 'outfile'):
+                outfilename = value
+            elif (argname == 'timeout'):
+                timeout = float(value)
+            elif (argname == 'threads'):
+                threads = int(value)
+            else:
+                return (cmdhelp)
+    if ((not networks) or (not outfilename)):
+        return (cmdhelp)
+
+    hostlist = []
+    for network in networks:
+        if (network.num_addresses == 1):
+            hostlist.append(str(network.network_address))
+        else:
+            hostlist.extend(str(ip) for ip in network.hosts())
+    print("Sweeping {} addresses with RMCP presence ping.".format(len(hostlist)))
+    starttime = time.monotonic()
+    responders = RMCPSweep(hostlist, timeout)
+    print("{} of {} addresses responded in {:.1f} seconds.".format(len(responders), len(hostlist), time.monotonic() - starttime))
+
+    def identify(host):
+        boardpn, boardrev = BoardPNAndRev()
+        devinfo = ParseInfoOutput(CMGetDeviceId([]))
+        return boardpn, boardrev, devinfo
+
+    results = CallOnHosts(sorted(responders, key=ipaddress.ip_address), identify, threads)
+    inventory = configparser.ConfigParser()
+    unsupported = 0
+    for host in sorted(results, key=ipaddress.ip_address):
+        if (isinstance(results[host], str)):
+            verbose("Discover: {} failed: {}".format(host, results[host]))
+            continue
+        boardpn, boardrev, devinfo = results[host]
+        SptChassis = GetSptChassisByPN(boardpn)
+        # the fleet commands can't run on a chassis they don't know, so leave it out of the inventory
+        if (not SptChassis):
+            verbose("Discover: {} has Board PN {}, it isn't a supported chassis".format(host, boardpn))
+            unsupported += 1
+            continue
+        inventory.add_section(host)
+        inventory.set(host, 'Platform', SptChassis)
+        inventory.set(host, 'Platform Name', CMAllPlatNames[SptChassis])
+        inventory.set(host, 'Board PN', boardpn)
+        inventory.set(host, 'Board Rev', boardrev)
+        inventory.set(host, 'CM FW Version', devinfo.get('FW Main Version', 'Unknown'))
+        inventory.set(host, 'Responds To', ','.join(sorted(responders[host])))
+
+    try:
+        with open(outfilename, 'w') as outfile:
+            inventory.write(outfile)
+    except OSError:
+        return "Unable to open {} for writing.".format(outfilename)
+    return "Found {} supported chassis, written to {}. {} hosts were not supported chassis.".format(
+        len(inventory.sections()), outfilename, unsupported)
+
+# Read the Config Properties, FRU Settings and (if the static key is given) Hidden Config Properties
+# of the current target into one ConfigParser, the same way SaveConfig does.
+# Returns an error string if any of the reads fail.
+def ReadChassisState(key=""):
+    allconfigs = configparser.ConfigParser()
+    configout = CMGetConfig([], True)
+    if (not configout.startswith('[')):
+        return configout
+    allconfigs.read_string(configout)
+    fruout = CMGetFRU([], True)
+    if (not fruout.startswith('[')):
+        return fruout
+    allconfigs.read_string(fruout)
+    if (key):
+        passout = CMGetPasscode(["key={}".format(key)])
+        if (not passout.startswith("Passcode")):
+            return passout
+        passcode = passout.split('=')[1].strip()
+        hiddenout = CMGetHiddenConfig(["key={}".format(key), "passcode={}".format(passcode)], True)
+        if (not hiddenout.startswith('[')):
+            return hiddenout
+        allconfigs.read_string(hiddenout)
+    return allconfigs
+
+# The snapshot store has one column per property name, prefixed by the section it was read from
+SnapshotSections = {
+    'ConfigProperties': 'cfg_',
+    'HiddenConfigProperties': 'hid_',
+    'FRUSettings': 'fru_',
+}
+
+def SnapshotColumns():
+    columns = []
+    allsettings = [('cfg_', settings) for settings in CMAllConfigSettings.values()]
+    allsettings.append(('hid_', CMAllHiddenSettings))
+    allsettings += [('fru_', settings) for settings in CMAllFRUSettings.values()]
+    for prefix, settings in allsettings:
+        for prop in settings.values():
+            column = prefix + prop.name
+            if (column not in columns):
+                columns.append(column)
+    return columns
+
+def OpenSnapshotStore(dbfilename):
+    db = sqlite3.connect(dbfilename)
+    db.execute("CREATE TABLE IF NOT EXISTS snapshot (sweep TEXT, host TEXT, platform TEXT, boardpn TEXT, "
+               "status TEXT, PRIMARY KEY (sweep, host))")
+    db.execute("CREATE INDEX IF NOT EXISTS snapshot_host ON snapshot (host, sweep)")
+    # add the columns for any properties defined since the store was created
+    existing = [row[1] for row in db.execute("PRAGMA table_info(snapshot)")]
+    for column in SnapshotColumns():
+        if (column not in existing):
+            db.execute('ALTER TABLE snapshot ADD COLUMN "{}"'.format(column))
+    return db
+
+def CMSnapshot(arglist):
+    cmdhelp = CMCommandHelpDetailed['Snapshot'.lower()]
+    inventoryfile = ""
+    dbfilename = ""
+    key = ""
+    threads = fleet_threads
+    if (arglist and (len(arglist) > 0)):
+        for arg in arglist:
+            if (len(arg.split('=')) < 2):  # argument is not well-formed
+                errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
+                return (errmsg + cmdhelp)
+            argname, value = arg.split('=', 1)
+            if (argname == 'inventory'):
+                inventoryfile = value
+            elif (argname == 'db'):
+                dbfilename = value
+            elif (argname == 'key'):
+                key = value
+            elif (argname == 'threads'):
+                threads = int(value)
+            else:
+                return (cmdhelp)
+    if ((not inventoryfile) or (not dbfilename)):
+        return (cmdhelp)
+    if (key and (not (len(key) == 8))):
+        return("The static key must be exactly 8 characters")
+
+    try:
+        hostlist = ReadInventory(inventoryfile)
+    except OSError:
+        return "Unable to open {} for reading.".format(inventoryfile)
+
+    sweep = time.strftime('%Y-%m-%d %H:%M:%S')
+    print("Taking snapshot {} of {} hosts.".format(sweep, len(hostlist)))
+    results = CallOnHosts(hostlist, lambda host: ReadChassisState(key), threads)
+
+    db = OpenSnapshotStore(dbfilename)
+    columns = SnapshotColumns()
+    failed = 0
+    rows = []
+    for host in hostlist:
+        state = results[host]
+        row = dict.fromkeys(columns)
+        if (isinstance(state, str)):
+            failed += 1
+            status = state.strip()
+            platform = boardpn = None
+        else:
+            status = 'Success'
+            boardpn = state.get('ConfigProperties', 'Board PN', fallback=None)
+            platform = GetSptChassisByPN(boardpn)
+            for section, prefix in SnapshotSections.items():
+                if (not state.has_section(section)):
+                    continue
+                for column in columns:
+                    if (column.startswith(prefix) and state.has_option(section, column[len(prefix):])):
+                        value = state.get(section, column[len(prefix):])
+                        # FRU fields are always strings, keep their leading zeros
+                        if ((prefix != 'fru_') and value.isdigit()):
+                            value = int(value)
+                        row[column] = value
+        rows.append([sweep, host, platform, boardpn, status] + [row[column] for column in columns])
+
+    collist = ', '.join('"{}"'.format(column) for column in ['sweep', 'host', 'platform', 'boardpn', 'status'] + columns)
+    marks = ', '.join('?' * (len(columns) + 5))
+    with db:
+        db.executemany("INSERT OR REPLACE INTO snapshot ({}) VALUES ({})".format(collist, marks), rows)
+    db.close()
+    return "Snapshot {} saved to {}: {} hosts, {} failed.".format(sweep, dbfilename, len(hostlist), failed)
+
+# Find which chassis in a snapshot have the given property values
+def CMQuerySnapshot(arglist):
+    cmdhelp = CMCommandHelpDetailed['QuerySnapshot'.lower()]
+    dbfilename = ""
+    sweep = ""
+    filters = []
+    if (arglist and (len(arglist) > 0)):
+        for arg in arglist:
+            if (len(arg.split('=')) < 2):  # argument is not well-formed
+                errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
+                return (errmsg + cmdhelp)
+            argname, value = arg.split('=', 1)
+            if (argname == 'db'):
+                dbfilename = value
+            elif (argname == 'sweep'):
+                sweep = value
+            else:
+                filters.append((argname, value))
+    if (not dbfilename):
+        return (cmdhelp)
+    if (not os.path.isfile(dbfilename)):
+        return "The snapshot store {} does not exist.".format(dbfilename)
+
+    db = OpenSnapshotStore(dbfilename)
+    columns = SnapshotColumns()
+    if (not sweep):
+        sweep = db.execute("SELECT MAX(sweep) FROM snapshot").fetchone()[0]
+    where = ["sweep = ?"]
+    params = [sweep]
+    lowercolumns = {column.lower(): column for column in columns}
+    for propname, value in filters:
+        # accept the bare property name, config properties are searched before hidden and FRU
+        column = lowercolumns.get(propname.lower())
+        for prefix in SnapshotSections.values():
+            if (not column):
+                column = lowercolumns.get((prefix + propname).lower())
+        if (not column):
+            db.close()
+            return "No property named {} is in the snapshot store.\n".format(propname) + cmdhelp
+        # index a property the first time it is queried, so later queries on it don't scan every row
+        with db:
+            db.execute('CREATE INDEX IF NOT EXISTS "snapshot_{0}" ON snapshot ("{0}", sweep)'.format(column))
+        where.append('"{}" = ?'.format(column))
+        if (column.startswith('fru_') or (not value.isdigit())):
+            params.append(value)
+        else:
+            params.append(int(value))
+
+    output = "Snapshot {}:\n".format(sweep)
+    count = 0
+    for host, platform, status in db.execute("SELECT host, platform, status FROM snapshot WHERE {} ORDER BY host".format(' AND '.join(where)), params):
+        output += "{:20} {:14} {}\n".format(host, str(platform), status)
+        count += 1
+    output += "{} chassis matched.".format(count)
+    db.close()
+    return output
+
+# FRU data only changes when the CM board is repaired, so the compliance cache keeps a host's
+# FRU values for as long as this field reads back the same.
+FRUFingerprintField = 'ChassisBoardSerialNumber'
+
+def SameValue(expected, actual):
+    if (expected.isdigit() and actual.isdigit()):
+        return int(expected) == int(actual)
+    return expected.strip() == actual.strip()
+
+def CMCompliance(arglist):
+    cmdhelp = CMCommandHelpDetailed['Compliance'.lower()]
+    inventoryfile = ""
+    baselinefile = ""
+    cachefilename = ""
+    key = ""
+    threads = fleet_threads
+    if (arglist and (len(arglist) > 0)):
+        for arg in arglist:
+            if (len(arg.split('=')) < 2):  # argument is not well-formed
+                errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
+                return (errmsg + cmdhelp)
+            argname, value = arg.split('=', 1)
+            if (argname == 'inventory'):
+                inventoryfile = value
+            elif (argname == 'baseline'):
+                baselinefile = value
+            elif (argname == 'cache'):
+                cachefilename = value
+            elif (argname == 'key'):
+                key = value
+            elif (argname == 'threads'):
+                threads = int(value)
+            else:
+                return (cmdhelp)
+    if ((not inventoryfile) or (not baselinefile)):
+        return (cmdhelp)
+
+    # the baseline has sections named <platform>:<section>, ex. [Hubble:ConfigProperties]
+    baseline = configparser.ConfigParser(interpolation=None)
+    baseline.optionxform = str  # keep the property names as written
+    try:
+        if (not baseline.read(baselinefile)):
+            return "Unable to open {} for reading.".format(baselinefile)
+    except configparser.Error as err:
+        return "Unable to parse the INI file {}.\n{}".format(baselinefile, err)
+    desired = {}
+    for sectionname in baseline.sections():
+        if (len(sectionname.split(':')) != 2):
+            return "The baseline section {} must be named <platform>:<section>.".format(sectionname)
+        platform, section = sectionname.split(':')
+        if (platform not in CMAllConfigSettings):
+            return "The baseline platform {} is not one of {}.".format(platform, list(CMAllConfigSettings))
+        if (section not in SnapshotSections):
+            return "The baseline section {} is not one of {}.".format(section, list(SnapshotSections))
+        if ((section == 'HiddenConfigProperties') and (not key)):
+            return "The baseline has Hidden Config Properties, the key argument is required."
+        desired.setdefault(platform, {})[section] = dict(baseline.items(sectionname))
+
+    cache = configparser.ConfigParser(interpolation=None)
+    cache.optionxform = str
+    if (cachefilename and os.path.isfile(cachefilename)):
+        cache.read(cachefilename)
+    try:
+        hostlist = ReadInventory(inventoryfile)
+    except OSError:
+        return "Unable to open {} for reading.".format(inventoryfile)
+
+    def check(host):
+        allconfigs = configparser.ConfigParser(interpolation=None)
+        allconfigs.optionxform = str
+        configout = CMGetConfig([], True)
+        if (not configout.startswith('[')):
+            return configout
+        allconfigs.read_string(configout)
+        platform = GetSptChassisByPN(allconfigs.get('ConfigProperties', 'Board PN'))
+        if (platform not in desired):
+            return allconfigs, platform, None
+        frufields = list(desired[platform].get('FRUSettings', {}))
+        fruvalues = None
+        if (frufields):
+            fingerprint = None
+            if (cache.has_section(host)):
+                # one FRU read tells if the cached values are still good
+                fruout = CMGetFRU([], True, [FRUFingerprintField])
+                if (not fruout.startswith('[')):
+                    return fruout
+                fingerprint = ParseInfoOutput(fruout).get(FRUFingerprintField)
+                cached = dict(cache.items(host))
+                if ((cached.get(FRUFingerprintField) == fingerprint) and all((field in cached) for field in frufields)):
+                    verbose("Compliance: using cached FRU values for {}".format(host))
+                    fruvalues = cached
+            if (fruvalues is None):
+                fruout = CMGetFRU([], True, frufields + [FRUFingerprintField])
+                if (not fruout.startswith('[')):
+                    return fruout
+                fruvalues = ParseInfoOutput(fruout)
+            allconfigs.read_dict({'FRUSettings': fruvalues})
+        if ('HiddenConfigProperties' in desired[platform]):
+            passout = CMGetPasscode(["key={}".format(key)])
+            if (not passout.startswith("Passcode")):
+                return passout
+            passcode = passout.split('=')[1].strip()
+            hiddenout = CMGetHiddenConfig(["key={}".format(key), "passcode={}".format(passcode)], True)
+            if (not hiddenout.startswith('[')):
+                return hiddenout
+            allconfigs.read_string(hiddenout)
+        return allconfigs, platform, fruvalues
+
+    print("Checking {} hosts against baseline {}.".format(len(hostlist), baselinefile))
+    results = CallOnHosts(hostlist, check, threads)
+
+    # group the deviations by property, then by the value found
+    deviations = {}
+    failed = []
+    skipped = []
+    deviating = set()
+    for host in hostlist:
+        if (isinstance(results[host], str)):
+            failed.append("{}: {}".format(host, results[host].strip()))
+            continue
+        allconfigs, platform, fruvalues = results[host]
+        if (platform not in desired):
+            skipped.append(host)
+            continue
+        if (fruvalues is not None):
+            if (cache.has_section(host)):
+                cache.remove_section(host)
+            cache.read_dict({host: fruvalues})
+        for section in desired[platform]:
+            for propname, expected in desired[platform][section].items():
+                actual = allconfigs.get(section, propname, fallback='<missing>')
+                if (not SameValue(expected, actual)):
+                    deviations.setdefault((section, propname, expected), {}).setdefault(actual, []).append(host)
+                    deviating.add(host)
+
+    if (cachefilename):
+        try:
+            with open(cachefilename, 'w') as cachefile:
+                cache.write(cachefile)
+        except OSError:
+            print("Unable to write the compliance cache {}.".format(cachefilename))
+
+    output = "Compliance: {} hosts checked, {} deviate, {} failed, {} with no baseline for their platform.\n".format(
+        len(hostlist), len(deviating), len(failed), len(skipped))
+    for (section, propname, expected) in sorted(deviations):
+        output += "{} {} (expected {}):\n".format(section, propname, expected)
+        for actual, hosts in sorted(deviations[(section, propname, expected)].items(), key=lambda item: -len(item[1])):
+            output += "    {:20} {:4} hosts: {}\n".format(actual, len(hosts), ', '.join(sorted(hosts)))
+    for failure in failed:
+        output += "FAILED {}\n".format(failure)
+    return output
+
+# SaveConfig/Reconfigure for a whole inventory.  The INI files go in one zip archive, one member per host,
+# and the result for each host is kept in <archive>.status.ini so a campaign can be run again to resume.
+def CMCampaign(arglist):
+    cmdhelp = CMCommandHelpDetailed['Campaign'.lower()]
+    mode = ""
+    inventoryfile = ""
+    archivename = ""
+    threads = fleet_threads
+    if (arglist and (len(arglist) > 0)):
+        for arg in arglist:
+            if (len(arg.split('=')) < 2):  # argument is not well-formed
+                errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
+                return (errmsg + cmdhelp)
+            argname, value = arg.split('=', 1)
+            if (argname == 'mode'):
+                mode = value.lower()
+            elif (argname == 'inventory'):
+                inventoryfile = value
+            elif (argname == 'archive'):
+                archivename = value
+            elif (argname == 'threads'):
+                threads = int(value)
+            else:
+                return (cmdhelp)
+    if ((mode not in ('save', 'restore')) or (not archivename)):
+        return (cmdhelp)
+    if ((mode == 'save') and (not inventoryfile)):
+        return "The inventory argument is required to save.\n" + cmdhelp
+
+    statusfilename = archivename + '.status.ini'
+    status = configparser.ConfigParser(interpolation=None)
+    status.read(statusfilename)
+
+    def setstatus(host, result):
+        if (not status.has_section(host)):
+            status.add_section(host)
+        status.set(host, mode, result.strip().replace('\n', ' '))
+        status.set(host, mode + ' time', time.strftime('%Y-%m-%d %H:%M:%S'))
+        with open(statusfilename, 'w') as statusfile:
+            status.write(statusfile)
+
+    def done(host):
+        return status.get(host, mode, fallback='').startswith('Success')
+
+    if (mode == 'save'):
+        try:
+            hostlist = ReadInventory(inventoryfile)
+        except OSError:
+            return "Unable to open {} for reading.".format(inventoryfile)
+        try:
+            archive = zipfile.ZipFile(archivename, 'a', zipfile.ZIP_DEFLATED)
+        except (OSError, zipfile.BadZipFile):
+            return "Unable to open the archive {} for writing.".format(archivename)
+        # a zip member can't be replaced, keep the snapshot of a host that is already in the archive
+        archived = set(archive.namelist())
+        for host in hostlist:
+            if ((not done(host)) and ((host + '.ini') in archived)):
+                verbose("{} is already in {}, keeping the saved snapshot".format(host, archivename))
+                setstatus(host, 'Success, already in the archive')
+        todo = [host for host in hostlist if (not done(host))]
+        print("Saving {} hosts to {}, {} were already saved.".format(len(todo), archivename, len(hostlist) - len(todo)))
+
+        def saved(host, reconfigprops):
+            if (isinstance(reconfigprops, str)):
+                setstatus(host, reconfigprops)
+                return
+            inistring = io.StringIO()
+            reconfigprops.write(inistring)
+            archive.writestr(host + '.ini', inistring.getvalue())
+            setstatus(host, 'Success')
+
+        try:
+            CallOnHosts(todo, lambda host: BuildReconfigProps(), threads, saved)
+        finally:
+            archive.close()
+    else:
+        try:
+            archive = zipfile.ZipFile(archivename, 'r')
+        except (OSError, zipfile.BadZipFile):
+            return "Unable to open the archive {} for reading.".format(archivename)
+        inifiles = {}
+        with archive:
+            for member in archive.namelist():
+                if (member.endswith('.ini')):
+                    inifiles[member[:-len('.ini')]] = archive.read(member).decode('utf-8')
+        hostlist = sorted(inifiles)
+        if (inventoryfile):
+            try:
+                hostlist = [host for host in ReadInventory(inventoryfile) if (host in inifiles)]
+            except OSError:
+                return "Unable to open {} for reading.".format(inventoryfile)
+        todo = [host for host in hostlist if (not done(host))]
+        print("Restoring {} hosts from {}, {} were already restored.".format(len(todo), archivename, len(hostlist) - len(todo)))
+
+        def restore(host):
+            reconfigprops = configparser.ConfigParser(interpolation=None)
+            reconfigprops.read_string(inifiles[host])
+            return ApplyReconfigProps(reconfigprops)
+
+        CallOnHosts(todo, restore, threads, setstatus)
+
+    succeeded = [host for host in hostlist if done(host)]
+    output = "Campaign {}: {} of {} hosts succeeded.\n".format(mode, len(succeeded), len(hostlist))
+    for host in hostlist:
+        if (not done(host)):
+            output += "FAILED {}: {}\n".format(host, status.get(host, mode, fallback='Not run'))
+    if (len(succeeded) < len(hostlist)):
+        output += "Run the same command again to retry only the failed hosts."
+    return output
+
+# The GetSensorInfo and GetPSUInfo fields kept by the Sample command
+SensorSampleFields = ['Chassis Inlet Temp', 'Chassis Exhaust Temp', 'Sled Power Reading', 'Sled Iin Amps Reading',
+                      'Sled Vin Volt Reading', 'PSU Presence', 'PSU Fault', 'PSU AC Loss'] + ['PSU{} Pout'.format(n) for n in range(1, 9)]
+PSUSampleFields = ['PSU Mismatch Snsr', 'PSU Redund Snsr', 'PSU Config - X', 'PSU Config - N']
+# the fan readings follow the Fan Control Scheme byte in GetSensorInfo, 2 bytes per fan, LSB first
+SensorFanStart = 33
+
+class ChassisTelemetry:
+    """The ring buffers of every sampled metric for one chassis"""
+
+    def __init__(self, size):
+        self.size = size
+        self.metrics = {}   # metric name: RingBuffer
+        self.lasttime = 0.0
+        self.lasterror = ""
+
+    def add(self, when, values):
+        for name, value in values.items():
+            if (name not in self.metrics):
+                self.metrics[name] = RingBuffer(self.size)
+            self.metrics[name].append(when, value)
+        self.lasttime = when
+        self.lasterror = ""
+
+# decode the numeric fields of a GetSensorInfo/GetPSUInfo response into a dict of name: number
+def DecodeInfoNumbers(outbytes, infotable, fields):
+    values = {}
+    for pos, cinfo in infotable.items():
+        if ((cinfo.name not in fields) or (pos + cinfo.len > len(outbytes))):
+            continue
+        value = cinfo.get_value(outbytes[pos:pos+cinfo.len])
+        if (cinfo.data == 'bit'):
+            values[cinfo.name] = int(value, 16)
+        else:
+            values[cinfo.name] = int(value)
+    return values
+
+# Read GetSensorInfo and GetPSUInfo from the current target.
+# Returns a dict of metric name: number or an error string.
+def ReadTelemetry():
+    values = {}
+    for command, infotable, fields in (('0x30 0x16', CMSensorInfo, SensorSampleFields), ('0x30 0x1f', CMPSUInfo, PSUSampleFields)):
+        stdout = call_ipmitool(command)
+        outbytes = stdout.split()
+        if (len(outbytes) < 4):
+            # no connection or an error completion code
+            return "Command {} failed: {}".format(command, stdout.strip())
+        outbytes = outbytes[:int(outbytes[2], 16) + 3]  # just the data bytes
+        values.update(DecodeInfoNumbers(outbytes, infotable, fields))
+        if (infotable is CMSensorInfo):
+            for fan, pos in enumerate(range(SensorFanStart, len(outbytes) - 1, 2), 1):
+                values['Fan{} Reading'.format(fan)] = int(outbytes[pos + 1] + outbytes[pos], 16)
+    return values
+
+# Read the telemetry of every host, in parallel if there is an inventory, and add it to the ring buffers
+def SampleTelemetry(hostlist, telemetry, threads):
+    if (hostlist):
+        results = CallOnHosts(hostlist, lambda host: ReadTelemetry(), threads)
+    else:
+        results = {CurrentTarget(): ReadTelemetry()}
+    now = time.time()
+    for host, values in results.items():
+        if (host not in telemetry):
+            continue
+        if (isinstance(values, str)):
+            telemetry[host].lasterror = values
+        else:
+            telemetry[host].add(now, values)
+    return now
+
+def CMSample(arglist):
+    cmdhelp = CMCommandHelpDetailed['Sample'.lower()]
+    inventoryfile = ""
+    interval = 10.0
+    samples = 0
+    history = 360
+    window = 300.0
+    recent = 0
+    threads = fleet_threads
+    if (arglist and (len(arglist) > 0)):
+        for arg in arglist:
+            if (len(arg.split('=')) < 2):  # argument is not well-formed
+                errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
+                return (errmsg + cmdhelp)
+            argname, value = arg.split('=', 1)
+            try:
+                if (argname == 'inventory'):
+                    inventoryfile = value
+                elif (argname == 'interval'):
+                    interval = float(value)
+                elif (argname == 'samples'):
+                    samples = int(value)
+                elif (argname == 'history'):
+                    history = int(value)
+                elif (argname == 'window'):
+                    window = float(value)
+                elif (argname == 'recent'):
+                    recent = int(value)
+                elif (argname == 'threads'):
+                    threads = int(value)
+                else:
+                    return (cmdhelp)
+            except ValueError:
+                return "The value of {} must be a number.\n".format(argname) + cmdhelp
+    if (history < 1):
+        return "The history must be at least 1 sample.\n" + cmdhelp
+
+    hostlist = []
+    if (inventoryfile):
+        try:
+            hostlist = ReadInventory(inventoryfile)
+        except OSError:
+            return "Unable to open {} for reading.".format(inventoryfile)
+        telemetry = {host: ChassisTelemetry(history) for host in hostlist}
+    else:
+        telemetry = {CurrentTarget(): ChassisTelemetry(history)}
+
+    print("Sampling {} chassis every {} seconds. Press Ctrl-C to stop.".format(len(telemetry), interval))
+    fmtline = "{:20} {:>6} {:>8} {:>6} {:>7}"
+    count = 0
+    try:
+        while ((samples == 0) or (count < samples)):
+            starttime = time.monotonic()
+            SampleTelemetry(hostlist, telemetry, threads)
+            count += 1
+            print(time.strftime('%H:%M:%S') + ' ' + fmtline.format("Host", "Inlet", "Exhaust", "Power", "Redund"))
+            for host, chassis in telemetry.items():
+                if (chassis.lasterror):
+                    print("         {:20} {}".format(host, chassis.lasterror))
+                    continue
+                lastvals = [chassis.metrics[name].last() if name in chassis.metrics else '-' for name in
+                            ('Chassis Inlet Temp', 'Chassis Exhaust Temp', 'Sled Power Reading', 'PSU Redund Snsr')]
+                print("         " + fmtline.format(host, *['{:g}'.format(v) if (v != '-') else v for v in lastvals]))
+            if ((samples == 0) or (count < samples)):
+                time.sleep(max(0.0, interval - (time.monotonic() - starttime)))
+    except KeyboardInterrupt:
+        print("Sampling stopped after {} samples.".format(count))
+
+    return TelemetrySummary(telemetry, window, recent)
+
+def TelemetrySummary(telemetry, window, recent):
+    now = time.time()
+    output = "Telemetry summary over the last {:g} seconds:\n".format(window)
+    fmtline = "    {:24} {:>8} {:>8} {:>8} {:>10} {:>8}\n"
+    for host, chassis in telemetry.items():
+        output += "{}:\n".format(host)
+        if (chassis.lasterror):
+            output += "    Last error: {}\n".format(chassis.lasterror)
+        output += fmtline.format("Metric", "Last", "Min", "Max", "Avg", "Samples")
+        for name, ring in chassis.metrics.items():
+            stats = ring.window_stats(window, now)
+            if (not stats):
+                continue
+            minval, maxval, avgval, count = stats
+            output += fmtline.format(name, '{:g}'.format(ring.last()), '{:g}'.format(minval), '{:g}'.format(maxval), '{:.2f}'.format(avgval), count)
+            if (recent):
+                output += "        recent: {}\n".format(' '.join('{:g}'.format(value) for when, value in ring.recent(recent)))
+    return output
+
+# Prometheus metric families for the sampled readings: name: (metric, help)
+# PSU<n> Pout and Fan<n> Reading are exported with a psu or fan label.
+PrometheusMetrics = {
+    'Chassis Inlet Temp': ('cm_inlet_temp_celsius', 'Chassis inlet temperature.'),
+    'Chassis Exhaust Temp': ('cm_exhaust_temp_celsius', 'Chassis exhaust temperature.'),
+    'Sled Power Reading': ('cm_sled_power_watts', 'Total sled power reading.'),
+    'Sled Iin Amps Reading': ('cm_sled_input_amps', 'Sled input current reading.'),
+    'Sled Vin Volt Reading': ('cm_sled_input_volts', 'Sled input voltage reading.'),
+    'PSU Presence': ('cm_psu_presence_mask', 'Bitmask of the PSUs that are present.'),
+    'PSU Fault': ('cm_psu_fault_mask', 'Bitmask of the PSUs with a fault.'),
+    'PSU AC Loss': ('cm_psu_ac_loss_mask', 'Bitmask of the PSUs that lost AC.'),
+    'PSU Mismatch Snsr': ('cm_psu_mismatch_sensor', 'PSU mismatch sensor bits.'),
+    'PSU Redund Snsr': ('cm_psu_redundancy_sensor', 'PSU redundancy sensor bits.'),
+    'PSU Config - X': ('cm_psu_config_required', 'Number of PSUs required (X of X+N).'),
+    'PSU Config - N': ('cm_psu_config_redundant', 'Number of redundant PSUs (N of X+N).'),
+    'PSU Pout': ('cm_psu_output_watts', 'PSU output power.'),
+    'Fan Reading': ('cm_fan_reading', 'Chassis fan reading.'),
+}
+
+def PrometheusLabels(labels):
+    return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in labels.items())
+
+# Build the /metrics page from the last sampled values, so a scrape never waits on ipmitool
+def PrometheusText(telemetry, hostlabels):
+    families = {}
+    for host, chassis in telemetry.items():
+        labels = {'host': host}
+        labels.update(hostlabels.get(host, {}))
+        families.setdefault('cm_up', []).append((labels, 0 if (chassis.lasterror or (not chassis.lasttime)) else 1))
+        if (chassis.lasttime):
+            families.setdefault('cm_last_sample_timestamp_seconds', []).append((labels, chassis.lasttime))
+        for name, ring in chassis.metrics.items():
+            extra = {}
+            if (name.startswith('PSU') and name.endswith(' Pout')):
+                extra = {'psu': name[3:-len(' Pout')]}
+                name = 'PSU Pout'
+            elif (name.startswith('Fan') and name.endswith(' Reading')):
+                extra = {'fan': name[3:-len(' Reading')]}
+                name = 'Fan Reading'
+            if (name not in PrometheusMetrics):
+                continue
+            metriclabels = dict(labels)
+            metriclabels.update(extra)
+            families.setdefault(PrometheusMetrics[name][0], []).append((metriclabels, ring.last()))
+
+    helptext = {metric: helpstr for metric, helpstr in PrometheusMetrics.values()}
+    helptext['cm_up'] = 'Whether the last poll of the chassis succeeded.'
+    helptext['cm_last_sample_timestamp_seconds'] = 'Time of the last successful poll.'
+    output = ""
+    for metric, samples in families.items():
+        output += "# HELP {} {}\n# TYPE {} gauge\n".format(metric, helptext[metric], metric)
+        for labels, value in samples:
+            output += "{}{{{}}} {}\n".format(metric, PrometheusLabels(labels), value)
+    return output
+
+def CMExporter(arglist):
+    cmdhelp = CMCommandHelpDetailed['Exporter'.lower()]
+    inventoryfile = ""
+    address = "127.0.0.1"
+    port = 9723
+    interval = 30.0
+    threads = fleet_threads
+    if (arglist and (len(arglist) > 0)):
+        for arg in arglist:
+            if (len(arg.split('=')) < 2):  # argument is not well-formed
+                errmsg = "The argument name and value must be separated by an = sign -> '{}'\n".format(arg)
+                return (errmsg + cmdhelp)
+            argname, value = arg.split('=', 1)
+            try:
+                if (argname == 'inventory'):
+                    inventoryfile = value
+                elif (argname == 'address'):
+                    address = value
+                elif (argname == 'port'):
+                    port = int(value)
+                elif (argname == 'interval'):
+                    interval = float(value)
+                elif (argname == 'threads'):
+                    threads = int(value)
+                else:
+                    return (cmdhelp)
+            except ValueError:
+                return "The value of {} must be a number.\n".format(argname) + cmdhelp
+
+    hostlist = []
+    if (inventoryfile):
+        try:
+            hostlist = ReadInventory(inventoryfile)
+        except OSError:
+            return "Unable to open {} for reading.".format(inventoryfile)
+        telemetry = {host: ChassisTelemetry(1) for host in hostlist}
+    else:
+        telemetry = {CurrentTarget(): ChassisTelemetry(1)}
+
+    # the labels only change with a FRU repair, read them until they are known
+    hostlabels = {}
+    def readlabels(host):
+        configout = CMGetConfig([], True)
+        if (not configout.startswith('[')):
+            return configout
+        values = ParseInfoOutput(configout)
+        SptChassis = GetSptChassisByPN(values.get('Board PN', ''))
+        return {'board_pn': values.get('Board PN', ''), 'platform': CMAllPlatNames.get(SptChassis, 'Unknown'),
+                'service_tag': values.get('ChassisServiceTag', '')}
+
+    def updatelabels():
+        missing = [host for host in telemetry if (host not in hostlabels)]
+        if (not missing):
+            return
+        if (hostlist):
+            results = CallOnHosts(missing, readlabels, threads)
+        else:
+            results = {CurrentTarget(): readlabels(CurrentTarget())}
+        for host, labels in results.items():
+            if (isinstance(labels, dict)):
+                hostlabels[host] = labels
+
+    page = {'text': ""}
+    def poller():
+        while (True):
+            starttime = time.monotonic()
+            try:
+                updatelabels()
+                SampleTelemetry(hostlist, telemetry, threads)
+                page['text'] = PrometheusText(telemetry, hostlabels)
+            except Exception as err:
+                print("Exporter poll failed: {}".format(err))
+            time.sleep(max(0.0, interval - (time.monotonic() - starttime)))
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if (self.path.split('?')[0] != '/metrics'):
+                self.send_error(404)
+                return
+            body = page['text'].encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            verbose("Exporter: " + (format % args))
+
+    try:
+        server = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+    except OSError as err:
+        return "Unable to listen on {}:{}: {}".format(address, port, err)
+    threading.Thread(target=poller, daemon=True).start()
+    print("Serving metrics for {} chassis on http://{}:{}/metrics every {} seconds. Press Ctrl-C to stop.".format(len(telemetry), address, port, interval))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return "Exporter stopped."
+
 def CMCommandHelpFunc(arglist):
     output = "CMCommand Detailed Help\n"
     if (arglist and (len(arglist) > 0)):
@@ -1617,11 +3617,22 @@ CMCommands = {
     'sethiddenconfig': CMSetHiddenConfig,
     'getpsuinfo': CMGetPSUInfo,
     'powercycle': CMPowerCycle,
+    'discover': CMDiscover,
+    'snapshot': CMSnapshot,
+    'querysnapshot': CMQuerySnapshot,
+    'compliance': CMCompliance,
+    'campaign': CMCampaign,
+    'sample': CMSample,
+    'exporter': CMExporter,
+    'ingestlog': CMIngestLog,
+    'querylog': CMQueryLog,
+    'mergelogs': CMMergeLogs,
+    'logstats': CMLogStats,
     'help': CMCommandHelpFunc,
 }
 
 # these commands don't need IPMItool installed
-CMCommandsNoIMPI = ['parselog', 'help']
+CMCommandsNoIMPI = ['parselog', 'querysnapshot', 'ingestlog', 'querylog', 'mergelogs', 'logstats', 'help']
 
 CMCommandHelp = {
     'getversion': 'Gets the CM Config Info.',
@@ -1631,15 +3642,26 @@ CMCommandHelp = {
     'getpasscode': 'Gets the Passcode for Hidden Config Operations. Use -a help for arguments',
     'gethiddenconfig': 'Lists the Hidden Configuration Properties. Use -a help for arguments',
     'getlog': 'Lists the log entries from the CM EEPROM memory. Use -a help for arguments.',
-    'parselog': 'Parse a provided log file from an iDRAC TSR package (named CMLogs.log).',
+    'parselog': 'Parse a provided log file from an iDRAC TSR package (named CMLogs.log), or the TSR zip itself.',
     'setconfig': 'Set ONE CM Config property. Use -a help for arguments.',
     'getfru': 'Gets all the FRU data.',
     'setfru': 'Sets one FRU item. Use -a help for arguments.',
     'saveconfig': 'Saves relevant CM Propertis and FRU Settings to an INI File for reconfigure.',
     'reconfigure': 'Sets all CM Config Properties and FRU items using an INI file.',
-    'sethiddenconfig':'Set ONE CM Hidden Config Property. Use -a help for arguments.',
+    'sethiddenconfig':'Set one or more CM Hidden Config Properties. Use -a help for arguments.',
     'getpsuinfo':'Get the current PSU mismatch status, redundancy configuration, and power output.',
     'powercycle':'Send a powercycle command to the Chassis or a single Sled. Use -a help for arguments.',
+    'discover':'Sweep a CIDR range for iDRACs and write an inventory file of the supported chassis.',
+    'snapshot':'Save the Config, Hidden Config and FRU values of every chassis in an inventory to a snapshot store.',
+    'querysnapshot':'List the chassis in a snapshot store that have the given property values.',
+    'compliance':'Compare every chassis in an inventory to a baseline INI file and list the properties that differ.',
+    'campaign':'SaveConfig or Reconfigure every chassis in an inventory using one archive, with resume. Use -a help for arguments.',
+    'sample':'Poll the sensor and PSU info on an interval and show the min/max/avg over a time window.',
+    'exporter':'Serve the sensor and PSU info of one or more chassis as Prometheus metrics.',
+    'ingestlog':'Add the CM log of every chassis in an inventory, or of TSR packages, to a searchable log store.',
+    'querylog':'Search a log store by chassis, time, severity, component or text.',
+    'mergelogs':'Merge the CM logs of many chassis into one timeline.',
+    'logstats':'Rank the most common CM log messages across many chassis and list the outlier chassis.',
     'help': 'List Detailed Command help information',
 }
 
@@ -1667,7 +3689,11 @@ The GetLog command takes the following optional named arguments (with -a):
     'parselog': """
 The ParseLog command takes a single log file captured from an iDRAC TSR and converys the text Hex codes to readable log data.
     -a logfile=<filename> - The log file from the TSR dump
+    -a tsr=<zipfile or directory> - Read the CM log straight from a TSR zip (nested archives are searched too),
+        or from every TSR zip in a directory using a pool of processes.
     -a outfile=<filename> - An optional output filename.  If not provided will dump to command prompt.
+        With a directory of TSRs this is the output directory, one <tsrname>_CMLogs.txt per TSR (default is the TSR directory).
+    -a processes=<int> - Number of processes for a directory of TSRs (default is the number of CPUs).
     """,
     'setconfig': """
 The SetConfig command takes the following required named arguments (with -a):
@@ -1688,21 +3714,151 @@ settings that would be set back to defaults by a FRU reflash update.
     'reconfigure': """
 The Reconfigure command takes the name of an INI file as input and will apply the CM Config propery
 and FRU Settings values to the target system based on the file input to reset properties that 
-were erased by a CM update. 
+were erased by a CM update.  Only the properties that differ from the current values are written,
+then they are read back to verify.
     -a inifile=<ini file path>  The path to an INI input file.
     """,
     'sethiddenconfig': """
 The SetHiddenConfig command takes the following required named arguments (with -a):
     -a key=<str>      - The 8-byte static key in ascii text.
-    -a passcode=<str> - The 8-byte passcode copied from GetPasscode output.
-    -a <propertyname>=<value> - set the given property by name to the value.  
-        Use the GetHiddenConfig command to see the list of property names.""",
+    -a <propertyname>=<value> - set the given property by name to the value.  Repeat to set more than one
+        property in the same request.  Use the GetHiddenConfig command to see the list of property names.
+and these optional named arguments:
+    -a passcode=<str> - The 8-byte passcode copied from GetPasscode output.  If not given, one is read with
+        GetPasscode and reused while the CM accepts it.
+    -a inventory=<filename> - Set the properties on every host in an inventory file.
+    -a threads=<int>  - Number of concurrent ipmitool sessions with an inventory. Default is 32.""",
     'getpsuinfo':"""
 The GetPSUInfo command does not take any extra arguments.""",
     'powercycle':"""
 The PowerCycle command takes the following named arguments (with -a):
     -a target=<id> - Send the PowerCycle command to the target. If not defined, id = 0. 
     If id==0, powercycle the chassis, else powercycle the sled number <id>.  <id> must be 0-4.""",
+    'discover':"""
+The Discover command sends RMCP presence pings to every address in one or more CIDR ranges, then reads
+the Board PN and Device ID of each iDRAC that answers and writes an inventory INI file, one section per host.
+Hosts whose Board PN is not a supported chassis are left out, -v lists them.
+The inventory file can be passed to the fleet commands with -a inventory=<filename>.
+    -a cidr=<network/bits> - The range to sweep, ex. 192.168.9.0/24. Repeat for more ranges.
+    -a outfile=<filename>  - The inventory file to write.
+    -a timeout=<seconds>   - Optional time to wait for ping responses. Default is 2.
+    -a threads=<int>       - Optional number of concurrent ipmitool sessions. Default is 32.""",
+    'snapshot':"""
+The Snapshot command reads the Config Properties, FRU Settings and optionally the Hidden Config Properties
+of every host in an inventory and adds them as one sweep to a SQLite snapshot store, one row per chassis
+and one column per property.  Columns are named cfg_<name>, hid_<name> and fru_<name>.
+    -a inventory=<filename> - An inventory file from the Discover command or a list of hosts, one per line.
+    -a db=<filename>        - The snapshot store to add to. It is created if it does not exist.
+    -a key=<str>            - Optional 8-byte static key. If given the Hidden Config Properties are saved too.
+    -a threads=<int>        - Optional number of concurrent ipmitool sessions. Default is 32.""",
+    'querysnapshot':"""
+The QuerySnapshot command lists the chassis in a snapshot store that match all the given property values.
+Each property is indexed the first time it is queried, so later queries on it are fast.
+    -a db=<filename>          - The snapshot store written by the Snapshot command.
+    -a sweep=<time>           - Optional sweep time to search. Default is the latest sweep.
+    -a <propertyname>=<value> - Match chassis with this value, ex. -a FTREnable=0. Use cfg_, hid_ or fru_
+        in front of the name to choose the section when a name is in more than one.""",
+    'compliance':"""
+The Compliance command reads every host in an inventory in parallel and compares it to the desired values
+in a baseline INI file.  Only the properties that deviate are reported, grouped by property and the value found.
+The baseline has one section per platform and property group, named <platform>:<section>, ex.
+    [Hubble:ConfigProperties]
+    FTREnable = 1
+    [Lake Austin:FRUSettings]
+    ChassisBoardManufacturer = Dell
+Sections may be ConfigProperties, HiddenConfigProperties or FRUSettings.
+    -a inventory=<filename> - An inventory file from the Discover command or a list of hosts, one per line.
+    -a baseline=<filename>  - The baseline INI file.
+    -a cache=<filename>     - Optional cache of FRU values.  The FRU values of a host are only read again
+        when its ChassisBoardSerialNumber changes.
+    -a key=<str>            - The 8-byte static key, required if the baseline has Hidden Config Properties.
+    -a threads=<int>        - Optional number of concurrent ipmitool sessions. Default is 32.""",
+    'campaign':"""
+The Campaign command runs SaveConfig or Reconfigure on every host in an inventory in parallel.
+Save mode writes the INI file of each host into one zip archive, named <host>.ini.  A host that is already in
+the archive keeps its saved snapshot, delete the archive to take new ones.  Restore mode applies them
+with the same rules as Reconfigure.  The result for each host is kept in <archive>.status.ini, running the same
+command again only retries the hosts that have not succeeded yet.
+    -a mode=<save|restore>  - Save the pre-update snapshots or restore them after the update.
+    -a archive=<filename>   - The zip archive of INI files.
+    -a inventory=<filename> - An inventory file from the Discover command or a list of hosts, one per line.
+        Required to save.  When restoring the default is every host in the archive.
+    -a threads=<int>        - Optional number of concurrent ipmitool sessions. Default is 32.""",
+    'sample':"""
+The Sample command polls GetSensorInfo and GetPSUInfo on an interval and keeps the temperatures, power,
+PSU and fan readings of each chassis in fixed-size ring buffers.  When it stops (after the given number of
+samples or Ctrl-C) it prints the last value and the min/max/avg of each reading over the time window.
+Without an inventory it samples the --host or --wmi target.
+    -a inventory=<filename> - Optional inventory file from the Discover command or a list of hosts, one per line.
+    -a interval=<seconds>   - Time between samples. Default is 10.
+    -a samples=<int>        - Number of samples to take. Default is 0, run until Ctrl-C.
+    -a history=<int>        - Number of samples kept per reading. Default is 360.
+    -a window=<seconds>     - The time window of the min/max/avg summary. Default is 300.
+    -a recent=<int>         - Optional number of recent values to list for each reading.
+    -a threads=<int>        - Optional number of concurrent ipmitool sessions. Default is 32.""",
+    'exporter':"""
+The Exporter command serves the GetSensorInfo and GetPSUInfo readings in Prometheus text format at
+http://<address>:<port>/metrics.  A background poller reads the chassis on an interval and a scrape returns
+the last values read, it never waits for ipmitool.  The metrics are labeled with the host, board_pn,
+platform and service_tag of each chassis.  Without an inventory it exports the --host or --wmi target.
+    -a inventory=<filename> - Optional inventory file from the Discover command or a list of hosts, one per line.
+    -a address=<ip>         - The address to listen on. Default is 127.0.0.1.
+    -a port=<int>           - The port to listen on. Default is 9723.
+    -a interval=<seconds>   - Time between polls. Default is 30.
+    -a threads=<int>        - Optional number of concurrent ipmitool sessions. Default is 32.""",
+    'ingestlog':"""
+The IngestLog command splits CM log lines into timestamp, severity, component and message and adds them to
+a SQLite log store, indexed by host and time with a full text index of the lines.  A log line that is
+already in the store (same host, log offset and content) is not added again, so ingests can be repeated.
+One source is required:
+    -a inventory=<filename> - Read the CM log of every host in an inventory file over ipmitool.
+    -a logfile=<filename>   - A CMLogs.log file from a TSR.
+    -a tsr=<zipfile or directory> - A TSR zip, or a directory of them.  The host is the TSR file name.
+    -a db=<filename>        - The log store to add to. It is created if it does not exist.
+    -a host=<name>          - Optional host name for a logfile or a single TSR.
+    -a platform=<name>      - Optional platform name for a logfile or TSR.
+    -a threads=<int>        - Optional number of concurrent ipmitool sessions. Default is 32.""",
+    'querylog':"""
+The QueryLog command lists the log lines in a log store that match all the given filters, oldest first.
+    -a db=<filename>        - The log store written by the IngestLog command.
+    -a host=<name>          - Only this host.
+    -a platform=<name>      - Only this platform.
+    -a severity=<name>      - CRITICAL, ERROR, WARNING, INFO or DEBUG.
+    -a component=<name>     - The component named in the line, ex. PSU1 or FAN3.
+    -a since=<time>         - Lines at or after YYYY-MM-DD[ HH:MM:SS], or a time ago like 7d, 12h or 30m.
+    -a until=<time>         - Lines at or before the time.
+    -a text=<words>         - Full text search of the lines, ex. -a text="PSU mismatch".
+    -a limit=<int>          - Maximum lines to show. Default is 100.""",
+    'mergelogs':"""
+The MergeLogs command merges the CM logs of many chassis into one timeline ordered by time, reading every log
+as a stream so any number of logs can be merged.  Each log must be in time order, a line without a timestamp
+keeps the time of the line before it.  Log files are named for their host, ex. <host>.txt,
+or CM_log_<servicetag>_<host>_<timestamp>.txt as written by cm_log_read.
+    -a logfile=<filename>   - A log file written by GetLog or ParseLog. Repeat for more files.
+    -a dir=<directory>      - Merge every file in the directory.
+    -a db=<filename>        - Merge the lines of a log store written by IngestLog. Repeat for more stores.
+    -a since=<time>         - Lines at or after YYYY-MM-DD[ HH:MM:SS], or a time ago like 7d, 12h or 30m.
+    -a until=<time>         - Lines at or before the time.
+    -a platform=<name>      - Only chassis of this platform.
+    -a inventory=<filename> - The inventory file from the Discover command with the platform of each host,
+        required to filter log files by platform.
+    -a outfile=<filename>   - Optional output file. If not provided will dump to command prompt.""",
+    'logstats':"""
+The LogStats command reads the CM logs of many chassis in one pass and ranks the most common messages.
+Numbers, hex values and IP addresses in a message are replaced with <n>, <hex> and <ip> to make its template,
+so ex. "PSU1 mismatch" and "PSU2 mismatch" count as "PSU<n> mismatch".  Counts come from a fixed size
+count-min sketch, they can be a little high but never low.  Each template shows its count per platform, and
+templates with no lines before the new time are marked new.  Chassis with many more log lines than the rest
+are listed as outliers.
+    -a logfile=<filename>   - A log file written by GetLog or ParseLog, named for its host. Repeat for more files.
+    -a dir=<directory>      - Read every file in the directory.
+    -a db=<filename>        - Read the lines of a log store written by IngestLog. Repeat for more stores.
+    -a inventory=<filename> - The inventory file from the Discover command with the platform of each host.
+    -a since=<time>         - Lines at or after YYYY-MM-DD[ HH:MM:SS], or a time ago like 7d, 12h or 30m.
+    -a until=<time>         - Lines at or before the time.
+    -a new=<time>           - Templates first seen at or after this time are new. Default is 7d.
+    -a top=<int>            - The number of templates to list. Default is 20.
+    -a outliers=<float>     - Standard deviations above the average line count for an outlier. Default is 3.""",
     'help': """
 The Help command may take arguments with -a to name specific commands.
     Ex:    -a GetVersion -a GetConfig
@@ -1726,7 +3882,10 @@ def check_ipmitool():
     return True
     
 def call_ipmitool(arguments):
-    if (args.wmi):
+    target = getattr(ipmi_target, 'host', None)
+    if (target):
+        cmdline = "ipmitool -I lanplus -H {} -U {} -P {} raw {}".format(target, args.user, args.password, arguments)
+    elif (args.wmi):
         cmdline = "ipmitool -I wmi raw {}".format(arguments)
     elif (args.host):
         cmdline = "ipmitool -I lanplus -H {} -U {} -P {} raw {}".format(args.host, args.user, args.password, arguments)
@@ -1743,6 +3902,47 @@ def call_ipmitool(arguments):
     print(stderr.decode('utf-8'))
     return ""  # no return bytes means a failed connection
 
+# Run func(host) for each host in a pool of threads with call_ipmitool pointed at that host.
+# Returns a dict of host: result, or host: error string if func raised an exception.
+# oncomplete(host, result) is called from this thread as each host finishes.
+def CallOnHosts(hostlist, func, threads=fleet_threads, oncomplete=None):
+    def worker(host):
+        ipmi_target.host = host
+        try:
+            return func(host)
+        finally:
+            ipmi_target.host = None
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        futures = {pool.submit(worker, host): host for host in hostlist}
+        for future in concurrent.futures.as_completed(futures):
+            host = futures[future]
+            try:
+                results[host] = future.result()
+            except Exception as err:
+                results[host] = "Exception: {}".format(err)
+            if (oncomplete):
+                oncomplete(host, results[host])
+    return results
+
+# Read an inventory file written by the Discover command (one section per host)
+# or a plain text file with one host per line.
+def ReadInventory(filename):
+    inventory = configparser.ConfigParser()
+    try:
+        inventory.read(filename)
+        return inventory.sections()
+    except configparser.MissingSectionHeaderError:
+        pass
+    hostlist = []
+    with open(filename) as hostfile:
+        for line in hostfile:
+            line = line.split('#')[0].strip()
+            if (line):
+                hostlist.append(line)
+    return hostlist
+
 def CallCommand(command, arglist):
     func = CMCommands.get(command.lower(), None)
     result = ""
@@ -1755,6 +3955,11 @@ def CallCommand(command, arglist):
             print("{} - {}".format(cmdname, CMCommandHelp[cmdname]))
     return result
 
+# progress messages are only shown when talking to one host, the fleet commands run many at once
+def progress(message, end='\n'):
+    if (not getattr(ipmi_target, 'host', None)):
+        print(message, end=end)
+
 def verbose(*args):
     if print_verbose:
         for arg in args:
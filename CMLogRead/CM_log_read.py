@@ -1,22 +1,26 @@
 import time
 import base64
 import sys
-import re 
+import re
 import platform
 import os
-
-line1 = ''
-line = 0
-line2 = ''
-offset = 0
-log_cnt = 0
+import argparse
+import configparser
+import glob
+import threading
+import concurrent.futures
 
 import subprocess
-if (len(sys.argv) < 3):
-    print("Usage: cm_log_read <iDrac IP address> <username, eg root> <password>")
-    sys.exit(1)
-    
-result = []
+
+usage = """Usage: cm_log_read <iDrac IP address> <username, eg root> <password>
+   or: cm_log_read -i <inventory file> <username> <password>"""
+
+# 64 bytes per CM log block
+log_block_bytes = 64
+progress_interval = 5  # seconds between progress summaries when reading more than one host
+
+cmdfirstget = "0x6 0x34 0x45 0x70 0x28 0xc8 0x20 0x0 0x10 0x1 0xff"
+cmdservicetag = "0x6 0x34 0x45 0x70 0x28 0xc8 0x20 0x0 0x11 0x0 0x39 0x1 0x9 0xd8"  # FRU ChassisServiceTag at 0x139
 
 def check_ipmitool():
     if (os.name == 'nt'):
@@ -34,8 +38,8 @@ def check_ipmitool():
         return False
     return True
 
-def call_ipmitool(arguments):
-    cmdline = "ipmitool -I lanplus -H {} -U {} -P {} raw {}".format(sys.argv[1], sys.argv[2], sys.argv[3], arguments)
+def call_ipmitool(host, user, password, arguments):
+    cmdline = "ipmitool -I lanplus -H {} -U {} -P {} raw {}".format(host, user, password, arguments)
     #print("ipmi cmd = {}".format(cmdline))
     child = subprocess.Popen(cmdline,cwd='.',shell=True,
         stdout=subprocess.PIPE,stderr=subprocess.PIPE, stdin=subprocess.PIPE)
@@ -45,28 +49,47 @@ def call_ipmitool(arguments):
     print(stderr.decode('utf-8'))
     return ""  # no return bytes means a failed connection
 
-if (not check_ipmitool()):
-    print("ipmitool was not found in the system path.  Please install it and make sure it is in the path.")
-    sys.exit(1)
-    
+# one host per section of a CMCommand Discover inventory, or one host per line
+def read_inventory(filename):
+    inventory = configparser.ConfigParser()
+    try:
+        inventory.read(filename)
+        return inventory.sections()
+    except configparser.MissingSectionHeaderError:
+        pass
+    hostlist = []
+    with open(filename) as hostfile:
+        for line in hostfile:
+            line = line.split('#')[0].strip()
+            if (line):
+                hostlist.append(line)
+    return hostlist
 
-cmdfirstget = "0x6 0x34 0x45 0x70 0x28 0xc8 0x20 0x0 0x10 0x1 0xff"
-    
-line = call_ipmitool(cmdfirstget)
-if (not line):
-    print ("Failed to execute ipmitool")
-    sys.exit(0)
-    
-log_cnt = (int((line[25:27]) + (line[22:24]),16))
-print("There are {} bytes in the CM log".format(log_cnt))
-
-f= open("CM_log.txt","w+")
-
-while (offset < log_cnt):
-    #win_cmd = "ipmitool -I lanplus -H 192.168.9.21 -U root -P calvin raw 0x6 0x34 0x45 0x70 0x28 0xc8 0x20 0x0 0x11 0x1 0x" + (format(offset,'04x'))[2:] + " 0x" + str(format(offset,'04x'))[:-2] + " 0x40 0xff"
+def get_service_tag(host, user, password):
+    outbytes = call_ipmitool(host, user, password, cmdservicetag).split()
+    if (len(outbytes) < 9):
+        return ""
+    tag = ""
+    for mybyte in outbytes[8:-1]:
+        try:
+            tag += bytes.fromhex(mybyte).decode('ascii')
+        except ValueError:
+            return ""
+    # only keep characters that are safe in a file name
+    return re.sub(r'[^A-Za-z0-9]', '', tag)
+
+def get_log_count(host, user, password):
+    line = call_ipmitool(host, user, password, cmdfirstget)
+    if (not line):
+        return -1
+    return (int((line[25:27]) + (line[22:24]),16))
+
+def read_log_block(host, user, password, offset):
     cmdnextget = "0x6 0x34 0x45 0x70 0x28 0xc8 0x20 0x0 0x11 0x1 0x{} 0x{} 0x40 0xff".format((format(offset,'04x'))[2:], str(format(offset,'04x'))[:-2] )
 
-    ipmiout = call_ipmitool(cmdnextget)
+    ipmiout = call_ipmitool(host, user, password, cmdnextget)
+    if (not ipmiout):
+        return None
     line2 = ("")
     for line in ipmiout:
         line1 = str(line)
@@ -81,13 +104,131 @@ while (offset < log_cnt):
     line2 = line2.replace('\r', "")
     line2 = line2.replace('\n', "")
     line2 = line2.upper()
-    line2 = line2[16:-2] 
-    ascii_string = ""
-    ascii_string = str(base64.b16decode(line2))[2:-1]
-    line2 = ("")
-    print (ascii_string)
-    f.write(ascii_string)
-    f.write("\n")
-    offset += 64
+    line2 = line2[16:-2]
+    return str(base64.b16decode(line2))[2:-1]
+
+# Find the partial log of an earlier run for this chassis and keep only its complete lines.
+# Returns the file name and the number of blocks already in it, or (None, 0) if there isn't one.
+def find_partial_log(outdir, name):
+    partials = sorted(glob.glob(os.path.join(outdir, "CM_log_{}_*.txt.part".format(name))))
+    if (not partials):
+        return None, 0
+    partname = partials[-1]
+    with open(partname, 'r+') as partfile:
+        data = partfile.read()
+        complete = data.rfind('\n') + 1
+        partfile.seek(complete)
+        partfile.truncate()
+    return partname, data[:complete].count('\n')
+
+# status of each host for the progress summary:
+# host: [blocks done, total blocks, start time, file name, error, blocks resumed from an earlier run]
+status = {}
+status_lock = threading.Lock()
+
+def collect_log(host, user, password, outdir, echo=False):
+    with status_lock:
+        status[host] = [0, 0, time.time(), "", "", 0]
+
+    log_cnt = get_log_count(host, user, password)
+    if (log_cnt < 0):
+        status[host][4] = "Failed to execute ipmitool"
+        return status[host]
+    # files are named by service tag and host, MergeLogs matches the host to the Discover inventory
+    name = "{}_{}".format(get_service_tag(host, user, password) or "NOTAG", re.sub(r'[^A-Za-z0-9.-]', '_', host))
+
+    partname, done = find_partial_log(outdir, name)
+    if (partname):
+        print("{}: resuming {} after {} blocks".format(host, partname, done))
+    else:
+        partname = os.path.join(outdir, "CM_log_{}_{}.txt.part".format(name, time.strftime('%Y%m%d_%H%M%S')))
+    offset = done * log_block_bytes
+    with status_lock:
+        status[host][0:2] = [done, log_cnt // log_block_bytes]
+        status[host][5] = done
+        status[host][3] = partname[:-len('.part')]
+    if (echo):
+        print("There are {} bytes in the CM log".format(log_cnt))
+
+    with open(partname, 'a') as f:
+        while (offset < log_cnt):
+            ascii_string = read_log_block(host, user, password, offset)
+            if (ascii_string is None):
+                status[host][4] = "ipmitool failed at offset {}, run again to resume".format(offset)
+                return status[host]
+            if (echo):
+                print (ascii_string)
+            f.write(ascii_string)
+            f.write("\n")
+            # keep the partial file up to date so an interrupted read can resume
+            f.flush()
+            offset += log_block_bytes
+            with status_lock:
+                status[host][0] += 1
+    os.replace(partname, status[host][3])
+    return status[host]
+
+def blocks_per_second(done, start, resumed):
+    elapsed = time.time() - start
+    return ((done - resumed) / elapsed) if (elapsed > 0) else 0.0
+
+def print_progress():
+    with status_lock:
+        lines = ["{:20} {:>5}/{:<5} blocks {:6.1f} blocks/sec".format(host, done, total, blocks_per_second(done, start, resumed))
+                 for host, (done, total, start, filename, error, resumed) in sorted(status.items()) if ((done < total) and (not error))]
+    if (lines):
+        print("\n".join(lines))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read the CM log of one iDRAC or of every iDRAC in an inventory.", usage=usage)
+    parser.add_argument('-i', '--inventory', help="An inventory file from CMCommand Discover or a list of hosts, one per line.")
+    parser.add_argument('-o', '--outdir', default='.', help="The directory for the log files. Default is the current directory.")
+    parser.add_argument('-t', '--threads', type=int, default=16, help="The number of iDRACs to read at once. Default is 16.")
+    parser.add_argument('positional', nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if (args.inventory and (len(args.positional) == 2)):
+        user, password = args.positional
+        try:
+            hostlist = read_inventory(args.inventory)
+        except OSError:
+            print("Unable to open {} for reading.".format(args.inventory))
+            sys.exit(1)
+    elif ((not args.inventory) and (len(args.positional) == 3)):
+        host, user, password = args.positional
+        hostlist = [host]
+    else:
+        print(usage)
+        sys.exit(1)
+
+    if (not check_ipmitool()):
+        print("ipmitool was not found in the system path.  Please install it and make sure it is in the path.")
+        sys.exit(1)
+    os.makedirs(args.outdir, exist_ok=True)
+
+    if (len(hostlist) == 1):
+        # one host prints the log as it is read, like before
+        done, total, start, filename, error, resumed = collect_log(hostlist[0], user, password, args.outdir, echo=True)
+        if (error):
+            print (error)
+            sys.exit(1)
+        print("Wrote {} blocks to {}, {:.1f} blocks/sec".format(done, filename, blocks_per_second(done, start, resumed)))
+        sys.exit(0)
 
+    print("Reading the CM log of {} hosts into {}".format(len(hostlist), args.outdir))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.threads)) as pool:
+        futures = [pool.submit(collect_log, host, user, password, args.outdir) for host in hostlist]
+        while (concurrent.futures.wait(futures, timeout=progress_interval).not_done):
+            print_progress()
 
+    failed = 0
+    for host, future in zip(hostlist, futures):
+        if (future.exception()):
+            status[host][4] = "Exception: {}".format(future.exception())
+        done, total, start, filename, error, resumed = status[host]
+        if (error):
+            failed += 1
+            print("{:20} {}".format(host, error))
+        else:
+            print("{:20} {:>5} blocks {:6.1f} blocks/sec  {}".format(host, done, blocks_per_second(done, start, resumed), filename))
+    print("{} hosts read, {} failed.".format(len(hostlist) - failed, failed))
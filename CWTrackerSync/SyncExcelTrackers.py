@@ -12,6 +12,19 @@ import argparse
 import base64
 import configparser
 import datetime
+import operator
+import re
+import struct
+import concurrent.futures
+import csv
+import dataclasses
+import hashlib
+import pickle
+import shutil
+import sqlite3
+import time
+import zipfile
+import xml.etree.ElementTree as ElementTree
 from dataclasses import dataclass
 
 @dataclass
@@ -37,12 +50,258 @@ class Issue:
     eta: str  # can't trust this to be a datetime
     description: str
     ismatched: bool  # will save time in diffing
+    rowhash: str = ""  # hash of the values, set when the sync cache is used
     
+class IssueStore:
+    """The issues of one tracker keyed by id, with secondary indexes on the ticket columns"""
+    indexfields = ('dell_tkt', 'cw_tkt', 'ami_tkt', 'nv_tkt', 'state')
     
+    def __init__(self):
+        self.byid = {}
+        self.rows = []  # every issue in row order, including duplicate ids
+        self.indexes = {field: {} for field in self.indexfields}
+        
+    def add(self, issue):
+        """Add the issue and return the issue already stored with the same id, or None.
+        Lookups by id keep returning the first issue with the id."""
+        existing = self.byid.get(issue.id)
+        if (existing is None):
+            self.byid[issue.id] = issue
+        self.rows.append(issue)
+        for field, index in self.indexes.items():
+            value = getattr(issue, field)
+            if (value is not None):
+                index.setdefault(value, []).append(issue)
+        return existing
+        
+    def get(self, id):
+        return self.byid.get(id)
+        
+    def find(self, field, value):
+        """Return the list of issues with the value in an indexed field"""
+        return self.indexes[field].get(value, [])
+        
+    def __iter__(self):
+        return iter(self.rows)
+        
+    def __len__(self):
+        return len(self.rows)
+    
+class FastReaderUnsupported(Exception):
+    """The workbook uses something the fast reader doesn't handle, read it with openpyxl instead"""
+
+class FastSheetReader:
+    """Streams the values of the active sheet of an .xlsx straight from the sheet XML in the zip.
+    Values are converted the same way openpyxl does with read_only=True and data_only=True."""
+    mainns = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+    relns = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+    pkgrelns = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+    # the openpyxl builtin number formats that are dates or times, 46 is [h]:mm:ss
+    builtindates = {14, 15, 16, 17, 18, 19, 20, 21, 22, 45, 46, 47}
+    builtintimedeltas = {46}
+    formatstrip = re.compile(r'".*?"|\[(?!hh?\]|mm?\]|ss?\])[^\]]*\]')
+    formattimedelta = re.compile(r'\[hh?\](:mm(:ss(\.0*)?)?)?|\[mm?\](:ss(\.0*)?)?|\[ss?\](\.0*)?', re.I)
+    
+    def __init__(self, filename):
+        try:
+            self.archive = zipfile.ZipFile(filename)
+            workbook = ElementTree.fromstring(self.archive.read('xl/workbook.xml'))
+            rels = ElementTree.fromstring(self.archive.read('xl/_rels/workbook.xml.rels'))
+        except (OSError, KeyError, zipfile.BadZipFile, ElementTree.ParseError) as err:
+            raise FastReaderUnsupported(err)
+        if (workbook.tag != self.mainns + 'workbook'):
+            raise FastReaderUnsupported(f"unknown workbook namespace {workbook.tag}")
+        targets = {}
+        parts = {}
+        for rel in rels.iter(self.pkgrelns + 'Relationship'):
+            target = rel.get('Target', '')
+            target = target[1:] if target.startswith('/') else 'xl/' + target
+            targets[rel.get('Id')] = target
+            parts[rel.get('Type', '').rsplit('/', 1)[-1]] = target
+
+        pr = workbook.find(self.mainns + 'workbookPr')
+        self.epoch = datetime.datetime(1899, 12, 30)
+        if ((pr is not None) and (pr.get('date1904') in ('1', 'true'))):
+            self.epoch = datetime.datetime(1904, 1, 1)
+        sheets = workbook.findall(f'{self.mainns}sheets/{self.mainns}sheet')
+        view = workbook.find(f'{self.mainns}bookViews/{self.mainns}workbookView')
+        active = int(view.get('activeTab', 0)) if (view is not None) else 0
+        if (active >= len(sheets)):
+            raise FastReaderUnsupported("the active sheet is missing")
+        self.title = sheets[active].get('name')
+        self.sheetpath = targets.get(sheets[active].get(self.relns + 'id'))
+        if ((not self.sheetpath) or (not self.sheetpath.startswith('xl/worksheets/'))):
+            raise FastReaderUnsupported(f"the active sheet {self.title} is not a worksheet")
+        self.stringspath = parts.get('sharedStrings')
+        self._shared_strings = None
+        self.datestyles, self.timedeltastyles = self.read_styles(parts.get('styles'))
+        
+    def read_styles(self, stylespath):
+        """Return the sets of cell style ids that have date and timedelta number formats"""
+        datestyles = set()
+        timedeltastyles = set()
+        if ((not stylespath) or (stylespath not in self.archive.namelist())):
+            return datestyles, timedeltastyles
+        styles = ElementTree.fromstring(self.archive.read(stylespath))
+        custom = {int(fmt.get('numFmtId')): fmt.get('formatCode', '')
+                  for fmt in styles.iter(self.mainns + 'numFmt')}
+        cellxfs = styles.find(self.mainns + 'cellXfs')
+        for idx, xf in enumerate(cellxfs if (cellxfs is not None) else []):
+            fmtid = int(xf.get('numFmtId', 0))
+            if (fmtid in custom):
+                fmt = custom[fmtid].split(';')[0]
+                if (re.search(r'(?<![_\\])[dmhysDMHYS]', self.formatstrip.sub('', fmt))):
+                    datestyles.add(idx)
+                if (self.formattimedelta.search(fmt)):
+                    timedeltastyles.add(idx)
+            elif (fmtid in self.builtindates):
+                datestyles.add(idx)
+                if (fmtid in self.builtintimedeltas):
+                    timedeltastyles.add(idx)
+        return datestyles, timedeltastyles
+        
+    def text(self, element):
+        """The text of a string item, without the phonetic runs"""
+        value = element.findtext(self.mainns + 't')
+        if (value is None):
+            value = ''.join(run.findtext(self.mainns + 't', '') for run in element.iter(self.mainns + 'r'))
+        return value
+        
+    def shared_strings(self):
+        # only read when the first shared string cell is found
+        if (self._shared_strings is None):
+            self._shared_strings = []
+            if (self.stringspath):
+                with self.archive.open(self.stringspath) as source:
+                    for event, element in ElementTree.iterparse(source):
+                        if (element.tag == self.mainns + 'si'):
+                            self._shared_strings.append(self.text(element))
+                            element.clear()
+        return self._shared_strings
+        
+    def from_excel(self, value, timedelta):
+        if (timedelta):
+            delta = datetime.timedelta(days=value)
+            if (delta.microseconds):
+                delta = datetime.timedelta(seconds=delta.total_seconds() // 1, microseconds=round(delta.microseconds, -3))
+            return delta
+        day, fraction = divmod(value, 1)
+        diff = datetime.timedelta(milliseconds=round(fraction * 86400 * 1000))
+        if ((0 <= value < 1) and (diff.days == 0)):
+            return (datetime.datetime.min + diff).time()
+        if ((0 < value < 60) and (self.epoch.year == 1899)):
+            day += 1
+        return self.epoch + datetime.timedelta(days=day) + diff
+        
+    def value(self, cell):
+        celltype = cell.get('t', 'n')
+        if (celltype == 'inlineStr'):
+            inline = cell.find(self.mainns + 'is')
+            return self.text(inline) if (inline is not None) else None
+        value = cell.findtext(self.mainns + 'v') or None
+        if (value is None):
+            return None
+        if (celltype == 'n'):
+            value = float(value) if (('.' in value) or ('E' in value) or ('e' in value)) else int(value)
+            style = int(cell.get('s', 0))
+            if (style in self.datestyles):
+                try:
+                    return self.from_excel(value, style in self.timedeltastyles)
+                except (OverflowError, ValueError):
+                    return "#VALUE!"
+            return value
+        if (celltype == 's'):
+            return self.shared_strings()[int(value)]
+        if (celltype == 'b'):
+            return bool(int(value))
+        if (celltype in ('str', 'e')):
+            return value
+        if (celltype == 'd'):
+            return datetime.datetime.fromisoformat(value.rstrip('Z'))
+        raise FastReaderUnsupported(f"unknown cell type {celltype}")
+        
+    @staticmethod
+    def column(letters):
+        """Return the 0-based index of a column from its letters"""
+        col = -1
+        for ch in letters:
+            col = ((col + 1) * 26) + (ord(ch) - 64) - 1
+        return col
+        
+    def header(self):
+        """Return the values of every cell of the first row, or an empty list if the first row is blank"""
+        rowtag = self.mainns + 'row'
+        with self.archive.open(self.sheetpath) as source:
+            for event, element in ElementTree.iterparse(source, events=('end',)):
+                if (element.tag != rowtag):
+                    continue
+                if (element.get('r', '1') != '1'):
+                    return []
+                values = {}
+                col = -1
+                for cell in element:
+                    ref = cell.get('r')
+                    col = self.column(ref.rstrip('0123456789')) if ref else col + 1
+                    values[col] = self.value(cell)
+                return [values.get(col) for col in range(max(values, default=-1) + 1)]
+        return []
+        
+    def iter_rows(self, columns, min_row=2):
+        """Yield a list for each row from min_row, the size of the largest column index in columns.
+        Only the 0-based columns listed get values, the others are None."""
+        columns = set(columns)
+        width = max(columns) + 1
+        max_row = None
+        counter = min_row
+        rowidx = 0
+        rowtag = self.mainns + 'row'
+        colindex = {}  # column letters: 0-based index
+        with self.archive.open(self.sheetpath) as source:
+            for event, element in ElementTree.iterparse(source, events=('end',)):
+                if (element.tag == self.mainns + 'dimension'):
+                    bounds = re.findall(r'\d+', element.get('ref', ''))
+                    if (len(bounds) == 2):
+                        max_row = int(bounds[1])
+                    continue
+                if (element.tag != rowtag):
+                    continue
+                rowidx = int(element.get('r')) if element.get('r') else rowidx + 1
+                if ((max_row is not None) and (rowidx > max_row)):
+                    break
+                if (rowidx >= counter):
+                    # some rows are missing
+                    while (counter < rowidx):
+                        counter += 1
+                        yield [None] * width
+                    values = [None] * width
+                    col = -1
+                    for cell in element:
+                        ref = cell.get('r')
+                        if (ref):
+                            letters = ref.rstrip('0123456789')
+                            col = colindex.get(letters)
+                            if (col is None):
+                                col = colindex[letters] = self.column(letters)
+                        else:
+                            col += 1
+                        if (col in columns):
+                            values[col] = self.value(cell)
+                    counter += 1
+                    yield values
+                element.clear()
+        # openpyxl fills in the rows up to the sheet dimension when there are rows past it
+        if ((max_row is not None) and (max_row < rowidx)):
+            while (counter <= max_row):
+                counter += 1
+                yield [None] * width
+
 print_verbose = False
 check_descriptions = False
+check_tickets = False
+similar_threshold = None
 
-#does not include comment fields
+# does not include comment fields
+# the columns are found by name in the header row, these are the columns used when the header doesn't name one
 intheads = {
     'ID': 0,
     'AGE': 1,
@@ -85,36 +344,862 @@ extheads = {
     'ETA': 17,
 }
 
-int_issues = []
-ext_issues = []
+# the Issue field of each tracker column
+headfields = {
+    'ID': 'id',
+    'AGE': 'age',
+    'OPENDATE': 'opendate',
+    'CLOSEDATE': 'closedate',
+    'REQUESTER': 'requester',
+    'OWNER': 'owner',
+    'STATE': 'state',
+    'PRIORITY': 'priority',
+    'TEMP': 'temperature',
+    'ISSUETYPE': 'issuetype',
+    'NEEDBY': 'needby',
+    'DELL_TKT': 'dell_tkt',
+    'CW_TKT': 'cw_tkt',
+    'AMI_TKT': 'ami_tkt',
+    'NV_TKT': 'nv_tkt',
+    'PLATFORM': 'platform',
+    'INTEXT': 'intext',
+    'DESCRIPTION': 'description',
+    'ETA': 'eta',
+}
+
+# the other names each column goes by in the header rows, compared in lowercase with only letters and digits
+headaliases = {
+    'ID': ('id', 'issue id', 'issue', 'cw id'),
+    'AGE': ('age', 'age days', 'days open'),
+    'OPENDATE': ('open date', 'opendate', 'opened', 'date opened', 'created'),
+    'CLOSEDATE': ('close date', 'closedate', 'closed date', 'date closed'),
+    'REQUESTER': ('requester', 'requestor', 'requested by', 'reporter'),
+    'OWNER': ('owner', 'assignee', 'assigned to'),
+    'STATE': ('state', 'status'),
+    'PRIORITY': ('priority', 'pri'),
+    'TEMP': ('temp', 'temperature'),
+    'ISSUETYPE': ('issue type', 'issuetype', 'type'),
+    'NEEDBY': ('need by', 'needby', 'needed by', 'need by date'),
+    'DELL_TKT': ('dell tkt', 'dell ticket', 'dell'),
+    'CW_TKT': ('cw tkt', 'cw ticket', 'coreweave tkt', 'coreweave ticket'),
+    'AMI_TKT': ('ami tkt', 'ami ticket', 'ami id'),
+    'NV_TKT': ('nv tkt', 'nv ticket', 'nvidia tkt', 'nvidia ticket'),
+    'PLATFORM': ('platform', 'system', 'model'),
+    'INTEXT': ('int ext', 'intext', 'internal external'),
+    'DESCRIPTION': ('description', 'desc', 'summary'),
+    'ETA': ('eta', 'est date', 'estimated date'),
+}
+
+ticketfields = ('dell_tkt', 'cw_tkt', 'ami_tkt', 'nv_tkt')
+
+# the fields the diff compares, these can be fixed with --apply
+rulefields = {'state': 'STATE', 'priority': 'PRIORITY', 'temperature': 'TEMP', 'description': 'DESCRIPTION'}
+
+int_issues = IssueStore()
+ext_issues = IssueStore()
+
+# the ingest workers save their output here, the main process prints it in order
+output_lines = None
+
+def output(line):
+    if (output_lines is None):
+        print(line)
+    else:
+        output_lines.append(str(line))
 
 def verbose(*args):
     if print_verbose:
         for arg in args:
-            print(arg)
+            output(arg)
             
 def reporterror(*args):
-    print(f"ERROR: {args}")
+    output(f"ERROR: {args}")
+
+def headername(value):
+    return " ".join(re.findall(r'[a-z0-9]+', str(value).lower()))
+
+def resolveheads(header, heads, name):
+    """Return the column of each field from the names in the header row, or None without the ID or STATE column.
+    A field is found by its aliases, or by the name given in place of the column number in heads.
+    A numbered field the header doesn't name stays at that column, a named one it doesn't have is left out."""
+    names = {}
+    for idx, value in enumerate(header):
+        if (value is not None):
+            names.setdefault(headername(value), idx)
+    columns = {}
+    for head, position in heads.items():
+        if (isinstance(position, str)):
+            wanted = (headername(position),)
+        else:
+            wanted = headaliases.get(head, ()) + (headername(head),)
+        found = next((names[alias] for alias in wanted if (alias in names)), None)
+        if (found is not None):
+            columns[head] = found
+        elif (isinstance(position, str)):
+            reporterror(f"MISSING COLUMN: The {name.lower()} tracker has no {position} column for {head}.")
+        else:
+            output(f"The {name.lower()} tracker header doesn't name the {head} column, using column {position + 1}")
+            columns[head] = position
+    if (('ID' not in columns) or ('STATE' not in columns)):
+        output(f"The {name.lower()} tracker needs the ID and STATE columns")
+        return None
+    verbose(f"{name} columns: " + ", ".join(f"{head}={idx + 1}" for head, idx in columns.items()))
+    return columns
+
+def rowextractor(columns):
+    """Compile the columns into one getter that returns the Issue values of a row padded with
+    (None, row number, False), so a row becomes an Issue with Issue(*extract(row + padding))."""
+    fieldheads = {field: head for head, field in headfields.items()}
+    indexes = []
+    for field in list(Issue.__dataclass_fields__)[:-1]:  # leaves out rowhash
+        if (field == 'row'):
+            indexes.append(-2)
+        elif (field == 'ismatched'):
+            indexes.append(-1)
+        else:
+            indexes.append(columns.get(fieldheads[field], -3))
+    return operator.itemgetter(*indexes)
+
+def ingesttracker(filename, heads, name, fast, verbosemode):
+    """Load and validate the issues of one tracker, run in a worker process.
+    Returns a tuple of Issue field values for each issue and the columns of the tracker, or None if the
+    workbook can't be loaded, and the list of output lines."""
+    global print_verbose, output_lines
+    print_verbose = verbosemode
+    output_lines = []
+    try:
+        return readtracker(filename, heads, name, fast), output_lines
+    finally:
+        output_lines = None
+
+def readtracker(filename, heads, name, fast):
+    reader = None
+    if (fast):
+        reader = fastreader(filename)
+    # verify that the workbook can be loaded
+    if (reader is None):
+        try:
+            wb = openpyxl.load_workbook(filename=filename, read_only=True, data_only=True)
+            verbose(f"{name} WB Sheets:", wb.sheetnames)
+        except:
+            output(f"Problem loading the excel workbook  {filename}")
+            return None
+        wb_sheet = wb.active
+        verbose(f"{name} WB Active Sheet title ", wb_sheet.title)
+        header = next(wb_sheet.iter_rows(max_row=1, values_only=True), ())
+    else:
+        header = reader.header()
+    columns = resolveheads(header, heads, name)
+    if (columns is None):
+        return None
+    if (reader is None):
+        rows = wb_sheet.iter_rows(min_row=2, values_only=True)
+    else:
+        rows = reader.iter_rows(columns.values())
+    extract = rowextractor(columns)
+    width = max(columns.values()) + 1
+
+    # ingest the issues list
+    output(f"Processing {name.lower()} issues list")
+    issues = IssueStore()
+    issuetuples = []
+    rowidx=2
+    for row in rows:
+        if (len(row) < width):
+            row = (*row,) + (None,) * (width - len(row))
+        values = extract((*row, None, rowidx, False))
+        anissue = Issue(*values)
+        if (anissue.id == None):
+            reporterror(f"NO ID: Skipping the issue at row {rowidx} because id is blank.")
+        elif (anissue.state not in ('open', 'closed')): 
+            reporterror(f"INVALID STATE: Skipping the issue at row {rowidx} with id {anissue.id} because state is invalid: {anissue.state}")
+        else:
+            verbose(f"Creating issue at row {rowidx} with id {anissue.id} and state {anissue.state}")
+            existissue = issues.add(anissue)
+            if (existissue):
+                reporterror(f"DUPLICATE ID: The id {anissue.id} at row {rowidx} is already in the list from row {existissue.row}")
+            # columns the tracker doesn't have, like the Int/Ext column of the external tracker, are None
+            if (('AGE' in columns) and (anissue.age == None)):
+                reporterror(f"INVALID AGE: The issue at row {rowidx} with id {anissue.id} has a blank Age field.")
+            if (('OPENDATE' in columns) and (anissue.opendate == None)):
+                reporterror(f"INVALID OPENDATE: The issue at row {rowidx} with id {anissue.id} has a blank Open Date field.")
+            if (anissue.state == 'open'):
+                if (('PRIORITY' in columns) and (anissue.priority == None)):
+                    reporterror(f"INVALID PRIORITY: The issue at row {rowidx} with id {anissue.id} has a blank priority field.")
+                if (('TEMP' in columns) and (anissue.temperature == None)):
+                    reporterror(f"INVALID TEMP: The issue at row {rowidx} with id {anissue.id} has a blank Temperature field.")
+                if (('PLATFORM' in columns) and (anissue.platform == None)):
+                    reporterror(f"INVALID PLATFORM: The issue at row {rowidx} with id {anissue.id} has a blank platform field.")
+                if (('DESCRIPTION' in columns) and (anissue.description == None)):
+                    reporterror(f"INVALID DESCRIPTION: The issue at row {rowidx} with id {anissue.id} has a blank description field.")
+
+            #verbose(anissue)
+            # plain tuples pickle much smaller than the dataclass
+            issuetuples.append(values)
+
+        rowidx += 1
+    return issuetuples, columns
+
+cacheversion = 2
+rowhashskip = ('row', 'ismatched', 'rowhash')  # inserting rows moves issues without changing them
+
+def filehash(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def rowhash(values):
+    """Hash of the values of an issue tuple, without its row number"""
+    fields = [value for field, value in zip(Issue.__dataclass_fields__, values) if (field not in rowhashskip)]
+    return hashlib.sha1(repr(fields).encode()).hexdigest()
+
+def loadcache(filename):
+    """Return the sync cache, a new empty one if the file is missing or from another version"""
+    try:
+        with open(filename, 'rb') as f:
+            cache = pickle.load(f)
+        if (cache.get('version') == cacheversion):
+            return cache
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+        pass
+    return {'version': cacheversion, 'trackers': {}, 'diffs': {}, 'findings': None, 'checks': None, 'time': None}
+
+def savecache(filename, cache):
+    with open(filename + '.tmp', 'wb') as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + '.tmp', filename)
 
-def findissuebyID(issueslist, id):
-    for issue in issueslist:
-        if (issue.id == id):
-            return issue
+def cachedtracker(cache, filename):
+    """Return the cached parse of a tracker if the file is the same as last time, else None"""
+    entry = cache['trackers'].get(os.path.abspath(filename))
+    if (not entry):
+        return None
+    stat = os.stat(filename)
+    if ((entry['size'], entry['mtime']) == (stat.st_size, stat.st_mtime_ns)):
+        return entry
+    if ((entry['size'] == stat.st_size) and (entry['hash'] == filehash(filename))):
+        entry['mtime'] = stat.st_mtime_ns  # saved again without changes
+        return entry
     return None
+
+def diffexternal(issue, in_issue):
+    """Return the errors for an issue of the external tracker and the internal issue with the same id"""
+    errors = []
+    if (not in_issue):
+        errors.append(f"EXT ONLY ISSUE: The id {issue.id} is not copied to the internal issues list.")
+    else:
+        if (in_issue.state != issue.state):
+            errors.append(f"STATE MISMATCH: The id {issue.id} has different states. internal = {in_issue.state} | external = {issue.state}.")
+        if (in_issue.priority != issue.priority):
+            errors.append(f"PRIORITY MISMATCH: The id {issue.id} has different priorities. internal = {in_issue.priority} | external = {issue.priority}.")
+        if (in_issue.temperature != issue.temperature):
+            errors.append(f"TEMP MISMATCH: The id {issue.id} has different temperatures. internal = {in_issue.temperature} | external = {issue.temperature}.")
+        if (check_descriptions and (in_issue.state == 'open') and (in_issue.description != issue.description)):
+            errors.append(f"DESC MISMATCH: The id {issue.id} has different descriptions. internal = {in_issue.description} | external = {issue.description}.")
+    return errors
+
+def diffinternal(in_issue, ext_issue):
+    """Return the errors for an issue of the internal tracker and the external issue with the same id"""
+    errors = []
+    if (in_issue.intext and (in_issue.intext.lower() != 'internal')):
+        if (not ext_issue):
+            errors.append(f"INT ONLY ISSUE: The id {in_issue.id} at row {in_issue.row} is not marked as Internal and is not copied to the external isues list.")
+    return errors
+
+@dataclass
+class Change:
+    tracker: str  # 'internal' or 'external', the tracker that is written
+    row: int  # the row that is written, set when the sheet is saved for copied issues
+    id: str
+    head: str
+    old: object
+    new: object
+    issue: Issue = None  # the issue to copy for an issue missing from the tracker
+
+def readrules(filename):
+    """Read the --apply rules, returns the source of truth of each field and the issues to copy, or None.
     
+    [fields]
+    # the tracker that is right for each field: internal, external or none to leave it alone
+    state = external
+    priority = internal
+    temperature = internal
+    description = internal
     
+    [copy]
+    # copy the EXT ONLY issues to the internal tracker and the INT ONLY issues to the external one
+    ext_only = yes
+    int_only = no
+    
+    [log]
+    changelog = tracker_changes.csv
+    backupdir = .
+    """
+    rules = configparser.ConfigParser(interpolation=None, inline_comment_prefixes=('#', ';'))
+    try:
+        if (not rules.read(filename)):
+            print(f"Unable to open the rules file {filename}")
+            return None
+    except configparser.Error as err:
+        print(f"Problem reading the rules file {filename}: {err}")
+        return None
+    truth = {}
+    for field, value in (rules['fields'].items() if rules.has_section('fields') else []):
+        if (field not in rulefields):
+            print(f"Unknown field {field} in the rules file, the fields are {', '.join(rulefields)}")
+            return None
+        if (value.lower() not in ('internal', 'external', 'none')):
+            print(f"The source of truth for {field} must be internal, external or none, not {value}")
+            return None
+        if (value.lower() != 'none'):
+            truth[field] = value.lower()
+    try:
+        copy = {'ext_only': rules.getboolean('copy', 'ext_only', fallback=False),
+                'int_only': rules.getboolean('copy', 'int_only', fallback=False)}
+    except ValueError as err:
+        print(f"Problem reading the copy rules: {err}")
+        return None
+    changelog = rules.get('log', 'changelog', fallback='tracker_changes.csv')
+    backupdir = rules.get('log', 'backupdir', fallback=None)
+    return truth, copy, changelog, backupdir
+
+def planchanges(truth, copy):
+    """Return the changes that fix the mismatches the diff reports, following the rules"""
+    changes = []
+    for issue in ext_issues:
+        in_issue = int_issues.get(issue.id)
+        if (not in_issue):
+            if (copy['ext_only']):
+                changes.append(Change('internal', None, issue.id, 'ROW', None, f"external row {issue.row}",
+                                      dataclasses.replace(issue, intext='external')))
+            continue
+        # the description of an issue is compared when it's open after its state is fixed
+        state = in_issue.state
+        if ('state' in truth):
+            state = in_issue.state if (truth['state'] == 'internal') else issue.state
+        for field, source in truth.items():
+            if ((field == 'description') and not (check_descriptions and (state == 'open'))):
+                continue  # descriptions are only compared with -d
+            intvalue = getattr(in_issue, field)
+            extvalue = getattr(issue, field)
+            if (intvalue != extvalue):
+                if (source == 'internal'):
+                    changes.append(Change('external', issue.row, issue.id, rulefields[field], extvalue, intvalue))
+                else:
+                    changes.append(Change('internal', in_issue.row, issue.id, rulefields[field], intvalue, extvalue))
+    if (copy['int_only']):
+        for in_issue in int_issues:
+            # a duplicated id is copied once, from its first row
+            if ((int_issues.get(in_issue.id) is in_issue) and diffinternal(in_issue, ext_issues.get(in_issue.id))):
+                changes.append(Change('external', None, in_issue.id, 'ROW', None, f"internal row {in_issue.row}", in_issue))
+    return changes
+
+def applychanges(filename, columns, changes, backupdir):
+    """Write the changes to the active sheet of a tracker with a single save, after making a backup.
+    Returns the backup file name, or None if the workbook couldn't be written."""
+    try:
+        wb = openpyxl.load_workbook(filename=filename)
+    except Exception as err:
+        print(f"Problem loading the excel workbook {filename}: {err}")
+        return None
+    ws = wb.active
+    nextrow = ws.max_row + 1
+    for change in changes:
+        if (change.issue is not None):
+            change.row = nextrow
+            nextrow += 1
+            for head, column in columns.items():
+                ws.cell(row=change.row, column=column + 1, value=getattr(change.issue, headfields[head]))
+        elif (change.head in columns):
+            ws.cell(row=change.row, column=columns[change.head] + 1, value=change.new)
+    base, ext = os.path.splitext(os.path.basename(filename))
+    backup = os.path.join(backupdir or os.path.dirname(filename), f"{base}_backup_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{ext}")
+    try:
+        shutil.copy2(filename, backup)
+        wb.save(filename)
+    except OSError as err:
+        print(f"Problem saving the excel workbook {filename}: {err}")
+        return None
+    return backup
+
+def writechangelog(changelog, changes, files):
+    """Append the changes to the CSV change log"""
+    newlog = not os.path.isfile(changelog)
+    when = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with open(changelog, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if (newlog):
+            writer.writerow(['Time', 'Tracker', 'Row', 'ID', 'Field', 'Old', 'New'])
+        for change in changes:
+            writer.writerow([when, files[change.tracker], change.row, change.id, change.head, change.old, change.new])
+
+# the fields the N-way sync compares across the trackers, the description only with -d
+nwayfields = ('state', 'priority', 'temperature', 'description')
+# ticket values that mean there is no ticket yet, they don't link issues
+placeholdertickets = ('n/a', 'na', 'none', 'tbd', 'tba', '-', '?')
+
+def readnwaytrackers(filename):
+    """Read the N-way tracker list, returns a list of (name, file, heads, ticket), the link fields and the
+    ID namespace of each tracker, or None.
+    Each section is a tracker, the first one is the reference for the matrix. A column is its name in
+    the header row, or a number counted from 0 that is used when the header doesn't name the column.
+    'columns = internal' or 'columns = external' starts from the built-in maps.
+    Issues are matched by the ticket fields in 'link', all of them by default, and by ID between trackers
+    with the same 'ids' namespace. The built-in maps share the cw namespace, the other trackers default
+    to their own, so an AMI ID is never matched to an internal ID.
+    'ticket' is the ticket field the issues of the tracker are known by in the other trackers,
+    an issue with that ticket set is expected in the tracker.
+    
+    [DEFAULT]
+    link = cw_tkt, ami_tkt, nv_tkt
+    
+    [Internal]
+    file = CW_internal.xlsx
+    columns = internal
+    
+    [AMI]
+    file = AMI_export.xlsx
+    ticket = ami_tkt
+    ID = AMI ID
+    AMI_TKT = AMI ID
+    STATE = Status
+    PRIORITY = 4
+    CW_TKT = CW Ticket
+    """
+    config = configparser.ConfigParser(interpolation=None, inline_comment_prefixes=('#', ';'))
+    try:
+        if (not config.read(filename)):
+            print(f"Unable to open the tracker list {filename}")
+            return None
+    except configparser.Error as err:
+        print(f"Problem reading the tracker list {filename}: {err}")
+        return None
+    linkfields = tuple(field.strip() for field in config.defaults().get('link', ', '.join(ticketfields)).split(',') if field.strip())
+    for field in linkfields:
+        if (field not in ticketfields):
+            print(f"Unknown link field {field}, the ticket fields are {', '.join(ticketfields)}")
+            return None
+    trackers = []
+    idspaces = []
+    for name in config.sections():
+        section = config[name]
+        builtin = {'internal': intheads, 'external': extheads, None: {}}
+        if (section.get('columns') not in builtin):
+            print(f"{name}: columns must be internal or external, not {section.get('columns')}")
+            return None
+        heads = dict(builtin[section.get('columns')])
+        for key, value in section.items():
+            if (key.upper() in headfields):
+                # a column number, or the name of the column in the header row
+                heads[key.upper()] = int(value) if value.strip().isdigit() else value
+            elif (key not in ('file', 'columns', 'ticket', 'link', 'ids')):
+                print(f"{name}: unknown column {key.upper()}, the columns are {', '.join(headfields)}")
+                return None
+        if (('ID' not in heads) or ('STATE' not in heads)):
+            print(f"{name}: the ID and STATE columns are required")
+            return None
+        if (not section.get('file')) or (not os.path.isfile(section.get('file'))):
+            print(f"{name}: the tracker file {section.get('file')} does not exist")
+            return None
+        if (section.get('ticket') not in ticketfields + (None,)):
+            print(f"{name}: ticket must be one of {', '.join(ticketfields)}, not {section.get('ticket')}")
+            return None
+        trackers.append((name, section.get('file'), heads, section.get('ticket')))
+        idspaces.append(section.get('ids', 'cw' if section.get('columns') else name))
+    if (len(trackers) < 2):
+        print(f"The tracker list {filename} needs at least two trackers")
+        return None
+    return trackers, linkfields, idspaces
+
+def nwaygroups(stores, linkfields, idspaces):
+    """Group the issues of all the trackers that share a value in one of the link fields, or an ID in
+    the same ID namespace.  Placeholder tickets like N/A or TBD don't link anything.
+    Returns a list of groups in the order they are first seen, each a list of (tracker index, issue)."""
+    parent = {}
+    def find(node):
+        while (parent[node] != node):
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+    # every issue and every key is a node, an issue joins the nodes of its keys
+    for index, store in enumerate(stores):
+        for issue in store:
+            node = (index, issue.row)
+            parent[node] = node
+            keys = [(field, ticketkey(getattr(issue, field))) for field in linkfields]
+            keys.append((('id', idspaces[index]), ticketkey(issue.id)))
+            for key in keys:
+                if ((not key[1]) or (key[1].lower() in placeholdertickets)):
+                    continue
+                if (key not in parent):
+                    parent[key] = node
+                else:
+                    root = find(key)
+                    if (root != find(node)):
+                        parent[find(node)] = root
+    groups = {}
+    for index, store in enumerate(stores):
+        for issue in store:
+            groups.setdefault(find((index, issue.row)), []).append((index, issue))
+    return list(groups.values())
+
+def nwaymatrix(trackers, stores, trackercolumns, linkfields, idspaces):
+    """Return the discrepancy matrix of the trackers, one row per issue and field that don't agree.
+    Each row is the issue, the field and a cell for each tracker.  Every issue of a group is compared,
+    a tracker with more than one issue in the group shows the value of each of its rows."""
+    matrix = []
+    for group in nwaygroups(stores, linkfields, idspaces):
+        members = [[] for tracker in trackers]
+        for index, issue in group:
+            members[index].append(issue)
+        label = str(group[0][1].id)
+        cells = ["-" if (not issues) else ", ".join(f"row {issue.row}" for issue in issues) for issues in members]
+        # an issue with a ticket in another tracker's ticket field should be in that tracker
+        missing = False
+        for (name, filename, heads, ticket), issues in zip(trackers, members):
+            if (ticket and (not issues) and any(getattr(issue, ticket) for index, issue in group)):
+                missing = True
+        if (missing or any((len(issues) > 1) for issues in members)):
+            matrix.append([label, 'rows'] + cells)
+        for field in nwayfields:
+            if ((field == 'description') and (not check_descriptions)):
+                continue
+            head = next(head for head, issuefield in headfields.items() if (issuefield == field))
+            values = set()
+            fieldcells = []
+            for columns, issues in zip(trackercolumns, members):
+                if ((not issues) or (head not in columns)):
+                    fieldcells.append("-")
+                    continue
+                values.update(repr(getattr(issue, field)) for issue in issues)
+                if (len(issues) == 1):
+                    fieldcells.append(str(getattr(issues[0], field)))
+                else:
+                    fieldcells.append(", ".join(f"row {issue.row}: {getattr(issue, field)}" for issue in issues))
+            if (len(values) > 1):
+                matrix.append([label, field] + fieldcells)
+    return matrix
+
+def printmatrix(header, matrix, width=40):
+    """Print the matrix as a table, cells longer than width are cut"""
+    rows = [[cell if (len(cell) <= width) else cell[:width - 3] + "..." for cell in map(str, row)] for row in [header] + matrix]
+    widths = [max(len(row[col]) for row in rows) for col in range(len(header))]
+    for row in rows:
+        print("  ".join(cell.ljust(colwidth) for cell, colwidth in zip(row, widths)).rstrip())
+
+def nwaysync(filename, fast):
+    """Load every tracker in the tracker list at once and print one discrepancy matrix"""
+    config = readnwaytrackers(filename)
+    if (config is None):
+        return 1
+    trackers, linkfields, idspaces = config
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(trackers), os.cpu_count() or 1)) as pool:
+        futures = [pool.submit(ingesttracker, trackerfile, heads, name, fast, print_verbose)
+                   for name, trackerfile, heads, ticket in trackers]
+    stores = []
+    trackercolumns = []
+    for future in futures:
+        result, lines = future.result()
+        for line in lines:
+            print(line)
+        if (result is None):
+            return 1
+        issuetuples, columns = result
+        trackercolumns.append(columns)
+        store = IssueStore()
+        for values in issuetuples:
+            store.add(Issue(*values))
+        stores.append(store)
+    print(f"Checking for differences between {', '.join(name for name, trackerfile, heads, ticket in trackers)}")
+    matrix = nwaymatrix(trackers, stores, trackercolumns, linkfields, idspaces)
+    if (matrix):
+        printmatrix(['ISSUE', 'FIELD'] + [name for name, trackerfile, heads, ticket in trackers], matrix)
+    print(f"{len(matrix)} discrepancies in {len(set(row[0] for row in matrix))} issues")
+    return 0
+
+def ticketkey(value):
+    """The same ticket can be a number in one tracker and text in the other"""
+    return None if (value is None) else str(value).strip()
+
+def difftickets():
+    """Return the errors for the ticket references of both trackers, from the ticket indexes of the issue stores.
+    A ticket referenced by more than one id, or an id with different tickets in the two trackers, is an error."""
+    errors = []
+    for field in ticketfields:
+        references = {}
+        for tracker, store in (('internal', int_issues), ('external', ext_issues)):
+            for value, issues in store.indexes[field].items():
+                references.setdefault(ticketkey(value), []).extend((tracker, issue) for issue in issues)
+        for value, issues in references.items():
+            if (value and (len(set(issue.id for tracker, issue in issues)) > 1)):
+                where = ", ".join(f"{issue.id} at {tracker} row {issue.row}" for tracker, issue in issues)
+                errors.append(f"SHARED TICKET: The {field} {value} is referenced by more than one id: {where}.")
+    for in_issue in int_issues.byid.values():
+        issue = ext_issues.get(in_issue.id)
+        if (not issue):
+            continue
+        for field in ticketfields:
+            if (ticketkey(getattr(in_issue, field)) != ticketkey(getattr(issue, field))):
+                errors.append(f"TICKET MISMATCH: The id {issue.id} has different {field} tickets. internal = {getattr(in_issue, field)} | external = {getattr(issue, field)}.")
+    return errors
+
+# near-duplicate descriptions are compared by their sets of 5 character shingles, estimated with
+# 64 MinHash values that are split into LSH bands so only descriptions sharing a band are compared
+similarshingle = 5
+similarhashes = 64
+shinglehashes = {}  # shingle: its MinHash hashes, shingles repeat a lot between descriptions
+
+def shingles(text):
+    return {text[idx:idx + similarshingle] for idx in range(max(1, len(text) - similarshingle + 1))}
+
+def minhash(shingleset):
+    """Return the smallest of each of the hashes of the shingles. All the hashes of a shingle come from one
+    SHAKE-128 digest, and the minimums are taken in C with map(min) over the shingles' hashes zipped together."""
+    rows = []
+    for shingle in shingleset:
+        hashes = shinglehashes.get(shingle)
+        if (hashes is None):
+            hashes = shinglehashes[shingle] = struct.unpack(f'<{similarhashes}I', hashlib.shake_128(shingle.encode()).digest(4 * similarhashes))
+        rows.append(hashes)
+    return list(map(min, zip(*rows)))
+
+def lshrows(threshold):
+    """Return the rows per band with the highest LSH threshold that is still well below the similarity
+    threshold, so nearly all the pairs above it share a band"""
+    best = 1
+    for rows in range(1, similarhashes + 1):
+        if ((similarhashes % rows == 0) and ((rows / similarhashes) ** (1 / rows) <= threshold * 0.8)):
+            best = rows
+    return best
+
+def findsimilar(threshold):
+    """Return the errors for issues with different ids whose descriptions are at least threshold alike,
+    within and across both trackers"""
+    errors = []
+    texts = {}  # normalized description: the issues with it
+    for tracker, store in (('internal', int_issues), ('external', ext_issues)):
+        for issue in store.byid.values():
+            if (issue.description):
+                texts.setdefault(headername(issue.description), []).append((tracker, issue))
+    texts.pop("", None)
+    def where(issues):
+        return ", ".join(f"{issue.id} at {tracker} row {issue.row}" for tracker, issue in issues)
+    for issues in texts.values():
+        if (len(set(issue.id for tracker, issue in issues)) > 1):
+            errors.append(f"SIMILAR DESCRIPTION: {where(issues)} have the same description.")
+
+    textlist = list(texts)
+    shinglesets = [shingles(text) for text in textlist]
+    rows = lshrows(threshold)
+    buckets = {}
+    for idx, shingleset in enumerate(shinglesets):
+        hashes = minhash(shingleset)
+        for band in range(0, similarhashes, rows):
+            buckets.setdefault((band, tuple(hashes[band:band + rows])), []).append(idx)
+    candidates = set()
+    for members in buckets.values():
+        for pos, first in enumerate(members):
+            for second in members[pos + 1:]:
+                candidates.add((first, second))
+    for first, second in sorted(candidates):
+        similarity = len(shinglesets[first] & shinglesets[second]) / len(shinglesets[first] | shinglesets[second])
+        issues = texts[textlist[first]] + texts[textlist[second]]
+        # a description that was edited in one tracker is a DESC MISMATCH, not a duplicate
+        if ((similarity >= threshold) and (len(set(issue.id for tracker, issue in issues)) > 1)):
+            errors.append(f"SIMILAR DESCRIPTION: The descriptions of {where(texts[textlist[first]])} and "
+                          f"{where(texts[textlist[second]])} are {similarity:.0%} alike.")
+    return errors
+
+# every run adds the issues of both trackers to the history, the reports are SQL over the history
+historyschema = """
+CREATE TABLE IF NOT EXISTS run (
+    runtime TEXT PRIMARY KEY,
+    internal TEXT,
+    external TEXT
+);
+CREATE TABLE IF NOT EXISTS issue (
+    tracker TEXT NOT NULL,
+    id TEXT NOT NULL,
+    runtime TEXT NOT NULL,
+    state TEXT,
+    priority TEXT,
+    temperature TEXT,
+    owner TEXT,
+    needby TEXT,
+    eta TEXT,
+    PRIMARY KEY (tracker, id, runtime)
+);
+CREATE INDEX IF NOT EXISTS issue_runtime ON issue (runtime, tracker, state);
+"""
+
+# each report is a header and a query, the runs are compared in time order per tracker and id
+historyreports = {
+    'time-in-state': (['TRACKER', 'ID', 'STATE', 'SINCE', 'DAYS'], """
+        WITH marked AS (
+            SELECT tracker, id, runtime, state,
+                   (state IS NOT LAG(state) OVER (PARTITION BY tracker, id ORDER BY runtime)) AS changed
+            FROM issue),
+        streaks AS (
+            SELECT tracker, id, runtime, state,
+                   SUM(changed) OVER (PARTITION BY tracker, id ORDER BY runtime) AS streak
+            FROM marked),
+        latest AS (SELECT MAX(runtime) AS runtime FROM run)
+        SELECT s.tracker, s.id, s.state, MIN(s.runtime),
+               printf('%.1f', julianday(latest.runtime) - julianday(MIN(s.runtime))) AS days
+        FROM streaks s
+        JOIN (SELECT tracker, id, MAX(streak) AS streak FROM streaks GROUP BY tracker, id) current USING (tracker, id, streak)
+        JOIN latest
+        JOIN issue i ON (i.tracker = s.tracker AND i.id = s.id AND i.runtime = latest.runtime)
+        GROUP BY s.tracker, s.id
+        ORDER BY julianday(latest.runtime) - julianday(MIN(s.runtime)) DESC, s.tracker, s.id"""),
+    'priority-churn': (['TRACKER', 'ID', 'CHANGES', 'FIRST', 'CURRENT', 'LAST CHANGE'], """
+        WITH changes AS (
+            SELECT tracker, id, runtime, priority,
+                   LAG(priority) OVER (PARTITION BY tracker, id ORDER BY runtime) AS previous,
+                   ROW_NUMBER() OVER (PARTITION BY tracker, id ORDER BY runtime) AS n,
+                   FIRST_VALUE(priority) OVER (PARTITION BY tracker, id ORDER BY runtime) AS first,
+                   LAST_VALUE(priority) OVER (PARTITION BY tracker, id ORDER BY runtime
+                                              ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS current
+            FROM issue)
+        SELECT tracker, id, SUM((n > 1) AND (priority IS NOT previous)) AS churn, first, current,
+               MAX(CASE WHEN ((n > 1) AND (priority IS NOT previous)) THEN runtime END)
+        FROM changes
+        GROUP BY tracker, id
+        HAVING churn > 0
+        ORDER BY churn DESC, tracker, id"""),
+    'overdue': (['TRACKER', 'ID', 'OWNER', 'PRIORITY', 'NEED BY', 'DAYS OVER'], """
+        WITH latest AS (SELECT MAX(runtime) AS runtime FROM run)
+        SELECT tracker, id, owner, priority, needby, printf('%.1f', julianday(latest.runtime) - julianday(needby)) AS days
+        FROM issue JOIN latest USING (runtime)
+        WHERE (state = 'open') AND (julianday(needby) < julianday(latest.runtime))
+        ORDER BY julianday(needby), tracker, id"""),
+    'throughput': (['TRACKER', 'WEEK', 'OPENED', 'CLOSED', 'OPEN'], """
+        WITH changes AS (
+            SELECT tracker, id, runtime, state,
+                   LAG(state) OVER (PARTITION BY tracker, id ORDER BY runtime) AS previous,
+                   strftime('%Y-%W', runtime) AS week
+            FROM issue),
+        lastruns AS (SELECT strftime('%Y-%W', runtime) AS week, MAX(runtime) AS runtime FROM run GROUP BY week)
+        SELECT tracker, week,
+               -- the first run has nothing to compare to, its issues don't count as opened
+               SUM((state = 'open') AND (previous IS NOT 'open') AND (runtime > (SELECT MIN(runtime) FROM run))),
+               SUM((state = 'closed') AND (previous = 'open')),
+               SUM((state = 'open') AND (runtime = (SELECT runtime FROM lastruns WHERE lastruns.week = changes.week)))
+        FROM changes
+        GROUP BY tracker, week
+        ORDER BY tracker, week"""),
+}
+
+def historyvalue(value):
+    if (value is None):
+        return None
+    if (isinstance(value, datetime.datetime)):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value).strip()
+
+def openhistory(filename):
+    history = sqlite3.connect(filename)
+    history.executescript(historyschema)
+    return history
+
+def recordhistory(filename, files):
+    """Add the issues of both trackers to the history as one run, the first row of a duplicated id is used"""
+    runtime = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    history = openhistory(filename)
+    with history:
+        history.execute("INSERT OR REPLACE INTO run VALUES (?, ?, ?)", (runtime, files['internal'], files['external']))
+        for tracker, store in (('internal', int_issues), ('external', ext_issues)):
+            history.executemany("INSERT OR REPLACE INTO issue VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                ((tracker, historyvalue(issue.id), runtime, issue.state, historyvalue(issue.priority),
+                                  historyvalue(issue.temperature), historyvalue(issue.owner), historyvalue(issue.needby),
+                                  historyvalue(issue.eta)) for issue in store.byid.values()))
+    runs = history.execute("SELECT COUNT(*) FROM run").fetchone()[0]
+    history.close()
+    verbose(f"Added {len(int_issues.byid) + len(ext_issues.byid)} issues to the history in {filename}, {runs} runs")
+
+def historyreport(filename, report):
+    """Print a report from the history"""
+    if (not os.path.isfile(filename)):
+        print(f"The history {filename} does not exist, run a sync with --history first.")
+        return 1
+    history = openhistory(filename)
+    header, query = historyreports[report]
+    rows = history.execute(query).fetchall()
+    history.close()
+    if (rows):
+        printmatrix(header, [["" if (value is None) else str(value) for value in row] for row in rows])
+    print(f"{len(rows)} rows")
+    return 0
+
+def fastreader(filename):
+    """Return the fast reader of a tracker, or None if it can't read the workbook"""
+    try:
+        reader = FastSheetReader(filename)
+    except FastReaderUnsupported as err:
+        verbose(f"Using openpyxl for {filename}, the fast reader can't read it: {err}")
+        return None
+    verbose(f"Fast reader active sheet title {reader.title}")
+    return reader
+
+def benchmarkreaders(filename, heads):
+    """Time reading a tracker with openpyxl and the fast reader and check they return the same values"""
+    start = time.perf_counter()
+    wb = openpyxl.load_workbook(filename=filename, read_only=True, data_only=True)
+    slowrows = [[row[idx] if ((idx in heads.values()) and (idx < len(row))) else None for idx in range(max(heads.values()) + 1)]
+                for row in wb.active.iter_rows(min_row=2, values_only=True)]
+    slowtime = time.perf_counter() - start
+    start = time.perf_counter()
+    reader = fastreader(filename)
+    if (reader is None):
+        print(f"{filename}: openpyxl {len(slowrows)} rows in {slowtime:.3f}s, the fast reader can't read this workbook.")
+        return
+    fastlist = list(reader.iter_rows(heads.values()))
+    fasttime = time.perf_counter() - start
+    same = "same values" if (fastlist == slowrows) else "DIFFERENT VALUES"
+    print(f"{filename}: openpyxl {len(slowrows)} rows in {slowtime:.3f}s, fast reader {len(fastlist)} rows in {fasttime:.3f}s, "
+          f"{slowtime / max(fasttime, 1e-9):.1f}x faster, {same}")
+
 if __name__ == "__main__":
     PARSER = argparse.ArgumentParser(description=__doc__)
     PARSER.add_argument('-v', '--verbose', action='store_true', default=False, help="Print more messages.")
     PARSER.add_argument('-d', '--descriptions', action='store_true', default=False, help="Check for matching descriptions.")
-    PARSER.add_argument('-i', '--internal-tracker', type=str, required=True, help="The filename and path of the Internal Tracker Excel Spreadsheet (.XLSX)")
-    PARSER.add_argument('-e', '--external-tracker', type=str, required=True, help="The filename and path of the Esternal Tracker Excel Spreadsheet (.XLSX)")
+    PARSER.add_argument('-k', '--tickets', action='store_true', default=False, help="Check the Dell, CW, AMI and NV ticket references for tickets shared by several ids and ids with different tickets.")
+    PARSER.add_argument('-s', '--similar', type=float, nargs='?', const=0.8, metavar='THRESHOLD', help="Find issues with different ids and near-duplicate descriptions within and across the trackers. THRESHOLD is how alike the descriptions must be, from 0 to 1, 0.8 by default.")
+    PARSER.add_argument('-H', '--history', type=str, help="Add the state, priority, temperature, owner, need by and ETA of every issue to this SQLite history.")
+    PARSER.add_argument('-r', '--report', choices=sorted(historyreports), help="Print a report from the --history instead of reading the trackers.")
+    PARSER.add_argument('-i', '--internal-tracker', type=str, help="The filename and path of the Internal Tracker Excel Spreadsheet (.XLSX)")
+    PARSER.add_argument('-e', '--external-tracker', type=str, help="The filename and path of the Esternal Tracker Excel Spreadsheet (.XLSX)")
+    PARSER.add_argument('-f', '--fast-reader', action='store_true', default=False, help="Read the trackers straight from the sheet XML, falls back to openpyxl for workbooks it can't read.")
+    PARSER.add_argument('-c', '--cache', type=str, help="Cache the parsed trackers in this file. Unchanged trackers aren't parsed again and only the errors that are new or resolved since the last run are shown.")
+    PARSER.add_argument('-a', '--apply', type=str, help="Fix the mismatches in the trackers following the source of truth rules in this INI file. Each changed tracker is backed up and saved once and the changes are logged.")
+    PARSER.add_argument('-n', '--nway', type=str, help="Compare every tracker in this INI tracker list, each with its own column map, instead of -i and -e.")
+    PARSER.add_argument('--benchmark', action='store_true', default=False, help="Time the fast reader against openpyxl on both trackers and exit.")
     
     args = PARSER.parse_args()
 
     if (sys.version_info.major < 3):
         print("This script requires Python version 3 or higher.  You are running {}.{}".format(sys.version_info.major, sys.version_info.minor))
         sys.exit(1)
+    if (args.verbose):
+        print_verbose = True
+    if (args.descriptions):
+        check_descriptions = True
+    if (args.tickets):
+        check_tickets = True
+    if (args.similar is not None):
+        if (not (0 < args.similar <= 1)):
+            PARSER.error("the similarity threshold must be more than 0 and at most 1")
+        similar_threshold = args.similar
+    if (args.nway):
+        sys.exit(nwaysync(args.nway, args.fast_reader))
+    if (args.report):
+        if (not args.history):
+            PARSER.error("a report needs the --history database")
+        sys.exit(historyreport(args.history, args.report))
+    if ((not args.internal_tracker) or (not args.external_tracker)):
+        PARSER.error("the internal and external trackers are required, or an N-way tracker list")
     # verify file format is XLSX by extension
     if (not '.xlsx' in args.internal_tracker.lower()):
         print("The internal tracker must be in XLSX format.")
@@ -129,158 +1214,154 @@ if __name__ == "__main__":
     if  (not os.path.isfile(args.external_tracker)):
         print("The external tracker file path does not exist.")
         sys.exit(1)
-    if (args.verbose):
-        print_verbose = True
-    if (args.descriptions):
-        check_descriptions = True
         
-    # verify that the workbooks can be loaded
-    try:
-        int_wb = openpyxl.load_workbook(filename=args.internal_tracker, read_only=True, data_only=True)
-        verbose("Internal WB Sheets:", int_wb.sheetnames)
-    except:
-        print("Problem loading the excel workbook ", args,internal_tracker)
-        exit(1)
-    try:
-        ext_wb = openpyxl.load_workbook(filename=args.external_tracker, read_only=True, data_only=True)
-        verbose("External WB Sheets:", ext_wb.sheetnames)
-    except:
-        print("Problem loading the excel workbook ", args,external_tracker)
-        exit(1)
-        
-    int_wb_sheet = int_wb.active
-    verbose("Internal WB Active Sheet title ", int_wb_sheet.title)
-    
-    ext_wb_sheet = ext_wb.active
-    verbose("External WB Active Sheet title ", ext_wb_sheet.title)
-    # ingest the internal issues list
-    print("Processing internal issues list")
-    rowidx=2
-    for introw in int_wb_sheet.iter_rows(min_row=2, values_only=True):
-        if (introw[intheads['ID']] == None):
-            reporterror(f"NO ID: Skipping the issue at row {rowidx} because id is blank.")
-        elif (introw[intheads['STATE']] not in ('open', 'closed')): 
-            reporterror(f"INVALID STATE: Skipping the issue at row {rowidx} with id {introw[intheads['ID']]} because state is invalid: {introw[intheads['STATE']]}")
-        else:
-            verbose(f"Creating issue at row {rowidx} with id {introw[intheads['ID']]} and state {introw[intheads['STATE']]}")
-            existissue = findissuebyID(int_issues, introw[intheads['ID']])
-            if (existissue):
-                reporterror(f"DUPLICATE ID: The id {introw[intheads['ID']]} at row {rowidx} is already in the list from row {existissue.row}")
-            if (introw[intheads['AGE']] == None):
-                reporterror(f"INVALID AGE: The issue at row {rowidx} with id {introw[intheads['ID']]} has a blank Age field.")
-            if (introw[intheads['OPENDATE']] == None):
-                reporterror(f"INVALID OPENDATE: The issue at row {rowidx} with id {introw[intheads['ID']]} has a blank Open Date field.")
-            if (introw[intheads['STATE']] == 'open'):
-                if (introw[intheads['PRIORITY']] == None):
-                    reporterror(f"INVALID PRIORITY: The issue at row {rowidx} with id {introw[intheads['ID']]} has a blank priority field.")
-                if (introw[intheads['TEMP']] == None):
-                    reporterror(f"INVALID TEMP: The issue at row {rowidx} with id {introw[intheads['ID']]} has a blank Temperature field.")
-                if (introw[intheads['PLATFORM']] == None):
-                    reporterror(f"INVALID PLATFORM: The issue at row {rowidx} with id {introw[intheads['ID']]} has a blank platform field.")
-                if (introw[intheads['DESCRIPTION']] == None):
-                    reporterror(f"INVALID DESCRIPTION: The issue at row {rowidx} with id {introw[intheads['ID']]} has a blank description field.")
-
-            anissue = Issue(id=introw[intheads['ID']],
-                row=rowidx,
-                age=introw[intheads['AGE']],
-                opendate=introw[intheads['OPENDATE']],
-                closedate=introw[intheads['CLOSEDATE']],
-                requester=introw[intheads['REQUESTER']],
-                owner=introw[intheads['OWNER']],
-                state=introw[intheads['STATE']],
-                priority=introw[intheads['PRIORITY']],
-                temperature=introw[intheads['TEMP']],
-                issuetype=introw[intheads['ISSUETYPE']],
-                needby=introw[intheads['NEEDBY']],
-                dell_tkt=introw[intheads['DELL_TKT']],
-                cw_tkt=introw[intheads['CW_TKT']],
-                ami_tkt=introw[intheads['AMI_TKT']],
-                nv_tkt=introw[intheads['NV_TKT']],
-                platform=introw[intheads['PLATFORM']],
-                intext=introw[intheads['INTEXT']],
-                eta=None,
-                description=introw[intheads['DESCRIPTION']],
-                ismatched=False                           
-            )
-            #verbose(anissue)
-            int_issues.append(anissue)
+    if (args.benchmark):
+        benchmarkreaders(args.internal_tracker, intheads)
+        benchmarkreaders(args.external_tracker, extheads)
+        sys.exit(0)
 
-        rowidx += 1
-        
-    # ingest the external issues list
-    print("Processing external issues list")
-    rowidx=2
-    for row in ext_wb_sheet.iter_rows(min_row=2, values_only=True):
-        if (row[extheads['ID']] == None):
-            reporterror(f"NO ID: Skipping the issue at row {rowidx} because id is blank.")
-        elif (row[extheads['STATE']] not in ('open', 'closed')): 
-            reporterror(f"INVALID STATE: Skipping the issue at row {rowidx} with id {row[extheads['ID']]} because state is invalid: {row[extheads['STATE']]}")
+    cache = None
+    if (args.cache):
+        cache = loadcache(args.cache)
+
+    # the trackers are independent until the diff, load and validate both at once
+    trackers = [(args.internal_tracker, intheads, 'Internal', int_issues), (args.external_tracker, extheads, 'External', ext_issues)]
+    parsed = {}
+    futures = {}
+    for filename, heads, name, issues in trackers:
+        entry = cachedtracker(cache, filename) if (cache is not None) else None
+        if (entry):
+            verbose(f"Using the cached {name.lower()} issues, {filename} has not changed")
+            parsed[filename] = entry
+    todo = [tracker for tracker in trackers if (tracker[0] not in parsed)]
+    if (todo):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(todo)) as pool:
+            for filename, heads, name, issues in todo:
+                futures[filename] = pool.submit(ingesttracker, filename, heads, name, args.fast_reader, print_verbose)
+
+    # with the cache only the errors that are new or resolved since the last run are shown
+    findings = []
+    for filename, heads, name, issues in trackers:
+        if (filename in futures):
+            result, lines = futures[filename].result()
+            for line in lines:
+                if ((cache is not None) and line.startswith('ERROR: ')):
+                    findings.append(line)
+                else:
+                    print(line)
+            if (result is None):
+                exit(1)
+            issuetuples, columns = result
+            if (cache is not None):
+                stat = os.stat(filename)
+                parsed[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': filehash(filename), 'columns': columns,
+                                    'issues': issuetuples, 'lines': lines, 'rowhashes': [rowhash(values) for values in issuetuples]}
+                cache['trackers'][os.path.abspath(filename)] = parsed[filename]
+            else:
+                parsed[filename] = {'issues': issuetuples, 'columns': columns, 'rowhashes': [""] * len(issuetuples)}
         else:
-            verbose(f"Creating issue at row {rowidx} with id {row[extheads['ID']]} and state {row[extheads['STATE']]}")
-            existissue = findissuebyID(ext_issues, row[extheads['ID']])
-            if (existissue):
-                reporterror(f"DUPLICATE ID: The id {row[extheads['ID']]} at row {rowidx} is already in the list from row {existissue.row}")
-            if (row[extheads['AGE']] == None):
-                reporterror(f"INVALID AGE: The issue at row {rowidx} with id {row[extheads['ID']]} has a blank Age field.")
-            if (row[extheads['OPENDATE']] == None):
-                reporterror(f"INVALID OPENDATE: The issue at row {rowidx} with id {row[extheads['ID']]} has a blank Open Date field.")
-            if (row[extheads['STATE']] == 'open'):
-                if (row[extheads['PRIORITY']] == None):
-                    reporterror(f"INVALID PRIORITY: The issue at row {rowidx} with id {row[extheads['ID']]} has a blank priority field.")
-                if (row[extheads['TEMP']] == None):
-                    reporterror(f"INVALID TEMP: The issue at row {rowidx} with id {row[extheads['ID']]} has a blank Temperature field.")
-                if (row[extheads['PLATFORM']] == None):
-                    reporterror(f"INVALID PLATFORM: The issue at row {rowidx} with id {row[extheads['ID']]} has a blank platform field.")
-                if (row[extheads['DESCRIPTION']] == None):
-                    reporterror(f"INVALID DESCRIPTION: The issue at row {rowidx} with id {row[extheads['ID']]} has a blank description field.")
-    
-            anissue = Issue(id=row[extheads['ID']],
-                row=rowidx,
-                age=row[extheads['AGE']],
-                opendate=row[extheads['OPENDATE']],
-                closedate=row[extheads['CLOSEDATE']],
-                requester=row[extheads['REQUESTER']],
-                owner=row[extheads['OWNER']],
-                state=row[extheads['STATE']],
-                priority=row[extheads['PRIORITY']],
-                temperature=row[extheads['TEMP']],
-                issuetype=row[extheads['ISSUETYPE']],
-                needby=row[extheads['NEEDBY']],
-                dell_tkt=row[extheads['DELL_TKT']],
-                cw_tkt=row[extheads['CW_TKT']],
-                ami_tkt=row[extheads['AMI_TKT']],
-                nv_tkt=row[extheads['NV_TKT']],
-                platform=row[extheads['PLATFORM']],
-                intext=None,
-                eta=row[extheads['ETA']],
-                description=row[extheads['DESCRIPTION']],
-                ismatched=False                           
-            )
-            #verbose(anissue)
-            ext_issues.append(anissue)
+            findings += [line for line in parsed[filename]['lines'] if line.startswith('ERROR: ')]
+        for values, valueshash in zip(parsed[filename]['issues'], parsed[filename]['rowhashes']):
+            anissue = Issue(*values)
+            anissue.rowhash = valueshash
+            issues.add(anissue)
 
-        rowidx += 1
-    
     print("Checking for Internal/External differences")
-    
+
+    # the diff of an issue only changes when its row or the one it's compared to changes
+    diffs = {}
+    previousdiffs = cache['diffs'] if (cache is not None) else {}
     for issue in ext_issues:
-        in_issue = findissuebyID(int_issues, issue.id)
-        if (not in_issue):
-            reporterror(f"EXT ONLY ISSUE: The id {issue.id} is not copied to the internal issues list.")
-        else:
-            if (in_issue.state != issue.state):
-                reporterror(f"STATE MISMATCH: The id {issue.id} has different states. internal = {in_issue.state} | external = {issue.state}.")
-            if (in_issue.priority != issue.priority):
-                reporterror(f"PRIORITY MISMATCH: The id {issue.id} has different priorities. internal = {in_issue.priority} | external = {issue.priority}.")
-            if (in_issue.temperature != issue.temperature):
-                reporterror(f"TEMP MISMATCH: The id {issue.id} has different temperatures. internal = {in_issue.temperature} | external = {issue.temperature}.")
-            if (check_descriptions and (in_issue.state == 'open') and (in_issue.description != issue.description)):
-                reporterror(f"DESC MISMATCH: The id {issue.id} has different descriptions. internal = {in_issue.description} | external = {issue.description}.")
+        in_issue = int_issues.get(issue.id)
+        key = ('ext', issue.rowhash, in_issue.rowhash if in_issue else None, check_descriptions)
+        errors = previousdiffs.get(key) if (cache is not None) else None
+        if (errors is None):
+            errors = diffexternal(issue, in_issue)
+        diffs[key] = errors
+        for error in errors:
+            if (cache is not None):
+                findings.append(f"ERROR: {(error,)}")
+            else:
+                reporterror(error)
     for in_issue in int_issues:
-        if (in_issue.intext and (in_issue.intext.lower() != 'internal')):
-            ext_issue = findissuebyID(ext_issues, in_issue.id)
-            if (not ext_issue):
-                reporterror(f"INT ONLY ISSUE: The id {in_issue.id} at row {in_issue.row} is not marked as Internal and is not copied to the external isues list.")
-                
+        ext_issue = ext_issues.get(in_issue.id)
+        key = ('int', in_issue.rowhash, in_issue.row, ext_issue is not None)
+        errors = previousdiffs.get(key) if (cache is not None) else None
+        if (errors is None):
+            errors = diffinternal(in_issue, ext_issue)
+        diffs[key] = errors
+        for error in errors:
+            if (cache is not None):
+                findings.append(f"ERROR: {(error,)}")
+            else:
+                reporterror(error)
+    # the ticket indexes were built as the issues were added, so this is one pass over them
+    if (check_tickets):
+        for error in difftickets():
+            if (cache is not None):
+                findings.append(f"ERROR: {(error,)}")
+            else:
+                reporterror(error)
+    if (similar_threshold is not None):
+        for error in findsimilar(similar_threshold):
+            if (cache is not None):
+                findings.append(f"ERROR: {(error,)}")
+            else:
+                reporterror(error)
+
+    if (cache is not None):
+        # -d, -k and -s change the errors, only a run with the same checks can be compared
+        checks = (check_descriptions, check_tickets, similar_threshold)
+        if ((cache['findings'] is None) or (cache.get('checks') != checks)):
+            if (cache['findings'] is not None):
+                print(f"The checks are not the same as the last run at {cache['time']}, showing every error")
+            for line in findings:
+                print(line)
+        else:
+            current = set(findings)
+            previous = set(cache['findings'])
+            new = [line for line in findings if (line not in previous)]
+            resolved = [line for line in cache['findings'] if (line not in current)]
+            for line in new:
+                print(f"NEW {line}")
+            for line in resolved:
+                print(f"RESOLVED {line}")
+            print(f"{len(findings)} errors, {len(new)} new and {len(resolved)} resolved since the last run at {cache['time']}")
+        cache['findings'] = findings
+        cache['checks'] = checks
+        cache['diffs'] = diffs
+        cache['time'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        savecache(args.cache, cache)
+
+    # the history has the trackers as they were read, before --apply changes them
+    if (args.history):
+        recordhistory(args.history, {'internal': args.internal_tracker, 'external': args.external_tracker})
+
+    if (args.apply):
+        rules = readrules(args.apply)
+        if (rules is None):
+            sys.exit(1)
+        truth, copy, changelog, backupdir = rules
+        changes = planchanges(truth, copy)
+        if (not changes):
+            print("There are no mismatches to fix")
+            sys.exit(0)
+        files = {'internal': args.internal_tracker, 'external': args.external_tracker}
+        applied = []
+        for tracker, filename in files.items():
+            trackerchanges = [change for change in changes if (change.tracker == tracker)]
+            if (not trackerchanges):
+                continue
+            backup = applychanges(filename, parsed[filename]['columns'], trackerchanges, backupdir)
+            if (backup is None):
+                continue
+            applied += trackerchanges
+            copied = sum(1 for change in trackerchanges if (change.issue is not None))
+            print(f"Fixed {len(trackerchanges) - copied} values and copied {copied} issues in {files[tracker]}, the backup is {backup}")
+        for change in applied:
+            verbose(f"{change.tracker} row {change.row} id {change.id} {change.head}: {change.old} -> {change.new}")
+        writechangelog(changelog, applied, files)
+        if (len(applied) < len(changes)):
+            sys.exit(1)
     sys.exit(0)
 